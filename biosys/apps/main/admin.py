@@ -1,15 +1,24 @@
 from __future__ import absolute_import, unicode_literals, print_function, division
 
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.admin import actions
+from django.contrib.admin.utils import model_ngettext
 from django.contrib.auth import get_user_model
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.forms import UserChangeForm, UserCreationForm
 from django.contrib.auth.validators import UnicodeUsernameValidator, ASCIIUsernameValidator
 from django.contrib.gis.admin import OSMGeoAdmin, GeoModelAdmin
+from django.core.exceptions import PermissionDenied
+from django.utils.encoding import force_text
+from django.utils.translation import ugettext as _
 
 from main import forms
 from main.api.serializers import UsernameValidator
 from main.models import *
+from main.utils_delete import delete_records, delete_dataset, delete_project
+from main.utils_index import get_index_name, sync_dataset_indexes
+from main.utils_links import update_record_links
+from main.utils_summary import add_records_to_summary, remove_records_from_summary, refresh_dataset_summary
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +30,29 @@ class MainAppAdmin(admin.ModelAdmin):
     change_list_template = 'main/main_change_list.html'
 
 
+def delete_selected(modeladmin, request, queryset):
+    """
+    The django delete_selected action with the objects deleted by the delete_queryset of the model admin instead of
+    queryset.delete(), that would leave the record links, the dataset summaries and the media files behind.
+    The confirmation page is still the django one.
+    """
+    if not request.POST.get('post'):
+        return actions.delete_selected(modeladmin, request, queryset)
+    if not modeladmin.has_delete_permission(request):
+        raise PermissionDenied
+    objs = list(queryset)
+    if objs:
+        for obj in objs:
+            modeladmin.log_deletion(request, obj, force_text(obj))
+        modeladmin.delete_queryset(request, queryset)
+        modeladmin.message_user(request, _("Successfully deleted %(count)d %(items)s.") % {
+            "count": len(objs), "items": model_ngettext(modeladmin.opts, len(objs))
+        }, messages.SUCCESS)
+
+
+delete_selected.short_description = actions.delete_selected.short_description
+
+
 class CustomUserChangeForm(UserChangeForm):
     """
     The sole purpose of this class is to override the django model username validation to allow backslash.
@@ -105,6 +137,14 @@ class ProjectAdmin(MainAppAdmin, OSMGeoAdmin):
     search_fields = ['name', 'code']
     openlayers_url = '//static.dbca.wa.gov.au/static/libs/openlayers/2.13.1/OpenLayers.js'
     form = forms.ProjectForm
+    actions = [delete_selected]
+
+    def delete_model(self, request, obj):
+        delete_project(obj)
+
+    def delete_queryset(self, request, queryset):
+        for project in queryset:
+            delete_project(project)
 
 
 @admin.register(Site)
@@ -130,12 +170,63 @@ class DatasetAdmin(MainAppAdmin):
     list_display = ['name', 'project', 'type', 'description']
     list_filter = ['project']
     form = forms.DataSetForm
+    actions = [delete_selected]
+
+    def save_model(self, request, obj, form, change):
+        previous = Dataset.objects.filter(pk=obj.pk).first() if change else None
+        super(DatasetAdmin, self).save_model(request, obj, form, change)
+        if not change:
+            refresh_dataset_summary(obj)
+        if previous is not None and previous.links_descriptor != obj.links_descriptor:
+            update_record_links(obj)
+        # the indexes are built by the worker (see build_pending_indexes)
+        sync_dataset_indexes(obj, build=False)
+
+    def delete_model(self, request, obj):
+        delete_dataset(obj)
+
+    def delete_queryset(self, request, queryset):
+        for dataset in queryset:
+            delete_dataset(dataset)
+
+
+@admin.register(DatasetIndex)
+class DatasetIndexAdmin(MainAppAdmin):
+    """
+    The indexes declared in the schema are managed from the dataset, an admin can index any other field.
+    """
+    fields = ('dataset', 'field', 'name', 'source', 'status')
+    list_display = ['dataset', 'field', 'name', 'source', 'status']
+    list_filter = ['dataset', 'source', 'status']
+    readonly_fields = ['name', 'source', 'status']
+
+    def save_model(self, request, obj, form, change):
+        obj.name = get_index_name(obj.dataset, obj.field)
+        obj.source = DatasetIndex.SOURCE_ADMIN
+        obj.status = DatasetIndex.STATUS_PENDING
+        # built by the worker, dropped as an orphan once deleted (see build_pending_indexes)
+        super(DatasetIndexAdmin, self).save_model(request, obj, form, change)
 
 
 @admin.register(Record)
 class RecordAdmin(MainAppAdmin):
     list_display = ['dataset', 'client_id', 'data']
     list_filter = ['dataset', 'validated', 'locked']
+    actions = [delete_selected]
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            # removed from the summaries with the stored values, added back once saved
+            remove_records_from_summary([obj.pk])
+        super(RecordAdmin, self).save_model(request, obj, form, change)
+        update_record_links(obj.dataset, [obj.pk])
+        add_records_to_summary(obj.dataset, [obj.pk])
+
+    def delete_model(self, request, obj):
+        delete_records(Record.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        delete_records(queryset)
 
 
 @admin.register(Media)
@@ -0,0 +1,101 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+from django.db.models import TextField
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from main.models import Record, RecordLink
+from main.utils_misc import json_keys_sql
+
+_TABLE = Record._meta.db_table
+
+
+def _datetime_sql(column):
+    """
+    The ISO 8601 representation of a timestamp as the serializer DateTimeField renders it: in the current time zone,
+    with the microseconds only if any and Z for UTC.
+    :return: (sql, number of time zone params)
+    """
+    local = "({} AT TIME ZONE %s)".format(column)
+    offset = "({} - ({} AT TIME ZONE 'UTC'))".format(local, column)
+    sql = "CASE WHEN {column} IS NULL THEN NULL ELSE " \
+          "to_char({local}, 'YYYY-MM-DD\"T\"HH24:MI:SS') || " \
+          "CASE WHEN extract(microseconds FROM {column})::bigint %% 1000000 = 0 THEN '' " \
+          "ELSE to_char({local}, '.US') END || " \
+          "CASE WHEN {offset} = interval '0' THEN 'Z' " \
+          "WHEN {offset} > interval '0' THEN '+' || to_char({offset}, 'HH24:MI') " \
+          "ELSE '-' || to_char(-{offset}, 'HH24:MI') END " \
+          "END".format(column=column, local=local, offset=offset)
+    return sql, sql.count('%s')
+
+
+def _column_sql(name):
+    return '{}.{}'.format(_TABLE, Record._meta.get_field(name).column), 0
+
+
+def _parent_sql():
+    # the first parent, by id (see Record.get_relations)
+    return "CASE WHEN {table}.dataset_id = ANY(%s) THEN " \
+           "(SELECT min(l.parent_id) FROM {link} l WHERE l.child_id = {table}.id) END".format(
+               table=_TABLE, link=RecordLink._meta.db_table)
+
+
+def _children_sql():
+    return "CASE WHEN {table}.dataset_id = ANY(%s) THEN " \
+           "(SELECT coalesce(json_agg(l.child_id ORDER BY l.child_id), '[]'::json) FROM {link} l " \
+           "WHERE l.parent_id = {table}.id) END".format(table=_TABLE, link=RecordLink._meta.db_table)
+
+
+# the sql of the RecordSerializer fields: {field name: (sql, number of time zone params)}
+FIELDS_SQL = {
+    'id': _column_sql('id'),
+    'data': _column_sql('data'),
+    'datetime': _datetime_sql('{}.datetime'.format(_TABLE)),
+    'geometry': ('ST_AsGeoJSON({}.geometry, 15)::json'.format(_TABLE), 0),
+    'species_name': _column_sql('species_name'),
+    'name_id': _column_sql('name_id'),
+    'source_info': _column_sql('source_info'),
+    'validated': _column_sql('validated'),
+    'locked': _column_sql('locked'),
+    'client_id': _column_sql('client_id'),
+    'created': _datetime_sql('{}.created'.format(_TABLE)),
+    'last_modified': _datetime_sql('{}.last_modified'.format(_TABLE)),
+    'dataset': _column_sql('dataset'),
+    'site': _column_sql('site'),
+}
+
+
+def can_render(fields):
+    return all(field in FIELDS_SQL or field in ('parent', 'children') for field in fields)
+
+
+def get_records_json(queryset, fields, parent_dataset_ids=None, children_dataset_ids=None, data_keys=None):
+    """
+    The json of the records built by postgres, with the same content as the RecordSerializer representation.
+    :param queryset: a Record queryset, filtered and ordered.
+    :param fields: the serializer field names, in order (see can_render)
+    :param parent_dataset_ids: the ids of the datasets whose records have a parent (see Record.parents)
+    :param children_dataset_ids: the ids of the datasets whose records have children (see Record.children)
+    :param data_keys: the keys of the data to render, all if None
+    :return: a queryset of the records json (text)
+    """
+    time_zone = timezone.get_current_timezone_name()
+    pairs = []
+    params = []
+    for field in fields:
+        if field == 'parent':
+            sql = _parent_sql()
+            params.append(list(parent_dataset_ids or []))
+        elif field == 'children':
+            sql = _children_sql()
+            params.append(list(children_dataset_ids or []))
+        elif field == 'data' and data_keys is not None:
+            sql = json_keys_sql(FIELDS_SQL['data'][0])
+            params.append(list(data_keys))
+        else:
+            sql, time_zone_count = FIELDS_SQL[field]
+            params += [time_zone] * time_zone_count
+        pairs.append("'{}', {}".format(field, sql))
+    sql = 'json_build_object({})::text'.format(', '.join(pairs))
+    return queryset.annotate(record_json=RawSQL(sql, params, output_field=TextField())) \
+        .values_list('record_json', flat=True)
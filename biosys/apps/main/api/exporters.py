@@ -18,14 +18,15 @@ class DefaultExporter:
         self.records = records if records else []
 
     def row_it(self, cast=True):
+        casters = self.schema.row_processor.casters
         for record in self.records:
             row = []
-            for field in self.schema.fields:
-                value = record.data.get(field.name, '')
+            for field_name, caster in casters:
+                value = record.data.get(field_name, '')
                 if cast:
                     # Cast to native python type
                     try:
-                        value = field.cast(value)
+                        value = caster(value)
                     except Exception:
                         pass
                 # TODO: remove that when running in Python3
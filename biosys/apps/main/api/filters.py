@@ -146,6 +146,8 @@ class RecordFilterSet(filters.FilterSet):
     data__contains = JSONFilter(field_name='data', lookup_expr='contains', distinct=True)
     data__has_key = filters.CharFilter(field_name='data', lookup_expr='has_key', distinct=True)
     geometry__within = GeometryFilter(field_name='geometry', lookup_expr='within', distinct=True)
+    # the children of a record
+    parent = filters.NumberFilter(field_name='parent_links__parent')
 
     class Meta:
         model = models.Record
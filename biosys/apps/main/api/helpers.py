@@ -1,4 +1,7 @@
 from django.utils import six
+from rest_framework.exceptions import ValidationError
+
+from main.utils_misc import SEARCH_MODES, SEARCH_MODE_FULLTEXT
 
 
 def to_bool(s):
@@ -6,3 +9,13 @@ def to_bool(s):
         return s.lower() in ('y', 'yes', 'true', 'on', '1')
     else:
         return bool(s)
+
+
+def get_search_mode(request):
+    """
+    The search_mode query param of the record search: fulltext (default) or substring
+    """
+    mode = request.query_params.get('search_mode') or SEARCH_MODE_FULLTEXT
+    if mode not in SEARCH_MODES:
+        raise ValidationError("Unknown search_mode {}. Should be one of {}".format(mode, SEARCH_MODES))
+    return mode
@@ -0,0 +1,175 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import datetime
+import json
+import logging
+import tempfile
+import threading
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadedfile import UploadedFile
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from main.api.uploaders import FileReader, SiteUploader, get_record_creator, get_record_upload_result, \
+    get_site_upload_result
+from main.models import UploadJob
+from main.utils_delete import delete_records
+from main.utils_species import HerbieFacade
+
+logger = logging.getLogger(__name__)
+
+
+def fail_stale_jobs(timeout=None):
+    """
+    Mark as failed the running jobs without heartbeat for timeout seconds (settings.UPLOAD_JOB_TIMEOUT by default):
+    their worker crashed or was killed. They are not run again, some records of the file may already be saved.
+    :return: the number of jobs marked as failed
+    """
+    timeout = timeout if timeout is not None else settings.UPLOAD_JOB_TIMEOUT
+    now = timezone.now()
+    limit = now - datetime.timedelta(seconds=timeout)
+    return UploadJob.objects \
+        .filter(status=UploadJob.STATUS_RUNNING) \
+        .filter(Q(heartbeat__lt=limit) | Q(heartbeat__isnull=True, started__lt=limit)) \
+        .update(status=UploadJob.STATUS_FAILED, finished=now,
+                message="The job was interrupted: no heartbeat from its worker for {} seconds".format(timeout))
+
+
+def claim_next_job():
+    """
+    Pick the oldest pending job and mark it as running, after the stale running jobs are marked as failed (see
+    fail_stale_jobs).
+    The row is locked with SKIP LOCKED so several workers can poll the same table without processing a job twice.
+    :return: the claimed UploadJob or None if there is no pending job
+    """
+    fail_stale_jobs()
+    with transaction.atomic():
+        job = UploadJob.objects \
+            .select_for_update(skip_locked=True) \
+            .filter(status=UploadJob.STATUS_PENDING) \
+            .order_by('id') \
+            .first()
+        if job is not None:
+            job.status = UploadJob.STATUS_RUNNING
+            job.started = job.heartbeat = timezone.now()
+            job.save(update_fields=['status', 'started', 'heartbeat'])
+    return job
+
+
+class JobHeartbeat(threading.Thread):
+    """
+    Update the heartbeat of a running job every interval seconds, from its own thread (and database connection) so a
+    long step without progress (e.g. a COPY ingest or the delete of the previous records) doesn't look stale.
+    """
+
+    def __init__(self, job, interval=None):
+        super(JobHeartbeat, self).__init__()
+        self.daemon = True
+        self.job_id = job.pk
+        self.interval = interval if interval is not None else settings.UPLOAD_JOB_HEARTBEAT_INTERVAL
+        self._stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self._stopped.wait(self.interval):
+                UploadJob.objects.filter(pk=self.job_id, status=UploadJob.STATUS_RUNNING) \
+                    .update(heartbeat=timezone.now())
+        except Exception:
+            logger.exception("Error while updating the heartbeat of the upload job {}".format(self.job_id))
+        finally:
+            connection.close()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class UploadJobRunner(object):
+    """
+    Process an upload job: run the RecordCreator or the SiteUploader on the job file, update the job progress every
+    PROGRESS_INTERVAL rows and save the per row report (the same as the synchronous upload response) as a json file.
+    """
+    PROGRESS_INTERVAL = 100
+
+    def __init__(self, job, species_facade_class=HerbieFacade):
+        self.job = job
+        self.species_facade_class = species_facade_class
+
+    def run(self):
+        job = self.job
+        heartbeat = JobHeartbeat(job)
+        heartbeat.start()
+        try:
+            with tempfile.TemporaryFile() as report:
+                job.file.open('rb')
+                try:
+                    file_ = UploadedFile(file=job.file.file, name=job.file_name, content_type=job.content_type)
+                    if job.type == UploadJob.TYPE_SITES:
+                        self._upload_sites(file_, report)
+                    else:
+                        self._upload_records(file_, report)
+                finally:
+                    job.file.close()
+                report.seek(0)
+                job.report.save('job_{}.json'.format(job.pk), File(report), save=False)
+            job.status = UploadJob.STATUS_COMPLETED
+        except Exception as e:
+            logger.exception("Error while processing the upload job {}".format(job.pk))
+            job.status = UploadJob.STATUS_FAILED
+            job.message = str(e)
+        finally:
+            heartbeat.stop()
+        job.finished = timezone.now()
+        job.save()
+        return job
+
+    def _upload_records(self, file_, report):
+        dataset = self.job.dataset
+        options = self.job.options
+        if options.get('delete_previous'):
+            delete_records(dataset.record_queryset)
+        creator = get_record_creator(dataset, FileReader(file_), options,
+                                     species_facade_class=self.species_facade_class)
+        report.write(b'[')
+        row = 1  # starts at 1 to match excel row id
+        for record, validator_result in creator:
+            row += 1
+            if row > 2:
+                report.write(b',')
+            self._write(report, get_record_upload_result(row, record, validator_result))
+            self._progress(validator_result.has_errors)
+        report.write(b']')
+        if creator.date_formats:
+            logger.info("Date formats detected for the upload job {}: {}".format(self.job.pk, creator.date_formats))
+
+    def _upload_sites(self, file_, report):
+        uploader = SiteUploader(file_, self.job.project)
+        report.write(b'{')
+        row = 0
+        try:
+            for site, error in uploader:
+                row += 1
+                if row > 1:
+                    report.write(b',')
+                self._write(report, str(row))
+                report.write(b':')
+                self._write(report, get_site_upload_result(site, error))
+                self._progress(bool(error))
+        finally:
+            uploader.close()
+        report.write(b'}')
+
+    @staticmethod
+    def _write(report, value):
+        report.write(json.dumps(value).encode('utf-8'))
+
+    def _progress(self, has_error):
+        job = self.job
+        job.rows_processed += 1
+        if has_error:
+            job.error_count += 1
+        if job.rows_processed % self.PROGRESS_INTERVAL == 0:
+            UploadJob.objects.filter(pk=job.pk).update(rows_processed=job.rows_processed, error_count=job.error_count)
@@ -0,0 +1,207 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.db.models.expressions import RawSQL
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from main.api.helpers import to_bool
+from main.models import Record
+
+
+class RecordPagination(LimitOffsetPagination):
+    """
+    The limit/offset pagination (the default) plus a keyset (cursor) pagination for the large record lists.
+    The cursor pagination is used with ?pagination=cursor or when a cursor is given. The records are paged on their id
+    or, if an ordering is given, on (ordering key, id) so a page costs the same whatever its depth.
+    ?pagination=cursor&limit=1000 -> {count, next, previous, results} where next and previous are the urls of the next
+    and previous pages (with an opaque cursor) or null. The count is skipped with count=false.
+    Only one ordering key is supported: a record field of CURSOR_ORDERING_FIELDS or a key of the data (schema field
+    names) or of the source_info (file_name, row).
+    """
+    pagination_query_param = 'pagination'
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    ordering_query_param = 'ordering'
+    CURSOR_PAGINATION = 'cursor'
+    DEFAULT_CURSOR_LIMIT = 100
+    CURSOR_ORDERING_FIELDS = ['id', 'created', 'last_modified', 'datetime', 'species_name', 'name_id', 'client_id',
+                              'validated', 'locked', 'site']
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        self.is_cursor = False
+
+    def is_cursor_request(self, request):
+        return request.query_params.get(self.pagination_query_param) == self.CURSOR_PAGINATION or \
+            self.cursor_query_param in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.is_cursor = self.is_cursor_request(request)
+        if not self.is_cursor:
+            return super(RecordPagination, self).paginate_queryset(queryset, request, view=view)
+        return self.paginate_queryset_with_cursor(queryset, request, view=view)
+
+    def get_paginated_response(self, data):
+        if not self.is_cursor:
+            return super(RecordPagination, self).get_paginated_response(data)
+        result = OrderedDict()
+        if self.count is not None:
+            result['count'] = self.count
+        result['next'] = self.get_next_link()
+        result['previous'] = self.get_previous_link()
+        result['results'] = data
+        return Response(result)
+
+    def get_next_link(self):
+        if not self.is_cursor:
+            return super(RecordPagination, self).get_next_link()
+        return self.get_cursor_link(self.next_position, reverse=False)
+
+    def get_previous_link(self):
+        if not self.is_cursor:
+            return super(RecordPagination, self).get_previous_link()
+        return self.get_cursor_link(self.previous_position, reverse=True)
+
+    def paginate_queryset_with_cursor(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request) or self.DEFAULT_CURSOR_LIMIT
+        self.count = None
+        if to_bool(request.query_params.get(self.count_query_param, True)):
+            self.count = queryset.count()
+        self.key = self.get_ordering_key(request, view)
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor['reverse']
+        # a previous page is read backward from the cursor
+        descending = (self.key is not None and self.key['descending']) != reverse
+        queryset = self.order_queryset(queryset, descending)
+        if cursor is not None:
+            queryset = self.filter_after(queryset, cursor, descending)
+        records = list(queryset[:self.limit + 1])
+        has_more = len(records) > self.limit
+        records = records[:self.limit]
+        if reverse:
+            records.reverse()
+        first, last = (self.get_position(records[0]), self.get_position(records[-1])) if records else (cursor, cursor)
+        if reverse:
+            self.previous_position = first if has_more else None
+            self.next_position = last
+        else:
+            self.previous_position = first if cursor is not None else None
+            self.next_position = last if has_more else None
+        return records
+
+    def get_ordering_key(self, request, view):
+        """
+        :return: None to order by id or a dict {sql, params, is_json, descending, get_value}
+        """
+        ordering = request.query_params.get(self.ordering_query_param)
+        if not ordering:
+            return None
+        if ',' in ordering:
+            raise ValidationError("The cursor pagination supports only one ordering field: {}".format(ordering))
+        descending = ordering.startswith('-')
+        name = ordering[1:] if descending else ordering
+        if name == 'id':
+            return {'sql': None, 'descending': descending}
+        table = Record._meta.db_table
+        dataset = getattr(view, 'dataset', None)
+        json_fields = [
+            ('source_info', ['file_name', 'row']),
+            ('data', dataset.schema.field_names if dataset else []),
+        ]
+        for json_field_name, keys in json_fields:
+            if name in keys:
+                return {
+                    'sql': '({}.{} -> %s)'.format(table, json_field_name),
+                    'params': [name],
+                    'is_json': True,
+                    'descending': descending,
+                    'get_value': lambda record: (getattr(record, json_field_name) or {}).get(name)
+                }
+        if name in self.CURSOR_ORDERING_FIELDS:
+            field = Record._meta.get_field(name)
+            return {
+                'sql': '{}.{}'.format(table, field.column),
+                'params': [],
+                'is_json': False,
+                'descending': descending,
+                'get_value': lambda record: getattr(record, field.attname)
+            }
+        raise ValidationError("The cursor pagination doesn't support the ordering {}".format(ordering))
+
+    def order_queryset(self, queryset, descending):
+        id_ordering = '-id' if descending else 'id'
+        if self.key is None or self.key['sql'] is None:
+            return queryset.order_by(id_ordering)
+        expression = RawSQL(self.key['sql'], self.key['params'])
+        # postgres default: nulls last in ascending order, first in descending order.
+        return queryset.order_by(expression.desc() if descending else expression.asc(), id_ordering)
+
+    def filter_after(self, queryset, position, descending):
+        """
+        Keep the records after the position in the (key, id) order.
+        """
+        if self.key is None or self.key['sql'] is None:
+            return queryset.filter(**{'id__lt' if descending else 'id__gt': position['id']})
+        key, key_params = self.key['sql'], self.key['params']
+        op = '<' if descending else '>'
+        id_sql = '{}.id {} %s'.format(Record._meta.db_table, op)
+        value = position['value']
+        if value is None:
+            where = '({key} IS NULL AND {id})'.format(key=key, id=id_sql)
+            params = key_params + [position['id']]
+            if descending:
+                # the nulls are first, every not null key is after
+                where = '({} OR {} IS NOT NULL)'.format(where, key)
+                params += key_params
+        else:
+            value_sql = '%s::jsonb' if self.key['is_json'] else '%s'
+            value = json.dumps(value) if self.key['is_json'] else value
+            where = '{key} {op} {value} OR ({key} = {value} AND {id})'.format(key=key, op=op, value=value_sql,
+                                                                              id=id_sql)
+            params = key_params + [value] + key_params + [value, position['id']]
+            if not descending:
+                # the nulls are last, after every not null key
+                where += ' OR {} IS NULL'.format(key)
+                params += key_params
+            where = '({})'.format(where)
+        return queryset.extra(where=[where], params=params)
+
+    def get_position(self, record):
+        position = {'id': record.pk, 'value': None}
+        if self.key is not None and self.key['sql'] is not None:
+            value = self.key['get_value'](record)
+            if not self.key['is_json'] and hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            position['value'] = value
+        return position
+
+    def get_cursor_link(self, position, reverse):
+        if position is None:
+            return None
+        cursor = dict(position, reverse=reverse)
+        encoded = base64.urlsafe_b64encode(json.dumps(cursor).encode('utf-8')).decode('ascii')
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            return {
+                'id': int(cursor['id']),
+                'value': cursor.get('value'),
+                'reverse': bool(cursor.get('reverse'))
+            }
+        except (TypeError, ValueError, KeyError, AttributeError, binascii.Error, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
@@ -6,17 +6,23 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
+from django.db import models, transaction
 from django.utils import timezone
 
 from rest_framework import serializers, fields, validators
 from rest_framework_gis import serializers as serializers_gis
 from drf_extra_fields.fields import Base64ImageField
 
+from main.api.helpers import to_bool
 from main.api.validators import get_record_validator_for_dataset
 from main.constants import MODEL_SRID
-from main.models import Program, Project, Site, Dataset, Record, Media, DatasetMedia, ProjectMedia
+from main.models import Program, Project, Site, Dataset, Record, Media, DatasetMedia, ProjectMedia, UploadJob, \
+    DatasetIndex
 from main.utils_auth import is_admin
-from main.utils_species import get_key_for_value
+from main.utils_data_package import SiteLookup
+from main.utils_links import update_record_links
+from main.utils_summary import add_records_to_summary, remove_records_from_summary, get_dataset_summary, \
+    get_project_record_count
 
 User = get_user_model()
 
@@ -112,7 +118,12 @@ class ProjectSerializer(serializers.ModelSerializer):
     extent = serializers.ListField(required=False, read_only=True)
     dataset_count = serializers.IntegerField(required=False, read_only=True)
     site_count = serializers.IntegerField(required=False, read_only=True)
-    record_count = serializers.IntegerField(required=False, read_only=True)
+    record_count = serializers.SerializerMethodField()
+
+    def get_record_count(self, instance):
+        # from the dataset summaries, annotated on the queryset of the ProjectViewSet
+        record_count = getattr(instance, 'summary_record_count', None)
+        return record_count if record_count is not None else get_project_record_count(instance)
 
     class Meta:
         model = Project
@@ -128,8 +139,16 @@ class SiteSerializer(serializers.ModelSerializer):
 
 
 class DatasetSerializer(serializers.ModelSerializer):
-    record_count = serializers.IntegerField(required=False, read_only=True)
-    extent = serializers.ListField(required=False, read_only=True)
+    # from the dataset summary (see main.utils_summary)
+    record_count = serializers.SerializerMethodField()
+    extent = serializers.SerializerMethodField()
+
+    def get_record_count(self, instance):
+        return get_dataset_summary(instance).record_count
+
+    def get_extent(self, instance):
+        extent = get_dataset_summary(instance).extent
+        return list(extent) if extent is not None else None
 
     class DataPackageValidator:
         def __init__(self):
@@ -208,7 +227,23 @@ class SchemaValidator:
             self.dataset = ctx['dataset']
 
 
+class RecordListSerializer(serializers.ListSerializer):
+    """
+    Resolve the parent and children of all the records in bulk before serializing them (see Record.get_relations).
+    """
+
+    def to_representation(self, data):
+        records = data.all() if isinstance(data, models.Manager) else data
+        if 'parent' in self.child.fields or 'children' in self.child.fields:
+            records = list(records)
+            self.child.relations = Record.get_relations(records)
+        return super(RecordListSerializer, self).to_representation(records)
+
+
 class RecordSerializer(serializers.ModelSerializer):
+    """
+    The parent and children are not serialized with the query param relations=false.
+    """
     parent = serializers.SerializerMethodField()
     children = serializers.SerializerMethodField()
 
@@ -223,10 +258,15 @@ class RecordSerializer(serializers.ModelSerializer):
         # the next object will hold a cached version of the 'species_name' -> name_id obtained
         # from the species_naming_facade above.
         self.species_name_id_mapping_cached = None
+        # {record id: (parent id, children ids)} set by the RecordListSerializer
+        self.relations = {}
 
         # dynamic fields
         request = ctx.get('request')
         if request:
+            if not to_bool(request.query_params.get('relations', True)):
+                self.fields.pop('parent')
+                self.fields.pop('children')
             expected_fields = request.query_params.getlist('fields', [])
             if expected_fields:
                 existing_fields = self.fields.keys()
@@ -266,7 +306,8 @@ class RecordSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def get_geometry(dataset, data):
-        return dataset.schema.cast_geometry(data, default_srid=dataset.project.datum or MODEL_SRID)
+        return dataset.schema.cast_geometry(data, default_srid=dataset.project.datum or MODEL_SRID,
+                                            site_lookup=SiteLookup(dataset.project, prefetch=False))
 
     @staticmethod
     def set_date(instance, validated_data, commit=True):
@@ -308,11 +349,11 @@ class RecordSerializer(serializers.ModelSerializer):
         if species_mapping:
             # name id takes precedence
             if name_id and name_id != -1:
-                species_name = get_key_for_value(species_mapping, int(name_id), None)
+                species_name = species_mapping.get_species_name(int(name_id))
                 if not species_name:
                     raise Exception("Cannot find a species with nameId={}".format(name_id))
             elif species_name:
-                name_id = int(species_mapping.get(species_name, -1))
+                name_id = int(species_mapping.get_name_id(species_name, -1))
             else:
                 raise Exception('Missing Species Name or Species Name Id')
         else:
@@ -328,9 +369,9 @@ class RecordSerializer(serializers.ModelSerializer):
         if all([
             self.species_name_id_mapping_cached is None,
             self.species_naming_facade_class is not None,
-            callable(getattr(self.species_naming_facade_class, 'name_id_by_species_name'))
+            callable(getattr(self.species_naming_facade_class, 'species_index', None))
         ]):
-            self.species_name_id_mapping_cached = self.species_naming_facade_class().name_id_by_species_name()
+            self.species_name_id_mapping_cached = self.species_naming_facade_class().species_index()
         return self.species_name_id_mapping_cached
 
     def set_fields_from_data(self, instance, validated_data):
@@ -348,6 +389,8 @@ class RecordSerializer(serializers.ModelSerializer):
         """
         Return the FIRST parent record.id or None
         """
+        if record.id in self.relations:
+            return self.relations[record.id][0]
         parents = record.parents
         # currently client support only one parent
         return parents[0].id if parents else None
@@ -357,6 +400,8 @@ class RecordSerializer(serializers.ModelSerializer):
         :param record:
         :return: an array of children record ids, or None
         """
+        if record.id in self.relations:
+            return self.relations[record.id][1]
         children = record.children
         return [rec.id for rec in children] if children is not None else None
 
@@ -381,18 +426,27 @@ class RecordSerializer(serializers.ModelSerializer):
         :return:
         """
         instance = super(RecordSerializer, self).create(validated_data)
-        return self.set_fields_from_data(instance, validated_data)
+        instance = self.set_fields_from_data(instance, validated_data)
+        update_record_links(instance.dataset, [instance.pk])
+        add_records_to_summary(instance.dataset, [instance.pk])
+        return instance
 
     def update(self, instance, validated_data):
-        instance = super(RecordSerializer, self).update(instance, validated_data)
-        # if data are sent we need to update the extracted fields
-        if validated_data.get('data') is not None:
-            instance = self.set_fields_from_data(instance, validated_data)
+        with transaction.atomic():
+            # the record is removed from the summaries with its previous values and added back once updated
+            remove_records_from_summary([instance.pk])
+            instance = super(RecordSerializer, self).update(instance, validated_data)
+            # if data are sent we need to update the extracted fields
+            if validated_data.get('data') is not None:
+                instance = self.set_fields_from_data(instance, validated_data)
+                update_record_links(instance.dataset, [instance.pk])
+            add_records_to_summary(instance.dataset, [instance.pk])
         return instance
 
     class Meta:
         model = Record
         fields = '__all__'
+        list_serializer_class = RecordListSerializer
 
 
 class Base64ProjectMediaSerializer(serializers.ModelSerializer):
@@ -443,6 +497,18 @@ class MediaSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class DatasetIndexSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DatasetIndex
+        fields = '__all__'
+
+
+class UploadJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadJob
+        exclude = ('file', 'report')
+
+
 class GeometrySerializer(serializers.Serializer):
     geometry = serializers_gis.GeometryField(required=False)
 
@@ -1,20 +1,27 @@
 import codecs
+import collections
 import datetime
+import json
+import multiprocessing
+import uuid
 from os import path
 
 import datapackage
 from django.conf import settings
+from django.db import connection, transaction
 from django.utils import six, timezone
 from django.utils.text import slugify
 from openpyxl import load_workbook
 
-from main.api.validators import get_record_validator_for_dataset
+from main.api.validators import get_record_validator_for_dataset, ObservationValidator, RecordValidatorResult
 from main.constants import MODEL_SRID
 from main.models import Site, Dataset
 from main.utils_data_package import GeometryParser, ObservationSchema, SpeciesObservationSchema, BiosysSchema, \
-    SpeciesNameParser
+    SpeciesNameParser, SiteLookup, RowProcessor, transform_coordinates, transform_geometry, is_blank_value
+from main.utils_links import update_record_links
+from main.utils_summary import add_records_to_summary, mark_summaries_stale, refresh_species_summary
 from main.utils_misc import get_value
-from main.utils_species import HerbieFacade, get_key_for_value
+from main.utils_species import HerbieFacade, SpeciesIndex
 
 # TODO: remove when python3
 if six.PY2:
@@ -23,26 +30,61 @@ else:
     import csv
 
 
-def xlsx_to_csv(file_):
+class XLSXDictReader(object):
+    """
+    A csv.DictReader like reader of the first sheet of a xlsx file.
+    The rows are read lazily from a read-only workbook so the memory use doesn't depend on the size of the sheet.
+    Each row is a dictionary header => value where the values are formatted as they would be in a csv file: strings,
+    empty string for blank cells and dates formatted with settings.DATE_FORMAT.
+    """
 
+    def __init__(self, file_):
+        self.workbook = load_workbook(filename=file_, read_only=True)
+        # use the first sheet
+        if len(self.workbook.worksheets) > 0:
+            self.rows = iter(self.workbook.worksheets[0].rows)
+        else:
+            self.rows = iter([])
+        headers = next(self.rows, None)
+        self.fieldnames = self._format_row(headers) if headers is not None else []
+
+    @staticmethod
     def _format(cell_):
-        result = cell_.value
-        if isinstance(result, datetime.datetime):
-            result = result.strftime(settings.DATE_FORMAT)
-        return result
+        value = cell_.value
+        if value is None:
+            return ''
+        if isinstance(value, datetime.datetime):
+            return value.strftime(settings.DATE_FORMAT)
+        if isinstance(value, float):
+            # same as the csv writer
+            return six.text_type(repr(value))
+        return six.text_type(value)
 
-    output = six.StringIO()
-    writer = csv.writer(output)
-    wb = load_workbook(filename=file_, read_only=True)
-    # use the first sheet
-    if len(wb.worksheets) > 0:
-        ws = wb.worksheets[0]
-        for row in ws.rows:
-            r = [_format(cell) for cell in row]
-            writer.writerow(r)
-    # rewind
-    output.seek(0)
-    return output
+    def _format_row(self, row):
+        return [self._format(cell) for cell in row]
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        values = []
+        # skip the empty rows like the csv.DictReader
+        while not values:
+            values = self._format_row(next(self.rows))
+        row = dict(zip(self.fieldnames, values))
+        if len(values) > len(self.fieldnames):
+            row[None] = values[len(self.fieldnames):]
+        else:
+            for field_name in self.fieldnames[len(values):]:
+                row[field_name] = None
+        return row
+
+    # TODO: remove when python3
+    next = __next__
+
+    def close(self):
+        if hasattr(self.workbook, 'close'):
+            self.workbook.close()
 
 
 # TODO: investigate the use frictionless tabulator.Stream as a xlsx/csv reader instead of this class
@@ -98,8 +140,7 @@ class FileReader(object):
             msg = "Wrong file type {}. Should be one of: {}".format(file_.content_type, self.SUPPORTED_TYPES)
             raise Exception(msg)
         if file_format == self.XLSX_FORMAT:
-            self.file = xlsx_to_csv(file_)
-            self.reader = csv.DictReader(self.file)
+            self.reader = XLSXDictReader(self.file)
         else:
             if six.PY3:
                 self.reader = csv.DictReader(codecs.iterdecode(self.file, 'utf-8'))
@@ -121,6 +162,8 @@ class FileReader(object):
         self.close()
 
     def close(self):
+        if isinstance(self.reader, XLSXDictReader):
+            self.reader.close()
         self.file.close()
 
 
@@ -225,105 +268,950 @@ class SiteUploader(FileReader):
         return attributes
 
 
+class RecordRowPreparer(object):
+    """
+    The CPU bound stage of the record creation: validate a row and cast it into the record field values.
+    No database access is done here (the sites come from a prefetched SiteLookup and the species from a SpeciesIndex),
+    so the preparer can run in a worker process. When pickled only the dataset, the lookups and the validator options
+    are sent, the schema and the validator are rebuilt from the dataset descriptor in the worker.
+    """
+
+    def __init__(self, dataset, validator, site_lookup, species_index):
+        self.dataset = dataset
+        self.validator = validator
+        self.site_lookup = site_lookup
+        self.species_index = species_index
+        self.schema = validator.schema
+        # a processor of its own to detect the date formats of the uploaded file.
+        self.row_processor = RowProcessor(self.schema, detect_date_formats=True)
+        self.is_observation = dataset.type in [Dataset.TYPE_OBSERVATION, Dataset.TYPE_SPECIES_OBSERVATION]
+        self.is_species_observation = dataset.type == Dataset.TYPE_SPECIES_OBSERVATION
+
+    def __getstate__(self):
+        return {
+            'dataset': self.dataset,
+            'site_lookup': self.site_lookup,
+            'species_index': self.species_index,
+            'schema_error_as_warning': self.validator.schema_error_as_warning,
+            'resolve_site_geometry': getattr(self.validator, 'resolve_site_geometry', True)
+        }
+
+    def __setstate__(self, state):
+        validator = get_record_validator_for_dataset(state['dataset'],
+                                                     schema_error_as_warning=state['schema_error_as_warning'],
+                                                     site_lookup=state['site_lookup'])
+        if isinstance(validator, ObservationValidator):
+            validator.resolve_site_geometry = state['resolve_site_geometry']
+        self.__init__(state['dataset'], validator, state['site_lookup'], state['species_index'])
+
+    @property
+    def timezone(self):
+        return self.dataset.project.timezone or timezone.get_current_timezone()
+
+    @property
+    def default_srid(self):
+        return self.dataset.project.datum or MODEL_SRID
+
+    def prepare(self, row):
+        """
+        Validate and cast the row.
+        :param row: a {column(string): value(string)} dictionary
+        :return: row (with the numbers casted), RecordValidatorResult, a dict of the record field values or None if
+        the row couldn't be casted.
+        """
+        # every value of the row is casted only once and shared by the validator and the casts below.
+        processed_row = self.row_processor.process(row)
+        validator_result = self.validator.validate(row, processed_row=processed_row)
+        if not validator_result.is_valid:
+            return row, validator_result, None
+        # The row values comes as string but we want to save numeric field as json number not string to allow a
+        # correct ordering. The next call will cast the numeric field into python int or float.
+        row = processed_row.cast_numbers()
+        fields = {}
+        try:
+            # specific fields
+            if self.is_observation:
+                observation_date = self.cast_observation_date(row, processed_row=processed_row)
+                if observation_date:
+                    # convert to datetime with timezone awareness
+                    fields['datetime'] = timezone.make_aware(observation_date, self.timezone)
+
+                # geometry, saved in the model srid
+                geometry = self.schema.cast_geometry(row, default_srid=self.default_srid, site_lookup=self.site_lookup)
+                fields['geometry'] = transform_geometry(geometry, MODEL_SRID, clone=True)
+                if self.is_species_observation:
+                    species_name, name_id = self.cast_species(row, validator_result)
+                    if validator_result.is_valid:
+                        fields['species_name'] = species_name
+                        fields['name_id'] = name_id
+        except Exception as e:
+            # catch all errors
+            message = str(e)
+            validator_result.add_column_error('unknown', message)
+            fields = None
+        return row, validator_result, fields
+
+    def cast_observation_date(self, row, processed_row=None):
+        """
+        :return: the observation date as a naive datetime or None
+        """
+        observation_date = self.schema.cast_record_observation_date(row, processed_row=processed_row)
+        if observation_date and isinstance(observation_date, datetime.date):
+            observation_date = datetime.datetime.combine(observation_date, datetime.time.min)
+        return observation_date
+
+    def cast_species(self, row, validator_result):
+        """
+        Lookup for species match in herbie. Either a species name or a nameId.
+        If the nameId is not found an error is added to the validator_result.
+        :return: species_name, name_id
+        """
+        species_name = self.schema.cast_species_name(row)
+        name_id = self.schema.cast_species_name_id(row)
+        # name id takes precedence
+        if name_id:
+            species_name = self.species_index.get_species_name(int(name_id))
+            if not species_name:
+                column_name = self.schema.species_name_parser.name_id_field.name
+                message = "Cannot find a species with nameId={}".format(name_id)
+                validator_result.add_column_error(column_name, message)
+        elif species_name:
+            name_id = int(self.species_index.get_name_id(species_name, -1))
+        return species_name, name_id
+
+
+# The preparer of a worker process of a parallel RecordCreator. Set by the pool initializer.
+_worker_preparer = None
+
+
+def _init_worker_preparer(preparer):
+    global _worker_preparer
+    _worker_preparer = preparer
+
+
+def _prepare_chunk(chunk):
+    """
+    Prepare a chunk of rows in a worker process.
+    :param chunk: a list of (counter, row)
+    :return: a list of (counter, row, RecordValidatorResult, fields), the date formats detected by the worker
+    """
+    prepared_chunk = [(counter,) + _worker_preparer.prepare(row) for counter, row in chunk]
+    return prepared_chunk, _worker_preparer.row_processor.date_formats
+
+
+class RecordKeyLookup(object):
+    """
+    The ids of the existing records of a dataset by key, for the upsert uploads.
+    The key is the declared primaryKey of the schema or, if the schema has none, the client_id of the record (given in
+    the CLIENT_ID_COLUMN of the uploaded file). Only the keys and the ids are kept in memory.
+    """
+    CLIENT_ID_COLUMN = 'client_id'
+
+    def __init__(self, dataset):
+        self.primary_key = dataset.schema.primary_key
+        self.ids = {}
+        if self.primary_key:
+            for pk, data in dataset.record_queryset.values_list('pk', 'data').iterator():
+                self.add(self.get_key(data), pk)
+        else:
+            queryset = dataset.record_queryset.exclude(client_id__isnull=True).exclude(client_id='')
+            for pk, client_id in queryset.values_list('pk', 'client_id').iterator():
+                self.add(client_id, pk)
+
+    @property
+    def key_column(self):
+        return ', '.join(self.primary_key) if self.primary_key else self.CLIENT_ID_COLUMN
+
+    def get_key(self, data, client_id=None):
+        """
+        :param data: the record data
+        :param client_id: the record client_id
+        :return: the key or None if the record has no key
+        """
+        if not self.primary_key:
+            return client_id or None
+        values = [(data or {}).get(name) for name in self.primary_key]
+        if any(is_blank_value(value) for value in values):
+            return None
+        # the numbers of the old records may have been saved as strings.
+        return tuple(six.text_type(value) for value in values)
+
+    def get_id(self, key):
+        return self.ids.get(key) if key is not None else None
+
+    def add(self, key, pk):
+        if key is not None:
+            self.ids.setdefault(key, pk)
+
+
 class RecordCreator:
+    """
+    Create records from a row generator.
+    Iterating over the creator yields a (record, RecordValidatorResult) tuple for every row, in order.
+    If a batch_size is given the valid records are inserted in bulk by batch of batch_size rows instead of one by one.
+    If processes is given the rows are validated and casted by chunk of chunk_size rows in a pool of worker processes
+    (see RecordRowPreparer), the records are still saved in the current process in the row order.
+    If upsert is True the rows are matched to the existing records of the dataset by key (see RecordKeyLookup): the new
+    rows are inserted, the existing records are updated with a single UPDATE per batch, only if they changed. The action
+    done is set as the upload_action attribute of the yielded record (ACTION_INSERTED, ACTION_UPDATED or
+    ACTION_UNCHANGED).
+    """
+    DEFAULT_BATCH_SIZE = 500
+    DEFAULT_CHUNK_SIZE = 200
+    # The matched records of an upsert, (id, data, site_id, datetime, geometry, species_name, name_id, source_info)
+    # values, are updated only if one of the fields but the source info changed. The query returns for every value the
+    # id, if it was updated and if the record exists.
+    UPSERT_UPDATE_SQL = """
+        WITH v (id, data, site_id, datetime, geometry, species_name, name_id, source_info) AS (VALUES {values}),
+        updated AS (
+            UPDATE {record} r SET data = v.data, site_id = v.site_id, datetime = v.datetime, geometry = v.geometry,
+            species_name = v.species_name, name_id = v.name_id, source_info = v.source_info, last_modified = now()
+            FROM v
+            WHERE r.id = v.id AND (
+                r.data IS DISTINCT FROM v.data OR r.site_id IS DISTINCT FROM v.site_id
+                OR r.datetime IS DISTINCT FROM v.datetime
+                OR ST_AsEWKB(r.geometry) IS DISTINCT FROM ST_AsEWKB(v.geometry)
+                OR r.species_name IS DISTINCT FROM v.species_name OR r.name_id IS DISTINCT FROM v.name_id
+            )
+            RETURNING r.id
+        )
+        SELECT v.id, v.id IN (SELECT id FROM updated), EXISTS (SELECT 1 FROM {record} r WHERE r.id = v.id) FROM v
+    """
+    UPSERT_VALUES_SQL = "(%s::integer, %s::jsonb, %s::integer, %s::timestamptz, ST_Transform(%s::geometry, {srid}), " \
+                        "%s::text, %s::integer, %s::jsonb)"
+
     def __init__(self, dataset, data_generator,
-                 commit=True, create_site=False, validator=None, species_facade_class=HerbieFacade):
+                 commit=True, create_site=False, validator=None, species_facade_class=HerbieFacade,
+                 batch_size=None, processes=None, chunk_size=None, upsert=False):
         self.dataset = dataset
         self.generator = data_generator
+        # read before the generator is wrapped (see _pop_client_ids)
+        self.file_name = data_generator.file_name if hasattr(data_generator, 'file_name') else None
+        self.upsert = upsert and commit
+        self.key_lookup = RecordKeyLookup(dataset) if self.upsert else None
+        # the client ids of the rows by row counter (upsert on client_id only)
+        self._client_ids = {}
+        self._upsert_keys = set()
+        if self.upsert and not self.key_lookup.primary_key:
+            self.generator = self._pop_client_ids(data_generator)
         self.create_site = create_site
         self.dataset = dataset
         self.schema = dataset.schema
         self.record_model = dataset.record_model
+        # the sites of the project are fetched once for the whole upload and shared with the validator.
+        self.site_lookup = SiteLookup(dataset.project)
+        # the codes of the sites created during the upload.
+        self.created_site_codes = set()
         self.validator = validator if validator else get_record_validator_for_dataset(dataset)
+        self.validator.site_lookup = self.site_lookup
         # if species. First load species list from herbie. Should raise an exception if problem.
-        self.species_id_by_name = {}
+        self.species_index = SpeciesIndex()
         if dataset.type == Dataset.TYPE_SPECIES_OBSERVATION:
-            self.species_id_by_name = species_facade_class().name_id_by_species_name()
+            self.species_index = species_facade_class().species_index()
+        self.preparer = RecordRowPreparer(dataset, self.validator, self.site_lookup, self.species_index)
         # Schema foreign key for site.
         self.site_fk = self.schema.get_fk_for_model('Site')
         self.commit = commit
-        self.file_name = self.generator.file_name if hasattr(self.generator, 'file_name') else None
+        self.batch_size = batch_size
+        self.processes = processes
+        self.chunk_size = chunk_size or self.DEFAULT_CHUNK_SIZE
+        # the date formats detected by the worker processes
+        self._worker_date_formats = {}
         # Trick: use GeometryParser to get the site code
         self.geo_parser = GeometryParser(self.schema)
 
     def __iter__(self):
+        if self.commit and self.batch_size:
+            # the links and the summary are updated after each batch (see _iter_batches)
+            for result in self._iter_batches():
+                yield result
+            return
+        # the records are committed one by one: the links and the summary are updated in bulk for the saved records,
+        # even if the upload stops before the end (reader error, client disconnected).
+        records = []
+        try:
+            for prepared in self._iter_prepared():
+                record, validator_result = self._create_record(*prepared)
+                records.append(record)
+                yield record, validator_result
+        finally:
+            self._update_links_and_summary(records)
+
+    def _update_links_and_summary(self, records):
+        """
+        Update the links to the parent/children records and the dataset summary with the committed records.
+        :param records: the records of the upload, the ones without pk (not saved) are ignored.
+        """
+        if not self.commit:
+            return
+        record_ids = []
+        inserted_ids = []
+        has_updates = False
+        for record in records:
+            if record is not None and record.pk is not None:
+                record_ids.append(record.pk)
+                action = getattr(record, 'upload_action', ACTION_INSERTED)
+                if action == ACTION_INSERTED:
+                    inserted_ids.append(record.pk)
+                elif action == ACTION_UPDATED:
+                    has_updates = True
+        update_record_links(self.dataset, record_ids)
+        add_records_to_summary(self.dataset, inserted_ids)
+        if has_updates:
+            mark_summaries_stale([self.dataset.pk])
+            refresh_species_summary(self.dataset)
+
+    @property
+    def date_formats(self):
+        """
+        The formats detected for the date fields with format 'any', for checking. The fields whose values have no
+        consistent format are not listed.
+        :return: a field name -> strptime format dict
+        """
+        date_formats = dict(self._worker_date_formats)
+        date_formats.update(self.preparer.row_processor.date_formats)
+        return date_formats
+
+    def _iter_prepared(self):
+        """
+        :return: a generator of (counter, row, RecordValidatorResult, fields) in the row order
+        """
+        if not self.processes or self.processes <= 1:
+            counter = 0
+            for data in self.generator:
+                counter += 1
+                yield (counter,) + self.preparer.prepare(data)
+        else:
+            for prepared in self._iter_prepared_parallel():
+                yield prepared
+
+    def _iter_prepared_parallel(self):
+        """
+        Send the rows by chunk to a pool of worker processes. At most 2 chunks per process are pending at a time to
+        keep the memory bounded whatever the size of the file.
+        """
+        pool = multiprocessing.Pool(self.processes, initializer=_init_worker_preparer, initargs=(self.preparer,))
+        try:
+            pending = collections.deque()
+            for chunk in self._iter_chunks():
+                pending.append((chunk, pool.apply_async(_prepare_chunk, (chunk,))))
+                if len(pending) >= 2 * self.processes:
+                    for prepared in self._get_prepared_chunk(*pending.popleft()):
+                        yield prepared
+            while pending:
+                for prepared in self._get_prepared_chunk(*pending.popleft()):
+                    yield prepared
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _iter_chunks(self):
+        chunk = []
         counter = 0
         for data in self.generator:
             counter += 1
-            yield self._create_record(data, counter)
+            chunk.append((counter, data))
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _get_prepared_chunk(self, chunk, async_result):
+        prepared_chunk, date_formats = async_result.get()
+        for name, date_format in date_formats.items():
+            self._worker_date_formats.setdefault(name, date_format)
+        if not self.created_site_codes:
+            return prepared_chunk
+        # The workers validated the rows against the sites that existed at the start of the upload. The rows of a site
+        # created since are prepared again with the current sites.
+        for index, (counter, row) in enumerate(chunk):
+            site_code = self.geo_parser.get_site_code(row) if self.geo_parser.is_valid() else None
+            if site_code is not None and six.text_type(site_code) in self.created_site_codes:
+                prepared_chunk[index] = (counter,) + self.preparer.prepare(row)
+        return prepared_chunk
+
+    def _pop_client_ids(self, data_generator):
+        """
+        Remove the client_id column from the rows (it is not part of the schema) and keep it by row counter.
+        """
+        counter = 0
+        for data in data_generator:
+            counter += 1
+            client_id = data.pop(RecordKeyLookup.CLIENT_ID_COLUMN, None)
+            if not is_blank_value(client_id):
+                self._client_ids[counter] = six.text_type(client_id).strip()
+            yield data
+
+    def _iter_batches(self):
+        prepared_batch = []
+        for prepared in self._iter_prepared():
+            prepared_batch.append(prepared)
+            if len(prepared_batch) >= self.batch_size:
+                for result in self._process_batch(prepared_batch):
+                    yield result
+                prepared_batch = []
+        if prepared_batch:
+            for result in self._process_batch(prepared_batch):
+                yield result
+
+    def _process_batch(self, prepared_batch):
+        """
+        :param prepared_batch: a list of (counter, row, RecordValidatorResult, fields)
+        :return: the list of (record, RecordValidatorResult) of the batch, saved. The links and the summary are
+        updated once the batch is committed.
+        """
+        batch = [self._build_record(*prepared) for prepared in prepared_batch]
+        self._save_batch(batch)
+        self._update_links_and_summary([record for record, validator_result in batch])
+        return batch
+
+    def _save_batch(self, batch):
+        """
+        Insert all the valid records of the batch with a single bulk insert, and update the matched records of an upsert
+        with a single UPDATE.
+        If the bulk insert or the update fails the records are saved one by one, each in its own savepoint, so a faulty row
+        doesn't prevent the others to be saved. The error is then reported on the faulty row.
+        :param batch: a list of (record, RecordValidatorResult)
+        """
+        records = [record for record, validator_result in batch if self._needs_save(record, validator_result)]
+        if not records:
+            return
+        try:
+            with transaction.atomic():
+                # the matched records of an upsert. The deleted ones are inserted back.
+                self._update_records([record for record in records if record.pk is not None])
+                self.record_model.objects.bulk_create([record for record in records if record.pk is None])
+        except Exception:
+            for record, validator_result in batch:
+                if self._needs_save(record, validator_result):
+                    if getattr(record, 'upload_action', None) == ACTION_INSERTED:
+                        # the pk may have been set by the failed bulk insert
+                        record.pk = None
+                    try:
+                        with transaction.atomic():
+                            self._save_record(record)
+                    except Exception as e:
+                        validator_result.add_column_error('unknown', str(e))
+        if self.upsert:
+            for record in [record for record in records if record.pk is not None]:
+                self.key_lookup.add(self.key_lookup.get_key(record.data, record.client_id), record.pk)
 
-    def _create_record(self, row, counter):
+    def _save_record(self, record):
+        if record.pk is not None:
+            self._update_records([record])
+        if record.pk is None:
+            record.save()
+
+    def _update_records(self, records):
+        """
+        Update the matched records of an upsert with a single UPDATE ... FROM (VALUES ...) (see UPSERT_UPDATE_SQL), only
+        if they changed. Set their upload_action: ACTION_UPDATED or ACTION_UNCHANGED, or ACTION_INSERTED with no pk
+        for the records deleted since the start of the upload (to be inserted).
+        """
+        if not records:
+            return
+        params = []
+        for record in records:
+            geometry = record.geometry
+            if geometry is not None and not geometry.srid:
+                geometry = geometry.clone()
+                geometry.srid = MODEL_SRID
+            params += [
+                record.pk,
+                json.dumps(record.data),
+                record.site_id,
+                record.datetime,
+                geometry.hexewkb.decode('ascii') if geometry is not None else None,
+                record.species_name,
+                record.name_id,
+                json.dumps(record.source_info)
+            ]
+        values = ', '.join([self.UPSERT_VALUES_SQL.format(srid=MODEL_SRID)] * len(records))
+        sql = self.UPSERT_UPDATE_SQL.format(values=values, record=self.record_model._meta.db_table)
+        records_by_id = dict((record.pk, record) for record in records)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        for pk, updated, exists in rows:
+            record = records_by_id[pk]
+            if updated:
+                record.upload_action = ACTION_UPDATED
+            elif exists:
+                record.upload_action = ACTION_UNCHANGED
+            else:
+                record.pk = None
+                record.upload_action = ACTION_INSERTED
+
+    @staticmethod
+    def _needs_save(record, validator_result):
+        return record is not None and validator_result.is_valid \
+            and getattr(record, 'upload_action', None) != ACTION_UNCHANGED
+
+    def _create_record(self, counter, row, validator_result, fields):
         """
         :param row: a {column(string): value(string)} dictionary
         :return: record, RecordValidatorResult
         """
-        validator_result = self.validator.validate(row)
+        record, validator_result = self._build_record(counter, row, validator_result, fields)
+        if self.commit and self._needs_save(record, validator_result):
+            try:
+                self._save_record(record)
+                if self.upsert:
+                    self.key_lookup.add(self.key_lookup.get_key(record.data, record.client_id), record.pk)
+            except Exception as e:
+                # catch all errors
+                message = str(e)
+                validator_result.add_column_error('unknown', message)
+        return record, validator_result
+
+    def _build_record(self, counter, row, validator_result, fields):
+        """
+        Build the (unsaved) record from a prepared row (see RecordRowPreparer.prepare).
+        :return: record, RecordValidatorResult
+        """
         record = None
-        # The row values comes as string but we want to save numeric field as json number not string to allow a
-        # correct ordering. The next call will cast the numeric field into python int or float.
-        row = self.schema.cast_numbers(row)
+        client_id = self._client_ids.pop(counter, None)
+        if fields is None:
+            return record, validator_result
         try:
-            if validator_result.is_valid:
-                site = self._get_or_create_site(row)
-                record = self.record_model(
-                    site=site,
-                    dataset=self.dataset,
-                    data=row,
-                    source_info={
-                        'file_name': self.file_name,
-                        'row': counter + 1  # add one to match excel/csv row id
-                    }
-                )
-                # specific fields
-                if self.dataset.type == Dataset.TYPE_OBSERVATION or self.dataset.type == Dataset.TYPE_SPECIES_OBSERVATION:
-                    observation_date = self.schema.cast_record_observation_date(row)
-                    if observation_date:
-                        # convert to datetime with timezone awareness
-                        if isinstance(observation_date, datetime.date):
-                            observation_date = datetime.datetime.combine(observation_date, datetime.time.min)
-                        tz = self.dataset.project.timezone or timezone.get_current_timezone()
-                        record.datetime = timezone.make_aware(observation_date, tz)
-
-                    # geometry
-                    geometry = self.schema.cast_geometry(row, default_srid=self.dataset.project.datum or MODEL_SRID)
-                    record.geometry = geometry
-                    if self.dataset.type == Dataset.TYPE_SPECIES_OBSERVATION:
-                        # species stuff. Lookup for species match in herbie.
-                        # either a species name or a nameId
-                        species_name = self.schema.cast_species_name(row)
-                        name_id = self.schema.cast_species_name_id(row)
-                        # name id takes precedence
-                        if name_id:
-                            species_name = get_key_for_value(self.species_id_by_name, int(name_id), None)
-                            if not species_name:
-                                column_name = self.schema.species_name_parser.name_id_field.name
-                                message = "Cannot find a species with nameId={}".format(name_id)
-                                validator_result.add_column_error(column_name, message)
-                                return record, validator_result
-                        elif species_name:
-                            name_id = int(self.species_id_by_name.get(species_name, -1))
-                        record.species_name = species_name
-                        record.name_id = name_id
-                if self.commit:
-                    record.save()
+            record = self.record_model(
+                site_id=self._get_or_create_site(row),
+                dataset=self.dataset,
+                data=row,
+                source_info={
+                    'file_name': self.file_name,
+                    'row': counter + 1  # add one to match excel/csv row id
+                },
+                **fields
+            )
+            if self.upsert:
+                record = self._match_record(record, client_id, validator_result)
         except Exception as e:
             # catch all errors
             message = str(e)
             validator_result.add_column_error('unknown', message)
         return record, validator_result
 
+    def _match_record(self, record, client_id, validator_result):
+        """
+        Match a new record with the existing record of the same key, from the keys of the lookup: the record gets the id
+        of the existing record, whether it changed is known when it is saved (see _update_records).
+        :return: the record to save
+        """
+        record.client_id = client_id
+        record.upload_action = ACTION_INSERTED
+        key = self.key_lookup.get_key(record.data, client_id)
+        if key is None:
+            return record
+        if key in self._upsert_keys:
+            message = "Duplicate key {} in the file".format(', '.join(key) if isinstance(key, tuple) else key)
+            validator_result.add_column_error(self.key_lookup.key_column, message)
+            return record
+        self._upsert_keys.add(key)
+        pk = self.key_lookup.get_id(key)
+        if pk is None:
+            return record
+        record.pk = pk
+        record.upload_action = ACTION_UPDATED
+        return record
+
+    @property
+    def timezone(self):
+        return self.preparer.timezone
+
+    @property
+    def default_srid(self):
+        return self.preparer.default_srid
+
     def _get_or_create_site(self, row):
-        site = None
+        """
+        :return: the site id or None
+        """
+        site_id = None
         if self.geo_parser.is_valid() and self.geo_parser.is_site_code:
             site_code = self.geo_parser.get_site_code(row)
-            kwargs = {
-                "project": self.dataset.project,
-                "code": site_code
-            }
-            site = Site.objects.filter(**kwargs).first()
-            if site is None and self.create_site:
-                site = Site.objects.create(**kwargs)
-        return site
+            site_id = self.site_lookup.get_site_id(site_code)
+            if site_id is None and self.create_site:
+                site = Site.objects.create(project=self.dataset.project, code=site_code)
+                self.site_lookup.add(site)
+                self.created_site_codes.add(six.text_type(site_code))
+                site_id = site.pk
+        return site_id
+
+
+class CopyRecordCreator(RecordCreator):
+    """
+    Ingest engine for very large files.
+    The rows are validated with the same validator as the RecordCreator but instead of being saved one by one, the valid
+    rows are streamed with COPY into a temporary staging table. The site resolution (join on the site code within the
+    project), the site geometry checks and the datetime and geometry derivation are then done in SQL and the records
+    are inserted with a single INSERT ... SELECT.
+    Iterating over the creator yields the same (record, RecordValidatorResult) tuples as the RecordCreator, once the
+    whole file has been ingested. The yielded records are only loaded with their id.
+    """
+    COPY_CHUNK_SIZE = 10000
+    STAGING_COLUMNS = [
+        ('row_number', 'integer'),
+        ('data', 'jsonb'),
+        ('site_code', 'text'),
+        ('x', 'double precision'),
+        ('y', 'double precision'),
+        ('srid', 'integer'),
+        ('observation_date', 'timestamp'),
+        ('species_name', 'text'),
+        ('name_id', 'integer'),
+        ('source_info', 'jsonb'),
+        ('error', 'text'),
+    ]
+    SITE_NOT_FOUND_ERROR = 'site_not_found'
+    SITE_NO_GEOMETRY_ERROR = 'site_no_geometry'
+
+    def __init__(self, dataset, data_generator, create_site=False, validator=None, species_facade_class=HerbieFacade):
+        super(CopyRecordCreator, self).__init__(dataset, data_generator, commit=True, create_site=create_site,
+                                                validator=validator, species_facade_class=species_facade_class)
+        # the site geometry is resolved in SQL.
+        if isinstance(self.validator, ObservationValidator):
+            self.validator.resolve_site_geometry = False
+        self.is_observation = dataset.type in [Dataset.TYPE_OBSERVATION, Dataset.TYPE_SPECIES_OBSERVATION]
+        self.is_species_observation = dataset.type == Dataset.TYPE_SPECIES_OBSERVATION
+        self.has_site_code = self.geo_parser.is_valid() and self.geo_parser.is_site_code
+        self.staging_table = 'biosys_record_staging_{}'.format(uuid.uuid4().hex)
+
+    def __iter__(self):
+        # Only the results with warnings or errors are kept to save memory.
+        results = []
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                self._create_staging_table(cursor)
+                staging_rows = []
+                counter = 0
+                for data in self.generator:
+                    counter += 1
+                    validator_result, staging_row = self._stage_row(data, counter)
+                    results.append(validator_result if validator_result.warnings or validator_result.errors else None)
+                    if staging_row is not None:
+                        staging_rows.append(staging_row)
+                    if len(staging_rows) >= self.COPY_CHUNK_SIZE:
+                        self._copy_rows(cursor, staging_rows)
+                        staging_rows = []
+                self._copy_rows(cursor, staging_rows)
+                if self.create_site:
+                    self._create_missing_sites(cursor)
+                for row_number, site_code, error in self._validate_sites(cursor):
+                    validator_result = results[row_number - 1] or RecordValidatorResult()
+                    message = self._get_site_error_message(site_code, error)
+                    for field in self.schema.geometry_parser.get_active_fields():
+                        validator_result.add_column_error(field.name, message)
+                    results[row_number - 1] = validator_result
+                record_ids = self._insert_records(cursor)
+                cursor.execute('DROP TABLE {}'.format(self.staging_table))
+            update_record_links(self.dataset, record_ids.values())
+            add_records_to_summary(self.dataset, record_ids.values())
+        for index, validator_result in enumerate(results):
+            validator_result = validator_result or RecordValidatorResult()
+            record_id = record_ids.get(index + 1)
+            record = self.record_model(pk=record_id, dataset=self.dataset) if record_id is not None else None
+            yield record, validator_result
+
+    def _stage_row(self, row, counter):
+        """
+        Validate and cast the row.
+        :return: RecordValidatorResult, the staging row values (None if the row is not valid)
+        """
+        processed_row = self.preparer.row_processor.process(row)
+        validator_result = self.validator.validate(row, processed_row=processed_row)
+        if not validator_result.is_valid:
+            return validator_result, None
+        row = processed_row.cast_numbers()
+        site_code, x, y, srid, observation_date, species_name, name_id = (None,) * 7
+        try:
+            if self.has_site_code:
+                site_code = self.geo_parser.get_site_code(row)
+            if self.is_observation:
+                observation_date = self.preparer.cast_observation_date(row, processed_row=processed_row)
+                point = self.schema.geometry_parser.cast_point(row, default_srid=self.default_srid)
+                if point is not None:
+                    x, y, srid = point.x, point.y, point.srid
+                if self.is_species_observation:
+                    species_name, name_id = self.preparer.cast_species(row, validator_result)
+                    if not validator_result.is_valid:
+                        return validator_result, None
+        except Exception as e:
+            # catch all errors
+            validator_result.add_column_error('unknown', str(e))
+            return validator_result, None
+        source_info = {
+            'file_name': self.file_name,
+            'row': counter + 1  # add one to match excel/csv row id
+        }
+        staging_row = [
+            counter,
+            json.dumps(row),
+            site_code,
+            x,
+            y,
+            srid,
+            observation_date.isoformat() if observation_date else None,
+            species_name,
+            int(name_id) if name_id else name_id,
+            json.dumps(source_info),
+            None
+        ]
+        return validator_result, staging_row
+
+    @staticmethod
+    def _to_copy_value(value):
+        """
+        Format a value for the COPY text format.
+        """
+        if value is None:
+            return '\\N'
+        value = six.text_type(value)
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+    def _create_staging_table(self, cursor):
+        columns = ', '.join('{} {}'.format(name, type_) for name, type_ in self.STAGING_COLUMNS)
+        cursor.execute('CREATE TEMPORARY TABLE {} ({}) ON COMMIT DROP'.format(self.staging_table, columns))
+
+    def _copy_rows(self, cursor, staging_rows):
+        """
+        Transform the points of the rows in the model srid and COPY the rows into the staging table.
+        """
+        self._transform_points(staging_rows)
+        buffer = six.StringIO()
+        for staging_row in staging_rows:
+            buffer.write('\t'.join(self._to_copy_value(value) for value in staging_row) + '\n')
+        self._copy(cursor, buffer)
+
+    @staticmethod
+    def _transform_points(staging_rows):
+        """
+        Batch transform the x, y of the staging rows into the model srid, one transformation per source srid.
+        """
+        rows_by_srid = collections.defaultdict(list)
+        for staging_row in staging_rows:
+            x, y, srid = staging_row[3:6]
+            if x is not None and srid != MODEL_SRID:
+                rows_by_srid[srid].append(staging_row)
+        for srid, rows in rows_by_srid.items():
+            coordinates = transform_coordinates([(row[3], row[4]) for row in rows], srid, MODEL_SRID)
+            for row, (x, y) in zip(rows, coordinates):
+                row[3:6] = [x, y, MODEL_SRID]
+
+    def _copy(self, cursor, buffer):
+        if buffer.tell() == 0:
+            return
+        buffer.seek(0)
+        columns = ', '.join(name for name, _ in self.STAGING_COLUMNS)
+        cursor.copy_expert('COPY {} ({}) FROM STDIN'.format(self.staging_table, columns), buffer)
+
+    def _create_missing_sites(self, cursor):
+        """
+        Create the sites that don't exist yet from the rows with coordinates (same rule as the RecordCreator: a row
+        without coordinates referencing an unknown site is an error).
+        """
+        sql = """
+            INSERT INTO main_site (project_id, code, name)
+            SELECT DISTINCT %(project)s, s.site_code, ''
+            FROM {staging} s
+            WHERE s.site_code IS NOT NULL AND s.site_code <> ''
+            AND (s.x IS NOT NULL OR NOT %(is_observation)s)
+            AND NOT EXISTS (
+                SELECT 1 FROM main_site site WHERE site.project_id = %(project)s AND site.code = s.site_code
+            )
+        """.format(staging=self.staging_table)
+        cursor.execute(sql, {
+            'project': self.dataset.project.pk,
+            'is_observation': self.is_observation
+        })
+
+    def _validate_sites(self, cursor):
+        """
+        Set based validation of the observation rows without coordinates: the site must exist in the project and
+        have a geometry.
+        :return: a list of (row_number, site_code, error) for the rows in error
+        """
+        if not self.is_observation or not self.has_site_code:
+            return []
+        sql = """
+            UPDATE {staging} s SET error = CASE
+                WHEN NOT EXISTS (
+                    SELECT 1 FROM main_site site WHERE site.project_id = %(project)s AND site.code = s.site_code
+                ) THEN %(not_found)s
+                ELSE %(no_geometry)s
+            END
+            WHERE s.x IS NULL AND NOT EXISTS (
+                SELECT 1 FROM main_site site
+                WHERE site.project_id = %(project)s AND site.code = s.site_code AND site.geometry IS NOT NULL
+            )
+            RETURNING s.row_number, s.site_code, s.error
+        """.format(staging=self.staging_table)
+        cursor.execute(sql, {
+            'project': self.dataset.project.pk,
+            'not_found': self.SITE_NOT_FOUND_ERROR,
+            'no_geometry': self.SITE_NO_GEOMETRY_ERROR
+        })
+        return cursor.fetchall()
+
+    def _get_site_error_message(self, site_code, error):
+        # same messages as the GeometryParser
+        if error == self.SITE_NOT_FOUND_ERROR:
+            return 'The site {} does not exist'.format(site_code)
+        if self.schema.geometry_parser.is_site_code_only:
+            return 'The site {} has no geometry'.format(site_code)
+        return 'No Latitude/Longitude Easting/Northing or Site Code found!'
+
+    def _insert_records(self, cursor):
+        """
+        Insert all the valid staged rows into the record table.
+        :return: a dict row_number => record id
+        """
+        sql = """
+            INSERT INTO main_record (
+                dataset_id, data, site_id, datetime, geometry, species_name, name_id, source_info,
+                validated, locked, created, last_modified
+            )
+            SELECT
+                %(dataset)s,
+                s.data,
+                site.id,
+                s.observation_date AT TIME ZONE %(timezone)s,
+                CASE
+                    WHEN s.x IS NOT NULL THEN ST_Transform(ST_SetSRID(ST_MakePoint(s.x, s.y), s.srid), %(srid)s)
+                    WHEN %(is_observation)s THEN site.geometry
+                END,
+                s.species_name,
+                COALESCE(s.name_id, -1),
+                s.source_info,
+                FALSE, FALSE, now(), now()
+            FROM {staging} s
+            LEFT JOIN main_site site ON site.project_id = %(project)s AND site.code = s.site_code
+            WHERE s.error IS NULL
+            ORDER BY s.row_number
+            RETURNING id, (source_info ->> 'row')::integer
+        """.format(staging=self.staging_table)
+        cursor.execute(sql, {
+            'dataset': self.dataset.pk,
+            'project': self.dataset.project.pk,
+            'timezone': six.text_type(self.timezone),
+            'srid': MODEL_SRID,
+            'is_observation': self.is_observation
+        })
+        # the row in source_info is the excel row (row_number + 1)
+        return dict((row - 1, record_id) for record_id, row in cursor.fetchall())
+
+
+ORM_ENGINE = 'orm'
+COPY_ENGINE = 'copy'
+ENGINES = [ORM_ENGINE, COPY_ENGINE]
+
+# the actions of an upsert upload
+ACTION_INSERTED = 'inserted'
+ACTION_UPDATED = 'updated'
+ACTION_UNCHANGED = 'unchanged'
+ACTIONS = [ACTION_INSERTED, ACTION_UPDATED, ACTION_UNCHANGED]
+
+
+def get_record_creator(dataset, data_generator, options, species_facade_class=HerbieFacade):
+    """
+    Build the record creator of a records upload.
+    The same options are used by the upload view, the upload jobs and the upload_records command.
+    :param dataset:
+    :param data_generator: a row generator, usually a FileReader
+    :param options: a dict with the keys: create_site, strict, engine, batch_size, processes and upsert
+    (see DatasetUploadRecordsView)
+    :param species_facade_class:
+    :return: a RecordCreator
+    """
+    validator = get_record_validator_for_dataset(dataset)
+    validator.schema_error_as_warning = not options.get('strict', False)
+    create_site = options.get('create_site', False)
+    if options.get('engine') == COPY_ENGINE:
+        return CopyRecordCreator(dataset, data_generator, validator=validator, create_site=create_site,
+                                 species_facade_class=species_facade_class)
+    return RecordCreator(dataset, data_generator, validator=validator, create_site=create_site, commit=True,
+                         species_facade_class=species_facade_class, batch_size=options.get('batch_size'),
+                         processes=options.get('processes'), upsert=options.get('upsert', False))
+
+
+def get_record_upload_result(row, record, validator_result):
+    """
+    The report of an uploaded record row.
+    :param row: the row number (excel like)
+    :param record: the created record
+    :param validator_result: the RecordValidatorResult
+    :return: a dict {row, recordId, errors, warnings} plus the action for an upsert upload. No recordId (and no action)
+    if the row has errors.
+    """
+    result = {
+        'row': row
+    }
+    if not validator_result.has_errors:
+        result['recordId'] = record.id
+        if hasattr(record, 'upload_action'):
+            result['action'] = record.upload_action
+    result.update(validator_result.to_dict())
+    return result
+
+
+class RecordUploadReport(object):
+    """
+    Number the uploaded rows, build their results (see get_record_upload_result) and count them for the summary.
+    """
+
+    def __init__(self, upsert=False):
+        self.row = 1  # starts at 1 to match excel row id
+        self.total = 0
+        self.failed = 0
+        self.with_warnings = 0
+        # the count per action of an upsert upload
+        self.actions = collections.OrderedDict((action, 0) for action in ACTIONS) if upsert else None
+
+    @property
+    def has_errors(self):
+        return self.failed > 0
+
+    def add(self, record, validator_result):
+        """
+        :return: the result of the row
+        """
+        self.row += 1
+        self.total += 1
+        if validator_result.has_errors:
+            self.failed += 1
+        if validator_result.warnings:
+            self.with_warnings += 1
+        result = get_record_upload_result(self.row, record, validator_result)
+        if self.actions is not None and result.get('action') in self.actions:
+            self.actions[result['action']] += 1
+        return result
+
+    @property
+    def summary(self):
+        summary = {
+            'total': self.total,
+            'succeeded': self.total - self.failed,
+            'failed': self.failed,
+            'withWarnings': self.with_warnings
+        }
+        if self.actions is not None:
+            summary.update(self.actions)
+        return summary
+
+
+def get_site_upload_result(site, error):
+    """
+    The report of an uploaded site row.
+    :param site: the created or updated site or None
+    :param error: the error or None
+    :return: a dict {site: pk|None, error: msg|None}
+    """
+    return {
+        'site': site.pk if site else None,
+        'error': str(error) if error else None
+    }
 
 
 class DataPackageBuilder:
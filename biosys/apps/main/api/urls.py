@@ -17,6 +17,7 @@ router.register(r'records?', api_views.RecordViewSet, 'record')
 router.register(r'media', api_views.MediaViewSet, 'media')
 router.register(r'project-media', api_views.ProjectMediaViewSet, 'project-media')
 router.register(r'dataset-media', api_views.DatasetMediaViewSet, 'dataset-media')
+router.register(r'upload-jobs?', api_views.UploadJobViewSet, 'upload-job')
 
 
 url_patterns = [
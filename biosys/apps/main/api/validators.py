@@ -1,5 +1,7 @@
 from main.constants import MODEL_SRID
 from main.models import Dataset
+from main.utils_data_package import SiteLookup
+from main.utils_species import SpeciesIndex
 
 
 def get_record_validator_for_dataset(dataset, **kwargs):
@@ -63,39 +65,41 @@ class GenericRecordValidator(object):
         self.schema = dataset.schema
         self.schema_error_as_warning = schema_error_as_warning
         self.default_srid = dataset.project.datum or MODEL_SRID
+        # the project sites. Can be shared with the caller (e.g. an upload) to avoid querying the same site many times.
+        self.site_lookup = kwargs.get('site_lookup') or SiteLookup(dataset.project, prefetch=False)
 
-    def validate(self, data):
-        return self.validate_schema(data)
+    def validate(self, data, processed_row=None):
+        return self.validate_schema(data, processed_row=processed_row)
 
-    def validate_schema(self, data):
+    def validate_schema(self, data, processed_row=None):
         """
         :param data: must be a dictionary or a list of key => value
+        :param processed_row: the result of schema.row_processor.process(data) if the caller already has it.
         :return: a RecordValidatorResult. To obtain the result as dict call the to_dict method of the result.
         """
-        data = dict(data)
+        if processed_row is None:
+            processed_row = self.schema.row_processor.process(data)
         result = RecordValidatorResult()
-        for field_name, value in data.items():
-            try:
-                schema_error_msg = self.schema.field_validation_error(field_name, value)
-            except Exception as e:
-                schema_error_msg = str(e)
-            if schema_error_msg:
-                if self.schema_error_as_warning:
-                    result.add_column_warning(field_name, schema_error_msg)
-                else:
-                    result.add_column_error(field_name, schema_error_msg)
+        for field_name, schema_error_msg in processed_row.errors:
+            if self.schema_error_as_warning:
+                result.add_column_warning(field_name, schema_error_msg)
+            else:
+                result.add_column_error(field_name, schema_error_msg)
         # check for missing required fields
-        for field in self.schema.required_fields:
-            if field.name not in data:
-                msg = "The field '{}' is missing".format(field.name)
-                if self.schema_error_as_warning:
-                    result.add_column_warning(field.name, msg)
-                else:
-                    result.add_column_error(field.name, msg)
+        for field in processed_row.missing_fields:
+            msg = "The field '{}' is missing".format(field.name)
+            if self.schema_error_as_warning:
+                result.add_column_warning(field.name, msg)
+            else:
+                result.add_column_error(field.name, msg)
         return result
 
 
 class ObservationValidator(GenericRecordValidator):
+    # If False, a record without coordinates but with a site code is considered valid without looking up the site.
+    # The caller is then responsible for resolving the site geometry (see the CopyRecordCreator).
+    resolve_site_geometry = True
+
     def __init__(self, dataset, schema_error_as_warning=True, **kwargs):
         super(ObservationValidator, self).__init__(dataset, schema_error_as_warning, **kwargs)
         self.date_col = self.schema.observation_date_field.name if self.schema.observation_date_field else None
@@ -105,8 +109,10 @@ class ObservationValidator(GenericRecordValidator):
         self.geometry_parser = self.schema.geometry_parser
         self.date_parser = self.schema.date_parser
 
-    def validate(self, data):
-        result = super(ObservationValidator, self).validate(data)
+    def validate(self, data, processed_row=None):
+        if processed_row is None:
+            processed_row = self.schema.row_processor.process(data)
+        result = super(ObservationValidator, self).validate(data, processed_row=processed_row)
         # every schema validation warnings become errors if they concern geometry or date stuff.
         for field in self.geometry_parser.get_active_fields():
             if field.name in result.warnings:
@@ -120,15 +126,15 @@ class ObservationValidator(GenericRecordValidator):
 
         # validate the date and the geometry values. To be done only if there's no schema error
         if not result.has_errors:
-            result = result.merge(self.validate_date(data))
+            result = result.merge(self.validate_date(data, processed_row=processed_row))
             result = result.merge(self.validate_geometry(data))
         return result
 
-    def validate_date(self, data):
+    def validate_date(self, data, processed_row=None):
         result = RecordValidatorResult()
         date_field = self.schema.observation_date_field
         try:
-            self.schema.cast_record_observation_date(data)
+            self.schema.cast_record_observation_date(data, processed_row=processed_row)
         except Exception as e:
             msg = str(e)
             result.add_column_error(date_field.name, msg)
@@ -137,7 +143,13 @@ class ObservationValidator(GenericRecordValidator):
     def validate_geometry(self, data):
         result = RecordValidatorResult()
         try:
-            self.schema.cast_geometry(data, default_srid=self.default_srid or MODEL_SRID)
+            default_srid = self.default_srid or MODEL_SRID
+            if self.resolve_site_geometry:
+                self.schema.cast_geometry(data, default_srid=default_srid, site_lookup=self.site_lookup)
+            elif self.geometry_parser.cast_point(data, default_srid=default_srid) is None \
+                    and not self.geometry_parser.get_site_code(data):
+                # no coordinates and no site. Let the parser raise the error.
+                self.schema.cast_geometry(data, default_srid=default_srid, site_lookup=self.site_lookup)
         except Exception as e:
             msg = str(e)
             # the fields involved in the geometry can be many.
@@ -150,12 +162,16 @@ class ObservationValidator(GenericRecordValidator):
 
 class SpeciesObservationValidator(ObservationValidator):
     def __init__(self, dataset, schema_error_as_warning=True, **kwargs):
-        super(SpeciesObservationValidator, self).__init__(dataset, schema_error_as_warning)
+        super(SpeciesObservationValidator, self).__init__(dataset, schema_error_as_warning, **kwargs)
         self.parser = self.schema.species_name_parser
-        self.species_name_id_mapping = kwargs.get('species_name_id_mapping')
-
-    def validate(self, data, schema_error_as_warning=True):
-        result = super(SpeciesObservationValidator, self).validate(data)
+        # a SpeciesIndex or a species_name -> name_id dict
+        species_name_id_mapping = kwargs.get('species_name_id_mapping')
+        if species_name_id_mapping is not None and not isinstance(species_name_id_mapping, SpeciesIndex):
+            species_name_id_mapping = SpeciesIndex(species_name_id_mapping)
+        self.species_name_id_mapping = species_name_id_mapping
+
+    def validate(self, data, schema_error_as_warning=True, processed_row=None):
+        result = super(SpeciesObservationValidator, self).validate(data, processed_row=processed_row)
         # every schema validation warnings become errors if they concern species stuff.
         for field in self.parser.get_active_fields():
             if field.name in result.warnings:
@@ -172,7 +188,7 @@ class SpeciesObservationValidator(ObservationValidator):
         if self.parser.has_name_id:
             name_id = self.parser.cast_species_name_id(data)
             if name_id and self.species_name_id_mapping is not None:
-                if name_id not in self.species_name_id_mapping.values():
+                if not self.species_name_id_mapping.has_name_id(name_id):
                     message = "Cannot find a species with nameId={}".format(name_id)
                     result.add_column_error(self.parser.name_id_field.name, message)
         return result
@@ -2,16 +2,21 @@ from __future__ import absolute_import, unicode_literals, print_function, divisi
 
 import datetime
 import logging
+import multiprocessing
 from collections import OrderedDict
 from os import path
 
 from django.contrib.auth import get_user_model, logout
 from django.core.files.uploadhandler import TemporaryFileUploadHandler
-from django.db.models import Q
+from django.db.models import Q, Count, Sum, Min, Max
+from django.db.models.functions import Coalesce
+from django.http import FileResponse
 from django.shortcuts import get_object_or_404
 from django.conf import settings
 from dry_rest_permissions.generics import DRYPermissions
 from rest_framework import viewsets, generics, status
+from rest_framework.decorators import detail_route
+from rest_framework.exceptions import ValidationError
 from rest_framework.parsers import MultiPartParser, FormParser, FileUploadParser, JSONParser
 from rest_framework.permissions import IsAuthenticated, BasePermission, SAFE_METHODS
 from rest_framework.views import APIView, Response
@@ -20,15 +25,24 @@ from rest_framework.settings import import_from_string
 from main import models, constants
 from main.api import serializers
 from main.api import filters
-from main.api.helpers import to_bool
-from main.api.uploaders import SiteUploader, FileReader, RecordCreator, DataPackageBuilder
-from main.api.validators import get_record_validator_for_dataset
-from main.models import Project, Site, Dataset, Record
+from main.api import db_render
+from main.api.pagination import RecordPagination
+from main.api.helpers import to_bool, get_search_mode
+from main.api import uploaders
+from main.api.uploaders import SiteUploader, FileReader, RecordCreator, DataPackageBuilder, RecordUploadReport, \
+    get_record_creator, get_site_upload_result
+from main.models import Project, Site, Dataset, Record, DatasetSpecies
 from main.utils_auth import is_admin
+from main.utils_data_package import SiteLookup, transform_geometry
+from main.utils_delete import delete_records, delete_dataset, delete_project
+from main.utils_index import sync_dataset_indexes
+from main.utils_links import update_record_links
+from main.utils_summary import mark_summaries_stale, remove_records_from_summary, refresh_dataset_summary, \
+    get_record_counts, get_estimated_count
 from main.api.exporters import DefaultExporter
-from main.utils_http import WorkbookResponse, CSVFileResponse
+from main.utils_http import WorkbookResponse, CSVFileResponse, NDJSONStreamingResponse, JSONRowsStreamingResponse
 from main.utils_species import NoSpeciesFacade
-from main.utils_misc import search_json_fields, order_by_json_field
+from main.utils_misc import search_records, order_by_json_field, select_json_keys
 
 
 logger = logging.getLogger(__name__)
@@ -87,10 +101,16 @@ class ProgramViewSet(viewsets.ModelViewSet):
 
 class ProjectViewSet(viewsets.ModelViewSet):
     permission_classes = (IsAuthenticated, DRYPermissions)
-    queryset = models.Project.objects.all()
+    # the record count of the projects, summed from the dataset summaries (see ProjectSerializer)
+    queryset = models.Project.objects.annotate(
+        summary_record_count=Coalesce(Sum('projects__summary__record_count'), 0)
+    )
     serializer_class = serializers.ProjectSerializer
     filter_class = filters.ProjectFilterSet
 
+    def perform_destroy(self, instance):
+        delete_project(instance)
+
 
 class ProjectPermission(BasePermission):
     def has_permission(self, request, view):
@@ -161,6 +181,18 @@ class ProjectSitesUploadView(APIView):
             msg = "Wrong file type {}. Should be one of: {}".format(file_obj.content_type, SiteUploader.SUPPORTED_TYPES)
             return Response(msg, status=status.HTTP_501_NOT_IMPLEMENTED)
 
+        # async mode: the file is stored and processed later by the process_upload_jobs command.
+        if 'async' in request.data and to_bool(request.data['async']):
+            job = models.UploadJob.objects.create(
+                type=models.UploadJob.TYPE_SITES,
+                project=self.project,
+                file=file_obj,
+                file_name=file_obj.name,
+                content_type=file_obj.content_type,
+                created_by=request.user
+            )
+            return Response(serializers.UploadJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
         uploader = SiteUploader(file_obj, self.project)
         data = {}
         # return an item by parsed row
@@ -170,16 +202,9 @@ class ProjectSitesUploadView(APIView):
         row = 0
         for site, error in uploader:
             row += 1
-            result = {
-                'site': None,
-                'error': None
-            }
-            if site:
-                result['site'] = site.pk
             if error:
                 has_error = True
-                result['error'] = str(error)
-            data[row] = result
+            data[row] = get_site_upload_result(site, error)
         uploader.close()
         status_code = status.HTTP_200_OK if not has_error else status.HTTP_400_BAD_REQUEST
         return Response(data, status=status_code)
@@ -206,6 +231,7 @@ class SiteViewSet(viewsets.ModelViewSet):
         serializer.save()
         instance.refresh_from_db()
         if instance.geometry is not None:
+            mark_summaries_stale(records.values_list('dataset_id', flat=True).distinct())
             records.update(geometry=instance.geometry)
 
 
@@ -213,7 +239,37 @@ class DatasetViewSet(viewsets.ModelViewSet):
     permission_classes = (IsAuthenticated, DRYPermissions)
     serializer_class = serializers.DatasetSerializer
     filter_class = filters.DatasetFilterSet
-    queryset = models.Dataset.objects.all().distinct()
+    queryset = models.Dataset.objects.all().distinct().select_related('summary')
+
+    def perform_create(self, serializer):
+        super(DatasetViewSet, self).perform_create(serializer)
+        refresh_dataset_summary(serializer.instance)
+        self.sync_indexes(serializer.instance)
+
+    def perform_update(self, serializer):
+        links_descriptor = serializer.instance.links_descriptor
+        super(DatasetViewSet, self).perform_update(serializer)
+        if serializer.instance.links_descriptor != links_descriptor:
+            update_record_links(serializer.instance)
+        self.sync_indexes(serializer.instance)
+
+    def perform_destroy(self, instance):
+        delete_dataset(instance)
+
+    @staticmethod
+    def sync_indexes(dataset):
+        # only registered: the indexes are built concurrently by the worker (see build_pending_indexes)
+        sync_dataset_indexes(dataset, build=False)
+
+    @detail_route(methods=['get'])
+    def indexes(self, request, *args, **kwargs):
+        """
+        The database indexes of the records data of the dataset.
+        The fields declared with biosys.index = true in the schema are indexed.
+        """
+        dataset = self.get_object()
+        serializer = serializers.DatasetIndexSerializer(dataset.indexes.all(), many=True)
+        return Response(serializer.data)
 
 
 class DatasetRecordsPermission(BasePermission):
@@ -235,10 +291,94 @@ class SpeciesMixin(object):
             logger.exception(msg)
 
 
-class DatasetRecordsView(generics.ListAPIView, generics.DestroyAPIView, SpeciesMixin):
+class RecordListMixin(object):
+    """
+    The record lists:
+    - only the columns of the serialized fields (query param fields) are loaded, and the parent and children are
+    resolved only if serialized (see RecordListSerializer).
+    - data_fields: only these keys of the data are serialized, extracted by the database.
+    - render=db: the opt-in fast path, the json of the records is built by postgres and streamed without model or
+    serializer instances (see main.api.db_render), in the same response as the serializer. The cursor pagination falls
+    back to the serializer.
+    """
+    data_fields_query_param = 'data_fields'
+    render_query_param = 'render'
+    DB_RENDER = 'db'
+
+    def get_list_fields(self):
+        """
+        :return: the names of the serializer fields, after the fields and relations query params
+        """
+        return list(self.get_serializer_class()(context=self.get_serializer_context()).fields.keys())
+
+    def get_data_keys(self, request):
+        """
+        :return: the keys of the data to serialize, None for all
+        """
+        return request.query_params.getlist(self.data_fields_query_param) or None
+
+    def project_queryset(self, queryset, fields, data_keys=None):
+        """
+        Load only the columns of the serialized fields, and of the dataset for the parent and children.
+        """
+        model_fields = [field.name for field in Record._meta.concrete_fields]
+        columns = set(field for field in fields if field in model_fields) | {'id', 'dataset'}
+        if data_keys is not None and 'data' in columns:
+            columns.remove('data')
+            queryset = select_json_keys(queryset, 'data', data_keys)
+        return queryset.only(*columns)
+
+    def get_db_render_response(self, request, fields):
+        """
+        :return: the streamed response or None if the list is not rendered by the database.
+        """
+        if request.query_params.get(self.render_query_param) != self.DB_RENDER or \
+                self.paginator.is_cursor_request(request) or not db_render.can_render(fields):
+            return None
+        queryset = self.filter_queryset(self.get_queryset())
+        # the page is selected on the ids only, the json is built for the records of the page
+        page = self.paginate_queryset(queryset.values_list('pk', flat=True))
+        if page is not None:
+            queryset = queryset.filter(pk__in=page)
+        # the link columns are only computed for the datasets of the listed records
+        datasets = [self.dataset] if self.dataset else Dataset.objects.filter(
+            pk__in=queryset.order_by().values('dataset_id')
+        ).only('pk', 'data_package')
+        kwargs = {
+            'parent_dataset_ids': [dataset.pk for dataset in datasets if dataset.has_foreign_keys],
+            'children_dataset_ids': [dataset.pk for dataset in datasets if dataset.has_primary_key],
+            'data_keys': self.get_data_keys(request)
+        }
+        rows = db_render.get_records_json(queryset, fields, **kwargs)
+        if page is None:
+            return JSONRowsStreamingResponse(rows.iterator())
+        envelope = self.paginator.get_paginated_response([]).data
+        envelope.pop('results')
+        return JSONRowsStreamingResponse(rows, envelope=envelope)
+
+    def list_records(self, request):
+        """
+        The list of ListModelMixin with the queryset projected on the serialized fields, or rendered by the database.
+        """
+        fields = self.get_list_fields()
+        response = self.get_db_render_response(request, fields)
+        if response is not None:
+            return response
+        queryset = self.project_queryset(self.filter_queryset(self.get_queryset()), fields,
+                                         data_keys=self.get_data_keys(request))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+
+class DatasetRecordsView(generics.ListAPIView, generics.DestroyAPIView, SpeciesMixin, RecordListMixin):
     permission_classes = (IsAuthenticated, DatasetRecordsPermission)
     # TODO: the filters don't appear in the swagger
     filter_class = filters.RecordFilterSet
+    pagination_class = RecordPagination
 
     def __init__(self, **kwargs):
         super(DatasetRecordsView, self).__init__(**kwargs)
@@ -277,16 +417,13 @@ class DatasetRecordsView(generics.ListAPIView, generics.DestroyAPIView, SpeciesM
         if self.dataset:
             queryset = self.dataset.record_queryset
 
+            ordering_param = self.request.query_params.get('ordering')
             search_param = self.request.query_params.get('search')
-            if search_param is not None:
-                field_info = {
-                    'data': self.dataset.schema.field_names,
-                    'source_info': ['file_name', 'row']
-                }
+            if search_param:
+                # ranked by relevance unless ordered
+                queryset = search_records(queryset, search_param, mode=get_search_mode(self.request),
+                                          rank=ordering_param is None)
 
-                queryset = search_json_fields(queryset, field_info, search_param)
-
-            ordering_param = self.request.query_params.get('ordering')
             if ordering_param is not None:
                 queryset = order_by_json_field(queryset, 'data', self.dataset.schema.field_names, ordering_param)
                 queryset = order_by_json_field(queryset, 'source_info', ['file_name', 'row'], ordering_param)
@@ -305,7 +442,7 @@ class DatasetRecordsView(generics.ListAPIView, generics.DestroyAPIView, SpeciesM
         """
         if not self.dataset:
             self.dataset = get_object_or_404(models.Dataset, pk=kwargs.get('pk'))
-        return super(DatasetRecordsView, self).list(request, *args, **kwargs)
+        return self.list_records(request)
 
     def destroy(self, request, *args, **kwargs):
         record_ids = request.data
@@ -315,16 +452,17 @@ class DatasetRecordsView(generics.ListAPIView, generics.DestroyAPIView, SpeciesM
             qs = Record.objects.filter(dataset=self.dataset)
         else:
             return Response("A list of record ids must be provided or 'all'", status=status.HTTP_400_BAD_REQUEST)
-        qs.delete()
+        delete_records(qs)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class RecordViewSet(viewsets.ModelViewSet, SpeciesMixin):
+class RecordViewSet(viewsets.ModelViewSet, SpeciesMixin, RecordListMixin):
     # TODO: implement a patch for the data JSON field. Ability to partially update some of the data properties.
     permission_classes = (IsAuthenticated, DRYPermissions)
     queryset = models.Record.objects.all()
     serializer_class = serializers.RecordSerializer
     filter_class = filters.RecordFilterSet
+    pagination_class = RecordPagination
 
     def __init__(self, **kwargs):
         super(RecordViewSet, self).__init__(**kwargs)
@@ -347,16 +485,13 @@ class RecordViewSet(viewsets.ModelViewSet, SpeciesMixin):
         queryset = super(RecordViewSet, self).get_queryset()
         if self.dataset:
             # add some specific json field queries (postgres)
+            ordering_param = self.request.query_params.get('ordering')
             search_param = self.request.query_params.get('search')
-            if search_param is not None:
-                field_info = {
-                    'data': self.dataset.schema.field_names,
-                    'source_info': ['file_name', 'row']
-                }
+            if search_param:
+                # ranked by relevance unless ordered
+                queryset = search_records(queryset, search_param, mode=get_search_mode(self.request),
+                                          rank=ordering_param is None)
 
-                queryset = search_json_fields(queryset, field_info, search_param)
-
-            ordering_param = self.request.query_params.get('ordering')
             if ordering_param is not None:
                 queryset = order_by_json_field(queryset, 'data', self.dataset.schema.field_names, ordering_param)
                 queryset = order_by_json_field(queryset, 'source_info', ['file_name', 'row'], ordering_param)
@@ -407,13 +542,17 @@ class RecordViewSet(viewsets.ModelViewSet, SpeciesMixin):
                 exporter.to_csv(response)
             return response
         else:
-            return super(RecordViewSet, self).list(request, *args, **kwargs)
+            return self.list_records(request)
 
     def update(self, request, *args, **kwargs):
         instance = self.get_object()
         self.dataset = instance.dataset
         return super(RecordViewSet, self).update(request, *args, **kwargs)
 
+    def perform_destroy(self, instance):
+        remove_records_from_summary([instance.pk])
+        super(RecordViewSet, self).perform_destroy(instance)
+
 
 class MediaViewSet(viewsets.ModelViewSet):
     permission_classes = (IsAuthenticated, DRYPermissions)
@@ -457,51 +596,95 @@ class DatasetMediaViewSet(viewsets.ModelViewSet):
             return serializers.DatasetMediaSerializer
 
 
+class UploadJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    The asynchronous upload jobs. Poll a job to follow its progress, the per row report is available at
+    upload-jobs/{pk}/report once the job is completed.
+    """
+    permission_classes = (IsAuthenticated, DRYPermissions)
+    serializer_class = serializers.UploadJobSerializer
+    queryset = models.UploadJob.objects.all()
+    filter_fields = ('id', 'type', 'status', 'project', 'dataset')
+
+    @detail_route(methods=['get'])
+    def report(self, request, *args, **kwargs):
+        job = self.get_object()
+        if job.status != models.UploadJob.STATUS_COMPLETED or not job.report:
+            msg = "The report of the job {} is not available. Job status: {}".format(job.pk, job.status)
+            return Response(msg, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(job.report.open('rb'), content_type='application/json')
+
+
 class StatisticsView(APIView):
+    """
+    The number of projects, datasets, records and sites, by dataset type.
+    The record counts are read from the dataset summaries, the record table is not scanned. Query params:
+    estimate=true: the totals are estimated from the postgres statistics instead of being counted.
+    by_project=true: add the counts of each project in projects.breakdown.
+    """
     permission_classes = (IsAuthenticated,)
+    dataset_types = [
+        ('generic', Dataset.TYPE_GENERIC),
+        ('observation', Dataset.TYPE_OBSERVATION),
+        ('speciesObservation', Dataset.TYPE_SPECIES_OBSERVATION),
+    ]
 
     def get(self, request, **kwargs):
+        estimate = to_bool(request.query_params.get('estimate', False))
+        dataset_counts = dict(Dataset.objects.values_list('type').annotate(Count('id')).order_by())
+        record_counts = get_record_counts('type')
+        if estimate:
+            totals = {model: get_estimated_count(model) for model in [Project, Dataset, Record, Site]}
+        else:
+            totals = {
+                Project: Project.objects.count(),
+                Dataset: sum(dataset_counts.values()),
+                Record: sum(record_counts.values()),
+                Site: Site.objects.count(),
+            }
         data = OrderedDict()
-        qs = Project.objects.all()
         data['projects'] = {
-            'total': qs.count()
+            'total': totals[Project]
         }
-        qs = Dataset.objects.all()
-        data['datasets'] = OrderedDict([
-            ('total', qs.count()),
-            ('generic', {
-                'total': qs.filter(type=Dataset.TYPE_GENERIC).count()
-            }),
-            ('observation', {
-                'total': qs.filter(type=Dataset.TYPE_OBSERVATION).count()
-            }),
-            ('speciesObservation', {
-                'total': qs.filter(type=Dataset.TYPE_SPECIES_OBSERVATION).count()
-            }),
-        ])
-        # records
-        total_records_count = Record.objects.count()
-        generic_record_count = Record.objects.filter(dataset__type=Dataset.TYPE_GENERIC).count()
-        observation_record_count = Record.objects.filter(dataset__type=Dataset.TYPE_OBSERVATION).count()
-        species_observation_count = Record.objects.filter(dataset__type=Dataset.TYPE_SPECIES_OBSERVATION).count()
-        data['records'] = OrderedDict([
-            ('total', total_records_count),
-            ('generic', {
-                'total': generic_record_count
-            }),
-            ('observation', {
-                'total': observation_record_count
-            }),
-            ('speciesObservation', {
-                'total': species_observation_count
-            }),
-        ])
-        qs = Site.objects.all()
+        data['datasets'] = self.get_counts_by_type(totals[Dataset], dataset_counts)
+        data['records'] = self.get_counts_by_type(totals[Record], record_counts)
         data['sites'] = {
-            'total': qs.count()
+            'total': totals[Site]
         }
+        if to_bool(request.query_params.get('by_project', False)):
+            data['projects']['breakdown'] = self.get_counts_by_project()
         return Response(data)
 
+    def get_counts_by_type(self, total, counts):
+        """
+        :param counts: a dict {dataset type: count}
+        """
+        result = OrderedDict([('total', total)])
+        for key, dataset_type in self.dataset_types:
+            result[key] = {
+                'total': counts.get(dataset_type, 0)
+            }
+        return result
+
+    @staticmethod
+    def get_counts_by_project():
+        """
+        The counts of each project with a grouped query per count.
+        """
+        dataset_counts = dict(Dataset.objects.values_list('project').annotate(Count('id')).order_by())
+        site_counts = dict(Site.objects.values_list('project').annotate(Count('id')).order_by())
+        record_counts = get_record_counts('project')
+        return [
+            OrderedDict([
+                ('id', pk),
+                ('name', name),
+                ('datasets', {'total': dataset_counts.get(pk, 0)}),
+                ('records', {'total': record_counts.get(pk, 0)}),
+                ('sites', {'total': site_counts.get(pk, 0)}),
+            ])
+            for pk, name in Project.objects.values_list('pk', 'name')
+        ]
+
 
 class WhoamiView(APIView):
     serializers = serializers.WhoAmISerializer
@@ -516,9 +699,19 @@ class WhoamiView(APIView):
 class DatasetUploadRecordsView(APIView, SpeciesMixin):
     """
     Upload file for records (xlsx, csv)
+    With upsert=true the rows are matched to the existing records by the primaryKey of the schema or, if the schema has
+    none, by the client_id column of the file. New rows are inserted, changed records updated and the result of every
+    row tells the action done: inserted, updated or unchanged.
+    The response is the list of the row results unless:
+    - summary=true: only the counts and the results of the rows in error are returned.
+    - stream=true: the results are streamed as newline delimited json (one line per row, only the rows in error if
+    summary=true), followed by a last {"summary": {...}} line. The status is always 200 in that case.
     """
     permission_classes = (IsAuthenticated, DatasetRecordsPermission)
     parser_classes = (FormParser, MultiPartParser)
+    ORM_ENGINE = uploaders.ORM_ENGINE
+    COPY_ENGINE = uploaders.COPY_ENGINE
+    ENGINES = uploaders.ENGINES
 
     def dispatch(self, request, *args, **kwargs):
         """
@@ -531,53 +724,163 @@ class DatasetUploadRecordsView(APIView, SpeciesMixin):
 
     def post(self, request, *args, **kwargs):
         file_obj = request.data['file']
-        create_site = 'create_site' in request.data and to_bool(request.data['create_site'])
-        delete_previous = 'delete_previous' in request.data and to_bool(request.data['delete_previous'])
-        strict = 'strict' in request.data and to_bool(request.data['strict'])
+        try:
+            options = self.get_upload_options(request.data)
+        except ValueError as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
 
         if file_obj.content_type not in FileReader.SUPPORTED_TYPES:
             msg = "Wrong file type {}. Should be one of: {}".format(file_obj.content_type, SiteUploader.SUPPORTED_TYPES)
             return Response(msg, status=status.HTTP_501_NOT_IMPLEMENTED)
 
-        if delete_previous:
-            self.dataset.record_queryset.delete()
+        # async mode: the file is stored and processed later by the process_upload_jobs command.
+        if 'async' in request.data and to_bool(request.data['async']):
+            job = models.UploadJob.objects.create(
+                type=models.UploadJob.TYPE_RECORDS,
+                project=self.dataset.project,
+                dataset=self.dataset,
+                file=file_obj,
+                file_name=file_obj.name,
+                content_type=file_obj.content_type,
+                options=options,
+                created_by=request.user
+            )
+            return Response(serializers.UploadJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+        if options['delete_previous']:
+            delete_records(self.dataset.record_queryset)
         generator = FileReader(file_obj)
-        validator = get_record_validator_for_dataset(self.dataset)
-        validator.schema_error_as_warning = not strict
-        creator = RecordCreator(self.dataset, generator,
-                                validator=validator, create_site=create_site, commit=True,
-                                species_facade_class=self.species_facade_class)
-        data = []
-        has_error = False
-        row = 1  # starts at 1 to match excel row id
-        for record, validator_result in creator:
-            row += 1
-            result = {
-                'row': row
+        creator = get_record_creator(self.dataset, generator, options, species_facade_class=self.species_facade_class)
+        report = RecordUploadReport(upsert=options['upsert'])
+        summary_only = 'summary' in request.data and to_bool(request.data['summary'])
+        results = self.iter_results(creator, report, file_obj.name, errors_only=summary_only)
+        if 'stream' in request.data and to_bool(request.data['stream']):
+            return NDJSONStreamingResponse(self.iter_stream(results, report))
+        data = list(results)
+        if summary_only:
+            data = {
+                'summary': report.summary,
+                'failedRows': data
             }
-            if validator_result.has_errors:
-                has_error = True
-            else:
-                result['recordId'] = record.id
-            result.update(validator_result.to_dict())
-            data.append(result)
-        status_code = status.HTTP_200_OK if not has_error else status.HTTP_400_BAD_REQUEST
+        status_code = status.HTTP_200_OK if not report.has_errors else status.HTTP_400_BAD_REQUEST
         return Response(data, status=status_code)
 
+    def iter_results(self, creator, report, file_name, errors_only=False):
+        """
+        Run the creator.
+        :return: a generator of the row results (only the rows in error if errors_only)
+        """
+        for record, validator_result in creator:
+            result = report.add(record, validator_result)
+            if not errors_only or validator_result.has_errors:
+                yield result
+        if creator.date_formats:
+            logger.info("Date formats detected in {} for dataset {}: {}".format(
+                file_name, self.dataset.pk, creator.date_formats))
+
+    def iter_stream(self, results, report):
+        """
+        The lines of a streamed upload. The response has already been sent when an unexpected error happens so the
+        error is reported in the last line.
+        """
+        try:
+            for result in results:
+                yield result
+        except Exception as e:
+            logger.exception("Error while streaming the upload of dataset {}".format(self.dataset.pk))
+            yield {'error': str(e), 'summary': report.summary}
+            return
+        yield {'summary': report.summary}
+
+    def get_upload_options(self, data):
+        """
+        Parse the upload options from the posted data.
+        :param data: the request data
+        :return: a dict {create_site, delete_previous, strict, engine, batch_size, processes, upsert}
+        :raise ValueError: if an option is invalid
+        """
+        options = {
+            'create_site': 'create_site' in data and to_bool(data['create_site']),
+            'delete_previous': 'delete_previous' in data and to_bool(data['delete_previous']),
+            'strict': 'strict' in data and to_bool(data['strict']),
+            'batch_size': None
+        }
+        # bulk mode: records are inserted by batch instead of one by one.
+        bulk = 'bulk' in data and to_bool(data['bulk'])
+        if bulk:
+            try:
+                batch_size = int(data.get('batch_size') or RecordCreator.DEFAULT_BATCH_SIZE)
+            except ValueError:
+                batch_size = 0
+            if batch_size <= 0:
+                raise ValueError("batch_size should be a positive integer: {}".format(data.get('batch_size')))
+            options['batch_size'] = batch_size
+
+        # parallel validation: the rows are validated in a pool of processes (orm engine only).
+        options['processes'] = None
+        if data.get('processes'):
+            try:
+                processes = int(data.get('processes'))
+            except ValueError:
+                processes = 0
+            if processes <= 0:
+                raise ValueError("processes should be a positive integer: {}".format(data.get('processes')))
+            options['processes'] = min(processes, multiprocessing.cpu_count())
+
+        # ingest engine: 'orm' (default) or 'copy' for very large files.
+        engine = data.get('engine') or self.ORM_ENGINE
+        if engine not in self.ENGINES:
+            raise ValueError("Unknown engine {}. Should be one of: {}".format(engine, self.ENGINES))
+        options['engine'] = engine
+
+        # upsert: update the existing records instead of inserting duplicates (orm engine only).
+        options['upsert'] = 'upsert' in data and to_bool(data['upsert'])
+        if options['upsert'] and engine != self.ORM_ENGINE:
+            raise ValueError("upsert is only supported by the {} engine".format(self.ORM_ENGINE))
+        return options
+
 
 class SpeciesView(APIView, SpeciesMixin):
+    # the id filters
+    filter_fields = [
+        ('project', 'dataset__project'),
+        ('dataset', 'dataset'),
+    ]
+
     def get(self, request, *args, **kwargs):
         """
-        Get a list of all species name present in the system
+        Get a list of all species name present in the system, from the species of the datasets (see DatasetSpecies).
+        Query params: search, strict (only the species with a name_id), project and dataset (ids).
+        With counts=true each species is returned with its counts:
+        {species_name, name_id, record_count, dataset_count, first_observation, last_observation}
         :return: a list of species name.
         """
-        qs = Record.objects.exclude(species_name__isnull=True)
-        qs = self.filter_queryset(qs)
-        # we output just the species name
-        data = qs \
-            .distinct('species_name') \
-            .order_by('species_name') \
-            .values_list('species_name', flat=True)
+        qs = self.filter_queryset(DatasetSpecies.objects.order_by())
+        if to_bool(request.query_params.get('counts', False)):
+            rows = qs.values('species_name').annotate(
+                max_name_id=Max('name_id'),
+                record_count=Sum('record_count'),
+                dataset_count=Count('dataset'),
+                first_observation=Min('first_observation'),
+                last_observation=Max('last_observation')
+            ).order_by('species_name')
+            data = [
+                OrderedDict([
+                    ('species_name', row['species_name']),
+                    ('name_id', row['max_name_id']),
+                    ('record_count', row['record_count']),
+                    ('dataset_count', row['dataset_count']),
+                    ('first_observation', row['first_observation']),
+                    ('last_observation', row['last_observation']),
+                ])
+                for row in rows
+            ]
+        else:
+            # we output just the species name
+            data = qs \
+                .distinct('species_name') \
+                .order_by('species_name') \
+                .values_list('species_name', flat=True)
         return Response(data=data)
 
     def filter_queryset(self, queryset):
@@ -590,6 +893,12 @@ class SpeciesView(APIView, SpeciesMixin):
         strict = to_bool(self.request.query_params.get('strict', False))
         if strict:
             query &= ~Q(name_id=-1)
+        for param, lookup in self.filter_fields:
+            value = self.request.query_params.get(param)
+            if value:
+                if not value.isdigit():
+                    raise ValidationError("{} must be an id: {}".format(param, value))
+                query &= Q(**{lookup: value})
         return queryset.filter(query)
 
 
@@ -617,10 +926,11 @@ class GeoConvertView(generics.GenericAPIView):
             geom_parser = schema.geometry_parser
             geometry = geom_parser.from_record_to_geometry(
                 record_data,
-                default_srid=dataset.project.datum or constants.MODEL_SRID
+                default_srid=dataset.project.datum or constants.MODEL_SRID,
+                site_lookup=SiteLookup(dataset.project, prefetch=False)
             )
-            # we output in WGS84
-            geometry.transform(constants.MODEL_SRID)
+            # we output in WGS84 (the geometry can be the one of a site, don't change it in place)
+            geometry = transform_geometry(geometry, constants.MODEL_SRID, clone=True)
             serializer = self.serializer_class({
                 'geometry': geometry,
                 'data': record_data
@@ -0,0 +1,30 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.utils_delete import clean_deleted_files
+
+
+class Command(BaseCommand):
+    help = "Remove from the storage the media files of the deleted records, datasets and projects. Runs forever " \
+           "polling for new files unless --once is given. Can be stopped at any time."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', default=False,
+                            help="Remove the pending files and exit.")
+        parser.add_argument('--interval', type=float, default=60,
+                            help="Seconds to wait between two polls when there is no pending file.")
+        parser.add_argument('--limit', type=int, default=None,
+                            help="Maximum number of files to remove per poll.")
+
+    def handle(self, *args, **options):
+        while True:
+            deleted, errors = clean_deleted_files(limit=options['limit'])
+            if deleted or errors:
+                self.stdout.write("{} files deleted, {} errors".format(deleted, errors))
+            if options['once']:
+                break
+            if not deleted:
+                time.sleep(options['interval'])
@@ -0,0 +1,41 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.api.jobs import claim_next_job, UploadJobRunner
+from main.api.views import SpeciesMixin
+from main.models import UploadJob
+from main.utils_index import build_pending_indexes
+
+
+class Command(BaseCommand):
+    help = "Process the pending asynchronous upload jobs. Runs forever polling for new jobs unless --once is given. " \
+           "Several workers can run at the same time. The pending indexes of the records data are built when there " \
+           "is no job to process."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', default=False,
+                            help="Process the pending jobs and exit.")
+        parser.add_argument('--interval', type=float, default=5,
+                            help="Seconds to wait between two polls when there is no pending job.")
+
+    def handle(self, *args, **options):
+        while True:
+            job = claim_next_job()
+            if job is None:
+                for dataset_index in build_pending_indexes():
+                    self.stdout.write("Index {} of dataset {}: {}".format(
+                        dataset_index.field, dataset_index.dataset_id, dataset_index.status))
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+                continue
+            self.stdout.write("Processing {} upload job {}: {}".format(job.type, job.pk, job.file_name))
+            job = UploadJobRunner(job, species_facade_class=SpeciesMixin.species_facade_class).run()
+            if job.status == UploadJob.STATUS_FAILED:
+                self.stderr.write("Job {} failed: {}".format(job.pk, job.message))
+            else:
+                self.stdout.write("Job {} completed: {} rows processed, {} rows in error".format(
+                    job.pk, job.rows_processed, job.error_count))
@@ -0,0 +1,29 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+from django.core.management.base import BaseCommand
+
+from main.models import Dataset
+from main.utils_summary import rebuild_summaries, create_missing_summaries
+
+
+class Command(BaseCommand):
+    help = "Recompute the summaries (record count, extent, datetime range, species count) and the species of the " \
+           "datasets. The summaries are created with the datasets and maintained on the record writes, this is to " \
+           "repair them after writes that bypass the application."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', type=int, action='append', dest='datasets', default=None,
+                            help="The id of a dataset to rebuild (repeatable). All the datasets by default.")
+        parser.add_argument('--missing', action='store_true', default=False,
+                            help="Only create the summaries of the datasets that don't have one.")
+
+    def handle(self, *args, **options):
+        if options['missing']:
+            for summary in create_missing_summaries():
+                self.stdout.write("{}: {} records".format(summary.dataset_id, summary.record_count))
+            return
+        datasets = Dataset.objects.order_by('pk')
+        if options['datasets']:
+            datasets = datasets.filter(pk__in=options['datasets'])
+        for summary in rebuild_summaries(datasets):
+            self.stdout.write("{}: {} records".format(summary.dataset_id, summary.record_count))
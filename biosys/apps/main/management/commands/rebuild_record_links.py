@@ -0,0 +1,25 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+from django.core.management.base import BaseCommand
+
+from main.models import Dataset, RecordLink
+from main.utils_links import update_record_links
+
+
+class Command(BaseCommand):
+    help = "Rebuild the parent/children links of the records from the foreign keys of the dataset schemas. To run once " \
+           "after the migration that created the link table, the links are then maintained on record and dataset " \
+           "updates."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', type=int, action='append', dest='datasets', default=None,
+                            help="The id of a dataset to rebuild (repeatable). All the datasets by default.")
+
+    def handle(self, *args, **options):
+        datasets = Dataset.objects.order_by('pk')
+        if options['datasets']:
+            datasets = datasets.filter(pk__in=options['datasets'])
+        for dataset in datasets:
+            update_record_links(dataset)
+            self.stdout.write("{}: {} links to parents".format(
+                dataset.pk, RecordLink.objects.filter(child__dataset=dataset).count()))
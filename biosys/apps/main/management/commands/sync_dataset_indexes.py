@@ -0,0 +1,28 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+from django.core.management.base import BaseCommand
+
+from main.models import Dataset
+from main.utils_index import sync_dataset_indexes, drop_orphan_indexes
+
+
+class Command(BaseCommand):
+    help = "Create the missing indexes of the records data declared in the dataset schemas (biosys.index) or added by " \
+           "an admin, retry the failed ones and drop the indexes that are no longer needed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', type=int, action='append', dest='datasets', default=None,
+                            help="The id of a dataset to sync (repeatable). All the datasets by default.")
+
+    def handle(self, *args, **options):
+        datasets = Dataset.objects.order_by('pk')
+        if options['datasets']:
+            datasets = datasets.filter(pk__in=options['datasets'])
+        for dataset in datasets:
+            indexes = sync_dataset_indexes(dataset)
+            for dataset_index in indexes:
+                self.stdout.write("{}: {} {} ({})".format(dataset.pk, dataset_index.field, dataset_index.name,
+                                                          dataset_index.status))
+        if not options['datasets']:
+            for name in drop_orphan_indexes():
+                self.stdout.write("Dropped orphan index {}".format(name))
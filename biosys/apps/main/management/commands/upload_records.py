@@ -0,0 +1,66 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import mimetypes
+from os import path
+
+from django.core.files.uploadedfile import UploadedFile
+from django.core.management.base import BaseCommand, CommandError
+
+from main.api.uploaders import FileReader, RecordCreator, RecordUploadReport, get_record_creator, ENGINES, \
+    COPY_ENGINE, ORM_ENGINE
+from main.api.views import SpeciesMixin
+from main.models import Dataset
+from main.utils_delete import delete_records
+
+
+class Command(BaseCommand):
+    help = "Upload records from a csv or xlsx file into a dataset. Meant for large backfills that can't be done " \
+           "through the API within a request timeout."
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset_id', type=int)
+        parser.add_argument('file_path')
+        parser.add_argument('--engine', choices=ENGINES, default=COPY_ENGINE,
+                            help="The ingest engine. 'copy' (default) for large files.")
+        parser.add_argument('--create-site', action='store_true', default=False)
+        parser.add_argument('--delete-previous', action='store_true', default=False)
+        parser.add_argument('--strict', action='store_true', default=False)
+        parser.add_argument('--batch-size', type=int, default=RecordCreator.DEFAULT_BATCH_SIZE,
+                            help="Batch size of the bulk insert for the 'orm' engine.")
+        parser.add_argument('--processes', type=int, default=None,
+                            help="Number of processes validating the rows in parallel for the 'orm' engine.")
+        parser.add_argument('--upsert', action='store_true', default=False,
+                            help="Update the existing records matching the primaryKey or client_id of a row instead of "
+                                 "inserting a new record. 'orm' engine only.")
+
+    def handle(self, *args, **options):
+        dataset = Dataset.objects.filter(pk=options['dataset_id']).first()
+        if dataset is None:
+            raise CommandError("Dataset {} does not exist".format(options['dataset_id']))
+        file_path = options['file_path']
+        if not path.exists(file_path):
+            raise CommandError("File {} does not exist".format(file_path))
+        if options['upsert'] and options['engine'] != ORM_ENGINE:
+            raise CommandError("--upsert is only supported by the {} engine".format(ORM_ENGINE))
+
+        if options['delete_previous']:
+            delete_records(dataset.record_queryset)
+
+        with open(file_path, 'rb') as fp:
+            file_ = UploadedFile(file=fp, name=path.basename(file_path),
+                                 content_type=mimetypes.guess_type(file_path)[0])
+            generator = FileReader(file_)
+            creator = get_record_creator(dataset, generator, options,
+                                         species_facade_class=SpeciesMixin.species_facade_class)
+            report = RecordUploadReport(upsert=options['upsert'])
+            for record, validator_result in creator:
+                result = report.add(record, validator_result)
+                if validator_result.has_errors:
+                    self.stderr.write("Row {}: {}".format(result['row'], validator_result.errors))
+            for field_name, date_format in creator.date_formats.items():
+                self.stdout.write("Date format detected for {}: {}".format(field_name, date_format))
+        if options['upsert']:
+            self.stdout.write("{inserted} records inserted, {updated} updated, {unchanged} unchanged, "
+                              "{failed} rows in error".format(**report.summary))
+        else:
+            self.stdout.write("{succeeded} records created, {failed} rows in error".format(**report.summary))
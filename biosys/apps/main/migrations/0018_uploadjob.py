@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.13 on 2018-09-10 10:12
+from __future__ import unicode_literals
+
+from django.conf import settings
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+import main.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('main', '0017_datasetmedia_projectmedia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(choices=[('records', 'Records'), ('sites', 'Sites')], default='records', max_length=100)),
+                ('file', models.FileField(storage=main.models.UploadJobStorage(), upload_to=main.models.get_upload_job_path)),
+                ('file_name', models.CharField(blank=True, max_length=512)),
+                ('content_type', models.CharField(blank=True, max_length=255)),
+                ('options', django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], db_index=True, default='pending', max_length=100)),
+                ('rows_processed', models.IntegerField(default=0)),
+                ('error_count', models.IntegerField(default=0)),
+                ('message', models.TextField(blank=True)),
+                ('report', models.FileField(blank=True, null=True, storage=main.models.UploadJobStorage(), upload_to=main.models.get_upload_job_report_path)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('dataset', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='main.Dataset')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.Project')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
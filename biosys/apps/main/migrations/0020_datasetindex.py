@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.13 on 2018-09-10 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0019_pendingfiledeletion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetIndex',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(max_length=1024)),
+                ('name', models.CharField(editable=False, max_length=63, unique=True)),
+                ('source', models.CharField(choices=[('schema', 'Schema'), ('admin', 'Admin')], default='admin', max_length=100)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=100)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='indexes', to='main.Dataset')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='datasetindex',
+            unique_together=set([('dataset', 'field')]),
+        ),
+    ]
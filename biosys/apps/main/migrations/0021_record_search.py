@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.13 on 2018-09-10 10:12
+from __future__ import unicode_literals
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# The search document of the records: the text of the data values and of the source info (file name and row),
+# maintained by a trigger so every insert/update path (ORM, bulk_create, COPY) is covered.
+# The columns are not declared in the Record model: they are only read in SQL (see main.utils_misc.search_records).
+SEARCH_SQL = [
+    "ALTER TABLE main_record ADD COLUMN search_text text",
+    "ALTER TABLE main_record ADD COLUMN search_vector tsvector",
+    """
+    CREATE FUNCTION main_record_search_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_text := concat_ws(
+            ' ',
+            (SELECT string_agg(value, ' ') FROM jsonb_each_text(NEW.data)),
+            NEW.source_info ->> 'file_name',
+            NEW.source_info ->> 'row'
+        );
+        NEW.search_vector := to_tsvector('simple', NEW.search_text);
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "CREATE TRIGGER main_record_search_update BEFORE INSERT OR UPDATE OF data, source_info ON main_record "
+    "FOR EACH ROW EXECUTE PROCEDURE main_record_search_update()",
+    # fill the existing records
+    "UPDATE main_record SET data = data",
+    "CREATE INDEX main_record_search_vector ON main_record USING gin (search_vector)",
+    "CREATE INDEX main_record_search_text_trgm ON main_record USING gin (search_text gin_trgm_ops)",
+]
+
+REVERSE_SEARCH_SQL = [
+    "DROP TRIGGER main_record_search_update ON main_record",
+    "DROP FUNCTION main_record_search_update()",
+    "ALTER TABLE main_record DROP COLUMN search_vector",
+    "ALTER TABLE main_record DROP COLUMN search_text",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0020_datasetindex'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunSQL(SEARCH_SQL, reverse_sql=REVERSE_SEARCH_SQL),
+    ]
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.13 on 2018-09-10 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# the summaries of the existing datasets
+FILL_SUMMARIES_SQL = "INSERT INTO main_datasetsummary (dataset_id, record_count, min_x, min_y, max_x, max_y, " \
+                     "start_datetime, end_datetime, species_count, last_modified, is_stale, updated) " \
+                     "SELECT d.id, count(r.id), ST_XMin(ST_Extent(r.geometry)), ST_YMin(ST_Extent(r.geometry)), " \
+                     "ST_XMax(ST_Extent(r.geometry)), ST_YMax(ST_Extent(r.geometry)), min(r.datetime), " \
+                     "max(r.datetime), count(DISTINCT r.species_name), max(r.last_modified), false, now() " \
+                     "FROM main_dataset d LEFT JOIN main_record r ON r.dataset_id = d.id GROUP BY d.id"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0022_recordlink'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetSummary',
+            fields=[
+                ('dataset', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='main.Dataset')),
+                ('record_count', models.IntegerField(default=0)),
+                ('min_x', models.FloatField(blank=True, null=True)),
+                ('min_y', models.FloatField(blank=True, null=True)),
+                ('max_x', models.FloatField(blank=True, null=True)),
+                ('max_y', models.FloatField(blank=True, null=True)),
+                ('start_datetime', models.DateTimeField(blank=True, null=True)),
+                ('end_datetime', models.DateTimeField(blank=True, null=True)),
+                ('species_count', models.IntegerField(default=0)),
+                ('last_modified', models.DateTimeField(blank=True, null=True)),
+                ('is_stale', models.BooleanField(default=False)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'dataset summaries',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='record',
+            index=models.Index(fields=['dataset', 'species_name', 'datetime'], name='main_record_ds_species_idx'),
+        ),
+        migrations.RunSQL(FILL_SUMMARIES_SQL, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.13 on 2018-09-10 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# the species name search (icontains: UPPER(species_name) LIKE UPPER(%s)) with a trigram index
+SPECIES_SEARCH_INDEX_SQL = "CREATE INDEX main_datasetspecies_name_trgm ON main_datasetspecies " \
+                           "USING gin (UPPER(species_name) gin_trgm_ops)"
+
+# fill the species of the existing records
+FILL_SPECIES_SQL = "INSERT INTO main_datasetspecies " \
+                   "(dataset_id, species_name, name_id, record_count, first_observation, last_observation) " \
+                   "SELECT dataset_id, species_name, max(name_id), count(*), min(datetime), max(datetime) " \
+                   "FROM main_record WHERE species_name IS NOT NULL GROUP BY dataset_id, species_name"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0023_datasetsummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetSpecies',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('species_name', models.CharField(max_length=500)),
+                ('name_id', models.IntegerField(default=-1)),
+                ('record_count', models.IntegerField(default=0)),
+                ('first_observation', models.DateTimeField(blank=True, null=True)),
+                ('last_observation', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'dataset species',
+                'ordering': ['species_name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='datasetspecies',
+            name='dataset',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='species', to='main.Dataset'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='datasetspecies',
+            unique_together=set([('dataset', 'species_name')]),
+        ),
+        migrations.RunSQL(SPECIES_SEARCH_INDEX_SQL, reverse_sql="DROP INDEX main_datasetspecies_name_trgm"),
+        migrations.RunSQL(FILL_SPECIES_SQL, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -12,6 +12,8 @@ from django.contrib.gis.db import models
 from django.contrib.gis.db.models import Extent
 from django.contrib.postgres.fields import JSONField
 from django.core.exceptions import ValidationError
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.text import Truncator
 from django.db.models.query_utils import Q
@@ -19,10 +21,13 @@ from timezone_field import TimeZoneField
 
 from main.constants import DATUM_CHOICES, MODEL_SRID
 from main.utils_auth import is_admin
-from main.utils_data_package import GenericSchema, ObservationSchema, SpeciesObservationSchema
+from main.utils_data_package import GenericSchema, ObservationSchema, SpeciesObservationSchema, SchemaCache
 
 logger = logging.getLogger(__name__)
 
+# The schema objects of the datasets, see Dataset.schema
+SCHEMA_CACHE = SchemaCache(maxsize=settings.SCHEMA_CACHE_SIZE)
+
 
 @python_2_unicode_compatible
 class Program(models.Model):
@@ -368,7 +373,10 @@ class Dataset(models.Model):
 
     @property
     def schema(self):
-        return self.schema_class(self.schema_data)
+        """
+        The schema object, cached per process (see SCHEMA_CACHE). It is shared, don't modify it.
+        """
+        return SCHEMA_CACHE.get(self.schema_class, self.schema_data)
 
     @property
     def resource(self):
@@ -426,6 +434,14 @@ class Dataset(models.Model):
         else:
             return None
 
+    @property
+    def links_descriptor(self):
+        """
+        What the parent/children links of the records depend on (see main.utils_links): a change requires to update
+        the links of all the records of the dataset.
+        """
+        return [self.name, self.code, self.resource.get('name'), self.foreign_keys]
+
     @property
     def has_primary_key(self):
         """
@@ -625,46 +641,57 @@ class Record(models.Model):
     @property
     def parents(self):
         """
-        If the record dataset schema has a declared foreign key, look for the parents of this record.
-        :return: a Record queryset or Record.objects.none()
+        If the record dataset schema has a declared foreign key, the parents of this record (see RecordLink).
+        :return: a Record queryset or None
         """
         if self.dataset.has_foreign_keys:
-            parent_dataset = self.dataset.get_parent_dataset
-            if parent_dataset:
-                parent_field, child_field = self.dataset.get_fk_lookup_fields_for_dataset(parent_dataset)
-                if parent_field and child_field:
-                    child_value = self.data[child_field]
-                    if child_value:
-                        query = Q(dataset=parent_dataset) & Q(data__contains={parent_field: child_value})
-                        return Record.objects.filter(query)
-            return Record.objects.none()
+            return Record.objects.filter(child_links__child=self)
         else:
             return None
 
     @property
     def children(self):
         """
-        If a dataset schema has a declared foreign key to the dataset of this record, look for children
+        If a dataset schema has a declared foreign key to the dataset of this record, the children of this record (see
+        RecordLink).
         Important note: Only a dataset with a declared 'primaryKey' in schema can be used for children lookup.
         :return: a Record queryset or None if the dataset has no declared primaryKey
         """
         if self.dataset.has_primary_key:
-            children_datasets = self.dataset.get_children_datasets()
-            if children_datasets:
-                query = None
-                for ds in children_datasets:
-                    parent_field, child_field = ds.get_fk_lookup_fields_for_dataset(self.dataset)
-                    if parent_field and child_field:
-                        parent_value = self.data[parent_field]
-                        if parent_value:
-                            dataset_query = Q(dataset=ds, data__contains={child_field: parent_value})
-                            query = query | dataset_query if query else dataset_query
-                if query:
-                    return Record.objects.filter(query)
-            return Record.objects.none()
+            return Record.objects.filter(parent_links__parent=self)
         else:
             return None
 
+    @staticmethod
+    def get_relations(records):
+        """
+        The parent and the children (see parents and children) of a list of records, with one query for all the
+        parents and one for all the children.
+        :param records: a list of records
+        :return: a dict {record id: (parent id or None, [children ids] or None)} with the same values as
+        parents[0].id and [r.id for r in children]
+        """
+        ids = [record.id for record in records]
+        parents = {}
+        for child_id, parent_id in RecordLink.objects.filter(child_id__in=ids) \
+                .order_by('-parent_id').values_list('child_id', 'parent_id'):
+            # the first parent, by id
+            parents[child_id] = parent_id
+        children = {}
+        for parent_id, child_id in RecordLink.objects.filter(parent_id__in=ids) \
+                .order_by('child_id').values_list('parent_id', 'child_id'):
+            children.setdefault(parent_id, []).append(child_id)
+        datasets = Dataset.objects.in_bulk(set(record.dataset_id for record in records))
+        relations = {}
+        for record in records:
+            dataset = datasets[record.dataset_id]
+            relations[record.id] = (
+                parents.get(record.id) if dataset.has_foreign_keys else None,
+                children.get(record.id, []) if dataset.has_primary_key else None
+            )
+        return relations
+
+
     def is_custodian(self, user):
         return self.dataset.is_custodian(user)
 
@@ -726,6 +753,10 @@ class Record(models.Model):
 
     class Meta:
         ordering = ['id']
+        indexes = [
+            # the species of a dataset and their observation range (see main.utils_summary)
+            models.Index(fields=['dataset', 'species_name', 'datetime'], name='main_record_ds_species_idx'),
+        ]
 
 
 def get_media_path(instance, filename):
@@ -1026,3 +1057,272 @@ class DatasetMedia(models.Model):
 
     def has_object_destroy_permission(self, request):
         return is_admin(request.user) or self.is_data_engineer(request.user)
+
+
+@deconstructible
+class UploadJobStorage(FileSystemStorage):
+    """
+    The files of the upload jobs are always stored on the local filesystem (settings.UPLOAD_JOBS_ROOT) whatever the
+    DEFAULT_FILE_STORAGE, so they can be read by the process_upload_jobs worker.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('location', settings.UPLOAD_JOBS_ROOT)
+        super(UploadJobStorage, self).__init__(**kwargs)
+
+
+def get_upload_job_path(instance, filename):
+    """
+    The function used in UploadJob file field to build the path of the uploaded file.
+    :param instance:
+    :param filename:
+    :return: string
+    """
+    try:
+        return 'project_{project}/{filename}'.format(
+            project=instance.project.id,
+            filename=filename
+        )
+    except Exception:
+        logger.exception('Error while building the upload job file name')
+        return 'unknown/{}'.format(filename)
+
+
+def get_upload_job_report_path(instance, filename):
+    """
+    The function used in UploadJob report field to build the path of the report file.
+    :param instance:
+    :param filename:
+    :return: string
+    """
+    return 'project_{project}/reports/{filename}'.format(
+        project=instance.project_id,
+        filename=filename
+    )
+
+
+@python_2_unicode_compatible
+class UploadJob(models.Model):
+    """
+    A file upload (records or sites) processed outside of the HTTP request by the process_upload_jobs command.
+    rows_processed and error_count are updated while the job is running, the per row report is saved in the report
+    file when the job is completed.
+    """
+    TYPE_RECORDS = 'records'
+    TYPE_SITES = 'sites'
+    TYPE_CHOICES = [
+        (TYPE_RECORDS, TYPE_RECORDS.capitalize()),
+        (TYPE_SITES, TYPE_SITES.capitalize()),
+    ]
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, STATUS_PENDING.capitalize()),
+        (STATUS_RUNNING, STATUS_RUNNING.capitalize()),
+        (STATUS_COMPLETED, STATUS_COMPLETED.capitalize()),
+        (STATUS_FAILED, STATUS_FAILED.capitalize()),
+    ]
+    type = models.CharField(max_length=100, null=False, blank=False, choices=TYPE_CHOICES, default=TYPE_RECORDS)
+    project = models.ForeignKey(Project, null=False, blank=False, on_delete=models.CASCADE)
+    dataset = models.ForeignKey(Dataset, null=True, blank=True, on_delete=models.CASCADE)
+    file = models.FileField(upload_to=get_upload_job_path, storage=UploadJobStorage())
+    file_name = models.CharField(max_length=512, blank=True)
+    content_type = models.CharField(max_length=255, blank=True)
+    # the upload options (create_site, strict, ...) as posted.
+    options = JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=100, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    rows_processed = models.IntegerField(default=0)
+    error_count = models.IntegerField(default=0)
+    # the error message if the job failed.
+    message = models.TextField(blank=True)
+    report = models.FileField(upload_to=get_upload_job_report_path, storage=UploadJobStorage(), null=True,
+                              blank=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    # updated by the worker while the job is running (see UploadJobRunner), to detect the jobs of a dead worker.
+    heartbeat = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return '{} upload {} ({})'.format(self.type, self.file_name, self.status)
+
+    @property
+    def is_finished(self):
+        return self.status in [self.STATUS_COMPLETED, self.STATUS_FAILED]
+
+    def is_custodian(self, user):
+        return self.project.is_custodian(user)
+
+    def is_data_engineer(self, user):
+        return self.project.is_data_engineer(user)
+
+    # API permissions
+    @staticmethod
+    def has_read_permission(request):
+        return True
+
+    def has_object_read_permission(self, request):
+        return True
+
+    @staticmethod
+    def has_metadata_permission(request):
+        return True
+
+    def has_object_metadata_permission(self, request):
+        return True
+
+    @staticmethod
+    def has_create_permission(request):
+        """
+        Jobs are only created through the upload endpoints
+        :param request:
+        :return:
+        """
+        return False
+
+    @staticmethod
+    def has_update_permission(request):
+        """
+        Update not allowed
+        :param request:
+        :return:
+        """
+        return False
+
+    @staticmethod
+    def has_destroy_permission(request):
+        return False
+
+
+@python_2_unicode_compatible
+class PendingFileDeletion(models.Model):
+    """
+    A media file to remove from the storage.
+    The media rows deleted in bulk (see main.utils_delete) queue their file here in the same transaction, the files are
+    then removed in the background by the clean_deleted_files command.
+    """
+    file = models.CharField(max_length=1024)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return self.file
+
+
+@python_2_unicode_compatible
+class DatasetIndex(models.Model):
+    """
+    A partial expression index on the records data of a dataset: ((data -> 'field'), id) WHERE dataset_id = X.
+    The indexes are created from the schema fields declared with biosys.index = true or added by an admin, and are
+    managed by main.utils_index.
+    """
+    SOURCE_SCHEMA = 'schema'
+    SOURCE_ADMIN = 'admin'
+    SOURCE_CHOICES = [
+        (SOURCE_SCHEMA, SOURCE_SCHEMA.capitalize()),
+        (SOURCE_ADMIN, SOURCE_ADMIN.capitalize()),
+    ]
+    STATUS_PENDING = 'pending'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, STATUS_PENDING.capitalize()),
+        (STATUS_READY, STATUS_READY.capitalize()),
+        (STATUS_FAILED, STATUS_FAILED.capitalize()),
+    ]
+    dataset = models.ForeignKey(Dataset, null=False, blank=False, related_name='indexes', on_delete=models.CASCADE)
+    field = models.CharField(max_length=1024)
+    # the postgres index name
+    name = models.CharField(max_length=63, unique=True, editable=False)
+    source = models.CharField(max_length=100, choices=SOURCE_CHOICES, default=SOURCE_ADMIN)
+    status = models.CharField(max_length=100, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        unique_together = ('dataset', 'field')
+
+    def __str__(self):
+        return '{}: {} ({})'.format(self.dataset, self.field, self.status)
+
+
+@python_2_unicode_compatible
+class RecordLink(models.Model):
+    """
+    A parent -> child link between two records, materialised from the foreign key declared in the child dataset
+    schema (see Record.parents and Record.children). Maintained by main.utils_links.
+    """
+    parent = models.ForeignKey(Record, related_name='child_links', on_delete=models.CASCADE)
+    child = models.ForeignKey(Record, related_name='parent_links', on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ('parent', 'child')
+
+    def __str__(self):
+        return '{} -> {}'.format(self.parent_id, self.child_id)
+
+
+@python_2_unicode_compatible
+class DatasetSummary(models.Model):
+    """
+    The aggregates of the records of a dataset, maintained on the record writes by main.utils_summary instead of being
+    computed on each read. The record_count is always exact. A delete or an update may shrink the extent, the datetime
+    range or the species: the summary is then flagged as stale and recomputed on the next read.
+    """
+    dataset = models.OneToOneField(Dataset, primary_key=True, related_name='summary', on_delete=models.CASCADE)
+    record_count = models.IntegerField(default=0)
+    # the extent of the record geometries
+    min_x = models.FloatField(null=True, blank=True)
+    min_y = models.FloatField(null=True, blank=True)
+    max_x = models.FloatField(null=True, blank=True)
+    max_y = models.FloatField(null=True, blank=True)
+    # the observation datetime range
+    start_datetime = models.DateTimeField(null=True, blank=True)
+    end_datetime = models.DateTimeField(null=True, blank=True)
+    species_count = models.IntegerField(default=0)
+    # the last write (create, update or delete) of a record of the dataset
+    last_modified = models.DateTimeField(null=True, blank=True)
+    is_stale = models.BooleanField(default=False)
+    updated = models.DateTimeField(auto_now=True)
+
+    @property
+    def extent(self):
+        if self.min_x is None:
+            return None
+        return self.min_x, self.min_y, self.max_x, self.max_y
+
+    class Meta:
+        verbose_name_plural = 'dataset summaries'
+
+    def __str__(self):
+        return '{}: {} records'.format(self.dataset, self.record_count)
+
+
+@python_2_unicode_compatible
+class DatasetSpecies(models.Model):
+    """
+    The records of a species in a dataset: the species summary, maintained on the record writes by main.utils_summary.
+    The per-project and system wide counts are aggregated from it, see the SpeciesView.
+    """
+    dataset = models.ForeignKey(Dataset, related_name='species', on_delete=models.CASCADE)
+    species_name = models.CharField(max_length=500)
+    name_id = models.IntegerField(default=-1)
+    record_count = models.IntegerField(default=0)
+    first_observation = models.DateTimeField(null=True, blank=True)
+    last_observation = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['species_name']
+        unique_together = ('dataset', 'species_name')
+        verbose_name_plural = 'dataset species'
+
+    def __str__(self):
+        return '{}: {} ({} records)'.format(self.dataset, self.species_name, self.record_count)
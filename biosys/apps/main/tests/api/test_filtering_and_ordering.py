@@ -5,6 +5,7 @@ from django.contrib.gis.geos import Polygon, Point, MultiPolygon
 from rest_framework import status
 
 from main.models import Record, Dataset
+from main.tests import factories
 from main.tests.api import helpers
 
 
@@ -93,6 +94,60 @@ class TestJsonSearchAndOrdering(helpers.BaseUserTestCase):
         record_values_as_string = [str(v) for v in record['data'].values()]
         self.assertEqual(sorted(list(record_values_as_string)), expected_data)
 
+    def test_search_modes(self):
+        """
+        The default full text search matches whole words and orders by relevance, the substring search matches any
+        part of the data values.
+        """
+        dataset = self._create_dataset_and_records_from_rows([
+            ['What', 'Comments'],
+            ['Chubby bat', 'A bat'],
+            ['Red fox', 'Not a bat'],
+            ['Chubby bat', 'Bat bat bat'],
+            ['Batman', 'Villain'],
+        ])
+        records = {r.data['Comments']: r.pk for r in dataset.record_queryset}
+        url = reverse('api:dataset-records', kwargs={'pk': dataset.pk})
+        client = self.custodian_1_client
+
+        resp = client.get(url, {'search': 'BAT'})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        ids = [r['id'] for r in resp.json()]
+        self.assertEqual(sorted(ids), sorted([records['A bat'], records['Not a bat'], records['Bat bat bat']]))
+        # the most relevant first
+        self.assertEqual(ids[0], records['Bat bat bat'])
+
+        # all the words
+        resp = client.get(url, {'search': 'chubby bat'})
+        self.assertEqual(sorted(r['id'] for r in resp.json()), sorted([records['A bat'], records['Bat bat bat']]))
+
+        # substring
+        resp = client.get(url, {'search': 'atma', 'search_mode': 'substring'})
+        self.assertEqual([r['id'] for r in resp.json()], [records['Villain']])
+
+        # the source info is searchable
+        resp = client.get(url, {'search': 'xlsx', 'search_mode': 'substring'})
+        self.assertEqual(len(resp.json()), len(records))
+
+        # an ordering replaces the ranking
+        resp = client.get(url, {'search': 'bat', 'ordering': 'Comments'})
+        self.assertEqual([r['data']['Comments'] for r in resp.json()], ['A bat', 'Bat bat bat', 'Not a bat'])
+
+        resp = client.get(url, {'search': 'bat', 'search_mode': 'regex'})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_updated_with_data(self):
+        dataset = self._create_dataset_and_records_from_rows([
+            ['What', 'Comments'],
+            ['Chubby bat', 'A bat'],
+        ])
+        record = dataset.record_queryset.first()
+        url = reverse('api:dataset-records', kwargs={'pk': dataset.pk})
+        self.assertEqual(len(self.custodian_1_client.get(url, {'search': 'fox'}).json()), 0)
+        record.data['What'] = 'Red fox'
+        record.save()
+        self.assertEqual([r['id'] for r in self.custodian_1_client.get(url, {'search': 'fox'}).json()], [record.pk])
+
     def test_string_ordering_in_json_data(self):
         """
         Test that if we provide a dataset and an order parameter (field) we can order through the data json field
@@ -728,3 +783,84 @@ class TestSpatialFiltering(helpers.BaseUserTestCase):
             sorted([r['data'].get('Where') for r in records]),
             sorted([r[4] for r in expected_records])
         )
+
+
+class TestCursorPagination(helpers.BaseUserTestCase):
+
+    def _more_setup(self):
+        self.client = self.custodian_1_client
+        self.dataset = factories.DatasetFactory(
+            project=self.project_1,
+            type=Dataset.TYPE_GENERIC,
+            data_package=helpers.create_data_package_from_fields([
+                {'name': 'Name', 'type': 'string'},
+                {'name': 'Count', 'type': 'integer'},
+            ]))
+        counts = [3, 1, None, 2, 1, 3, None]
+        self.records = [
+            Record.objects.create(dataset=self.dataset, data=dict({'Name': 'R{}'.format(i)},
+                                                                  **({'Count': count} if count is not None else {})))
+            for i, count in enumerate(counts)
+        ]
+
+    def _get_all_pages(self, url, **params):
+        """
+        Follow the next links then the previous links back.
+        :return: the ids of the pages read forward, the ids of the pages read backward
+        """
+        params = dict({'pagination': 'cursor', 'limit': 3}, **params)
+        resp = self.client.get(url, params)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        pages = [resp.json()]
+        while pages[-1]['next']:
+            pages.append(self.client.get(pages[-1]['next']).json())
+        forward = [r['id'] for page in pages for r in page['results']]
+        backward_pages = [pages[-1]]
+        while backward_pages[-1]['previous']:
+            backward_pages.append(self.client.get(backward_pages[-1]['previous']).json())
+        backward = [r['id'] for page in reversed(backward_pages) for r in page['results']]
+        self.assertEqual(len(pages), 3)
+        return forward, backward, pages
+
+    def test_by_id(self):
+        urls = [
+            (reverse('api:record-list'), {'dataset__id': self.dataset.pk}),
+            (reverse('api:dataset-records', kwargs={'pk': self.dataset.pk}), {})
+        ]
+        for url, params in urls:
+            forward, backward, pages = self._get_all_pages(url, **params)
+            expected = [r.pk for r in self.records]
+            self.assertEqual(forward, expected)
+            self.assertEqual(backward, expected)
+            self.assertEqual(pages[0]['count'], len(expected))
+            self.assertIsNone(pages[0]['previous'])
+
+    def test_ordering_with_nulls(self):
+        url = reverse('api:dataset-records', kwargs={'pk': self.dataset.pk})
+        orderings = [
+            # nulls last ascending, first descending (postgres default) then by id
+            ('Count', lambda r: (r.data.get('Count') is None, r.data.get('Count', 0), r.pk)),
+            ('-Count', lambda r: (r.data.get('Count') is not None, -r.data.get('Count', 0), -r.pk)),
+        ]
+        for ordering, sort_key in orderings:
+            forward, backward, pages = self._get_all_pages(url, ordering=ordering)
+            expected = [r.pk for r in sorted(self.records, key=sort_key)]
+            self.assertEqual(forward, expected)
+            self.assertEqual(backward, expected)
+
+    def test_skip_count(self):
+        url = reverse('api:dataset-records', kwargs={'pk': self.dataset.pk})
+        forward, backward, pages = self._get_all_pages(url, count=False)
+        self.assertNotIn('count', pages[0])
+
+    def test_invalid(self):
+        url = reverse('api:dataset-records', kwargs={'pk': self.dataset.pk})
+        self.assertEqual(self.client.get(url, {'cursor': 'not a cursor'}).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(url, {'pagination': 'cursor', 'ordering': 'Name,Count'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_limit_offset_is_default(self):
+        url = reverse('api:dataset-records', kwargs={'pk': self.dataset.pk})
+        resp = self.client.get(url, {'limit': 3, 'offset': 3})
+        self.assertEqual(resp.json()['count'], len(self.records))
+        self.assertEqual([r['id'] for r in resp.json()['results']], [r.pk for r in self.records[3:6]])
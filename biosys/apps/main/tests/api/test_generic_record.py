@@ -2,12 +2,16 @@ import json
 import re
 from os import path
 
+from django.contrib import admin
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import six
 from openpyxl import load_workbook
 from openpyxl.cell import Cell
 from rest_framework import status
 
+from main.admin import RecordAdmin
 from main.models import Dataset, Record
 from main.tests import factories
 from main.tests.api import helpers
@@ -1125,3 +1129,253 @@ class TestForeignKey(helpers.BaseUserTestCase):
             data = resp.json()
             self.assertEqual(data['children'], expected_children_ids)
             self.assertEqual(data['parent'], expected_parent_id)
+
+    def test_list_relations_in_bulk(self):
+        """
+        The parent and children of a list of records are resolved in bulk: same values as the detail, and the number
+        of queries doesn't depend on the number of records.
+        """
+        parent_dataset = self._create_dataset_and_records_from_rows([
+            ['Survey ID', 'Where'],
+            ['ID-001', 'King\'s Park'],
+            ['ID-002', 'Cottesloe'],
+            ['ID-003', 'Somewhere'],
+        ])
+        parent_dataset.data_package['resources'][0]['schema']['primaryKey'] = 'Survey ID'
+        parent_dataset.save()
+        child_schema = helpers.create_schema_from_fields([
+            {
+                "name": "Survey ID",
+                "type": "string",
+                "constraints": helpers.REQUIRED_CONSTRAINTS
+            },
+            {
+                "name": "What",
+                "type": "string",
+                "constraints": helpers.NOT_REQUIRED_CONSTRAINTS
+            }
+        ])
+        child_schema['foreignKeys'] = [{
+            'fields': 'Survey ID',
+            'reference': {
+                'fields': 'Survey ID',
+                'resource': parent_dataset.name
+            }
+        }]
+        child_dataset = self._create_dataset_with_schema(self.project_1, self.data_engineer_1_client, child_schema)
+        self._upload_records_from_rows([
+            ['Survey ID', 'What'],
+            ['ID-001', 'Canis lupus'],
+            ['ID-001', 'A frog'],
+            ['ID-002', 'A tooth brush'],
+            ['ID-004', 'Orphan'],
+        ], child_dataset.pk, strict=False)
+
+        client = self.custodian_1_client
+        for dataset in [parent_dataset, child_dataset]:
+            url = reverse('api:dataset-records', kwargs={'pk': dataset.pk})
+            resp = client.get(url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            records = resp.json()
+            self.assertEqual(len(records), dataset.record_count)
+            for record in records:
+                detail = client.get(reverse('api:record-detail', kwargs={'pk': record['id']})).json()
+                self.assertEqual(record['parent'], detail['parent'])
+                self.assertEqual(record['children'], detail['children'])
+
+            with CaptureQueriesContext(connection) as one_record:
+                client.get(url, {'limit': 1})
+            with CaptureQueriesContext(connection) as all_records:
+                client.get(url, {'limit': 10})
+            self.assertEqual(len(one_record), len(all_records))
+
+            # opt-out
+            resp = client.get(url, {'relations': False})
+            for record in resp.json():
+                self.assertNotIn('parent', record)
+                self.assertNotIn('children', record)
+
+    def test_list_relations_db_render(self):
+        """
+        The parent and children rendered by the database (?render=db) are the same as the serialized ones.
+        """
+        parent_dataset = self._create_dataset_and_records_from_rows([
+            ['Survey ID', 'Where'],
+            ['ID-001', 'King\'s Park'],
+            ['ID-002', 'Cottesloe'],
+        ])
+        parent_dataset.data_package['resources'][0]['schema']['primaryKey'] = 'Survey ID'
+        parent_dataset.save()
+        child_schema = helpers.create_schema_from_fields([
+            {
+                "name": "Survey ID",
+                "type": "string",
+                "constraints": helpers.REQUIRED_CONSTRAINTS
+            },
+            {
+                "name": "What",
+                "type": "string",
+                "constraints": helpers.NOT_REQUIRED_CONSTRAINTS
+            }
+        ])
+        child_schema['foreignKeys'] = [{
+            'fields': 'Survey ID',
+            'reference': {
+                'fields': 'Survey ID',
+                'resource': parent_dataset.name
+            }
+        }]
+        child_dataset = self._create_dataset_with_schema(self.project_1, self.data_engineer_1_client, child_schema)
+        self._upload_records_from_rows([
+            ['Survey ID', 'What'],
+            ['ID-001', 'Canis lupus'],
+            ['ID-001', 'A frog'],
+            ['ID-003', 'Orphan'],
+        ], child_dataset.pk, strict=False)
+
+        client = self.custodian_1_client
+        urls = [reverse('api:dataset-records', kwargs={'pk': dataset.pk})
+                for dataset in [parent_dataset, child_dataset]]
+        urls.append(reverse('api:record-list'))
+        for url in urls:
+            for params in [{}, {'relations': False}, {'limit': 2}]:
+                expected = client.get(url, params).json()
+                resp = client.get(url, dict(params, render='db'))
+                self.assertEqual(resp.status_code, status.HTTP_200_OK)
+                self.assertEqual(json.loads(b''.join(resp.streaming_content).decode('utf-8')), expected)
+
+    def test_list_fields_and_data_fields(self):
+        """
+        With fields only the columns of the fields are loaded, and with data_fields only these keys of the data are
+        serialized. Same result rendered by the database.
+        """
+        dataset = self._create_dataset_and_records_from_rows([
+            ['What', 'Where', 'Who'],
+            ['Canis lupus', 'King\'s Park', 'Tim'],
+            ['A frog', 'Cottesloe', 'Jane'],
+        ])
+        client = self.custodian_1_client
+        url = reverse('api:dataset-records', kwargs={'pk': dataset.pk})
+        expected_data = sorted(
+            ({key: record.data[key] for key in ['What', 'Who']} for record in dataset.record_queryset),
+            key=lambda data: data['What']
+        )
+        params = {'fields': ['id', 'data'], 'data_fields': ['What', 'Who', 'Unknown'], 'ordering': 'What'}
+        with CaptureQueriesContext(connection) as queries:
+            resp = client.get(url, params)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        records = resp.json()
+        self.assertEqual([sorted(record.keys()) for record in records], [['data', 'id'], ['data', 'id']])
+        self.assertEqual([record['data'] for record in records], expected_data)
+        # no relations, no query per record
+        self.assertFalse([query for query in queries if 'main_recordlink' in query['sql']])
+        with CaptureQueriesContext(connection) as one_record:
+            client.get(url, dict(params, limit=1))
+        with CaptureQueriesContext(connection) as all_records:
+            client.get(url, dict(params, limit=10))
+        self.assertEqual(len(one_record), len(all_records))
+
+        resp = client.get(url, dict(params, render='db'))
+        self.assertEqual(json.loads(b''.join(resp.streaming_content).decode('utf-8')), records)
+
+        # record list
+        resp = client.get(reverse('api:record-list'), {'dataset__id': dataset.pk, 'data_fields': 'Where'})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(record['data']['Where'] for record in resp.json()), ['Cottesloe', 'King\'s Park'])
+        self.assertEqual([list(record['data'].keys()) for record in resp.json()], [['Where'], ['Where']])
+
+    def test_links_maintained(self):
+        """
+        The parent/children links are kept up to date on record uploads, creates, updates and deletes and on a change
+        of the dataset foreign keys. The children of a record can be filtered with ?parent=
+        """
+        child_schema = helpers.create_schema_from_fields([
+            {
+                "name": "Survey ID",
+                "type": "string",
+                "constraints": helpers.REQUIRED_CONSTRAINTS
+            },
+            {
+                "name": "What",
+                "type": "string",
+                "constraints": helpers.NOT_REQUIRED_CONSTRAINTS
+            }
+        ])
+        child_schema['foreignKeys'] = [{
+            'fields': 'Survey ID',
+            'reference': {
+                'fields': 'Survey ID',
+                'resource': 'Surveys'
+            }
+        }]
+        # the children are uploaded before their parents
+        child_dataset = self._create_dataset_with_schema(self.project_1, self.data_engineer_1_client, child_schema)
+        self._upload_records_from_rows([
+            ['Survey ID', 'What'],
+            ['ID-001', 'Canis lupus'],
+            ['ID-002', 'A frog'],
+        ], child_dataset.pk, strict=False)
+        parent_schema = helpers.create_schema_from_fields([
+            {
+                "name": "Survey ID",
+                "type": "string",
+                "constraints": helpers.REQUIRED_CONSTRAINTS
+            }
+        ])
+        parent_schema['primaryKey'] = 'Survey ID'
+        parent_dataset = self._create_dataset_with_schema(self.project_1, self.data_engineer_1_client, parent_schema,
+                                                          dataset_name='Surveys')
+        self._upload_records_from_rows([['Survey ID'], ['ID-001'], ['ID-002']], parent_dataset.pk, strict=False)
+        id_001 = parent_dataset.record_queryset.filter(data__contains={'Survey ID': 'ID-001'}).first()
+        id_002 = parent_dataset.record_queryset.filter(data__contains={'Survey ID': 'ID-002'}).first()
+        lupus = child_dataset.record_queryset.filter(data__contains={'What': 'Canis lupus'}).first()
+        frog = child_dataset.record_queryset.filter(data__contains={'What': 'A frog'}).first()
+        self.assertEqual([r.pk for r in id_001.children], [lupus.pk])
+        self.assertEqual([r.pk for r in frog.parents], [id_002.pk])
+
+        client = self.custodian_1_client
+        url = reverse('api:record-list')
+        resp = client.get(url, {'parent': id_001.pk})
+        self.assertEqual([r['id'] for r in resp.json()], [lupus.pk])
+
+        # create
+        resp = client.post(url, data={
+            'dataset': child_dataset.pk,
+            'data': {'Survey ID': 'ID-001', 'What': 'A tooth brush'}
+        }, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        brush_id = resp.json()['id']
+        self.assertEqual(resp.json()['parent'], id_001.pk)
+        self.assertEqual(sorted(r['id'] for r in client.get(url, {'parent': id_001.pk}).json()),
+                         sorted([lupus.pk, brush_id]))
+
+        # update
+        resp = client.patch(reverse('api:record-detail', kwargs={'pk': lupus.pk}), data={
+            'data': {'Survey ID': 'ID-002', 'What': 'Canis lupus'}
+        }, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.json()['parent'], id_002.pk)
+        self.assertEqual(sorted(r.pk for r in id_002.children), sorted([lupus.pk, frog.pk]))
+
+        # delete
+        resp = client.delete(reverse('api:dataset-records', kwargs={'pk': parent_dataset.pk}), data=[id_002.pk],
+                             format='json')
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(list(frog.parents), [])
+
+        # admin update and delete
+        record_admin = RecordAdmin(Record, admin.site)
+        lupus.data = {'Survey ID': 'ID-001', 'What': 'Canis lupus'}
+        record_admin.save_model(None, lupus, None, True)
+        self.assertEqual(sorted(r.pk for r in id_001.children), sorted([lupus.pk, brush_id]))
+        record_admin.delete_model(None, lupus)
+        self.assertEqual([r.pk for r in id_001.children], [brush_id])
+
+        # foreign key removed
+        child_schema.pop('foreignKeys')
+        resp = self.data_engineer_1_client.patch(reverse('api:dataset-detail', kwargs={'pk': child_dataset.pk}), data={
+            'type': child_dataset.type,
+            'data_package': helpers.create_data_package_from_schema(child_schema)
+        }, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(id_001.children), [])
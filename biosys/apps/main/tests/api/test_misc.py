@@ -1,9 +1,11 @@
+from django.core.management import call_command
 from django.shortcuts import reverse
 from django.test import TestCase
+from django.utils.six import StringIO
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from main.models import Project
+from main.models import Project, Dataset, DatasetSummary, Record
 
 from main.tests import factories
 from main.tests.api import helpers
@@ -124,6 +126,57 @@ class TestStatistics(TestCase):
         )
         self.assertEqual(expected, resp.json())
 
+    def test_records_by_project(self):
+        user = factories.UserFactory.create()
+        client = APIClient()
+        client.force_authenticate(user)
+        program = factories.ProgramFactory.create()
+        projects = [factories.ProjectFactory.create(program=program, name=name) for name in ['A', 'B']]
+        dataset = factories.DatasetFactory.create(project=projects[0], name='Bats', type=Dataset.TYPE_OBSERVATION,
+                                                  data_package={})
+        for i in range(3):
+            Record.objects.create(dataset=dataset, data={'id': i})
+        factories.SiteFactory.create(project=projects[1])
+        # the records created without the API are not in the summaries
+        resp = client.get(self.url)
+        self.assertEqual(resp.json()['records']['total'], 0)
+        self.assertFalse(DatasetSummary.objects.exists())
+        call_command('rebuild_dataset_summaries', '--missing', stdout=StringIO())
+
+        resp = client.get(self.url, {'by_project': True})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.json()
+        self.assertEqual(data['records']['total'], 3)
+        self.assertEqual(data['records']['observation'], {'total': 3})
+        self.assertEqual(data['records']['generic'], {'total': 0})
+        self.assertEqual(data['projects']['total'], 2)
+        self.assertEqual(data['projects']['breakdown'], [
+            {
+                'id': projects[0].pk,
+                'name': 'A',
+                'datasets': {'total': 1},
+                'records': {'total': 3},
+                'sites': {'total': 0},
+            },
+            {
+                'id': projects[1].pk,
+                'name': 'B',
+                'datasets': {'total': 0},
+                'records': {'total': 0},
+                'sites': {'total': 1},
+            },
+        ])
+
+        # same shape with estimated totals
+        resp = client.get(self.url, {'estimate': True})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        estimated = resp.json()
+        self.assertEqual(estimated.keys(), data.keys())
+        self.assertNotIn('breakdown', estimated['projects'])
+        self.assertEqual(estimated['records']['observation'], {'total': 3})
+        for key in ['projects', 'datasets', 'records', 'sites']:
+            self.assertIsInstance(estimated[key]['total'], int)
+
     def test_not_allowed_methods(self):
         user = factories.UserFactory.create()
         user.set_password('password')
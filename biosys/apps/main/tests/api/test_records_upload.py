@@ -1,11 +1,15 @@
 import datetime
+import json
 from os import path
 
 from django.contrib.gis.geos import Point
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from rest_framework import status
 
+from main.api.uploaders import RecordCreator
 from main.models import Dataset, Site
 from main.tests import factories
 from main.tests.api import helpers
@@ -470,3 +474,489 @@ class TestObservation(helpers.BaseUserTestCase):
             expected_date = datetime.date(2017, 6, 4)
             self.assertEqual(timezone.localtime(record.datetime).date(), expected_date)
             self.assertEqual(record.geometry, self.site.geometry)
+
+    def test_site_from_other_project(self):
+        """
+        The site geometry lookup must be scoped to the dataset project.
+        """
+        factories.SiteFactory.create(project=self.project_2, code='OTHER', geometry=Point(115.76, -32.0))
+        csv_data = [
+            ['What', 'Site'],
+            ['Other project site', 'OTHER']
+        ]
+        file_ = helpers.rows_to_xlsx_file(csv_data)
+        client = self.custodian_1_client
+        with open(file_, 'rb') as fp:
+            data = {
+                'file': fp,
+                'strict': True
+            }
+            resp = client.post(self.url, data=data, format='multipart')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, resp.status_code)
+        self.assertEqual(resp.json()[0]['errors']['Site'], 'The site OTHER does not exist')
+        self.assertEqual(self.dataset.record_queryset.count(), 0)
+
+    def test_site_lookup_queries(self):
+        """
+        The sites are fetched once for the whole upload, not for every row.
+        """
+        csv_data = [['What', 'Site']] + [['Row {}'.format(i), self.site.code] for i in range(10)]
+        file_ = helpers.rows_to_csv_file(csv_data)
+        client = self.custodian_1_client
+        with open(file_) as fp:
+            data = {
+                'file': fp,
+                'strict': True,
+                'bulk': True
+            }
+            with CaptureQueriesContext(connection) as context:
+                resp = client.post(self.url, data=data, format='multipart')
+        self.assertEqual(status.HTTP_200_OK, resp.status_code)
+        self.assertLess(len(context.captured_queries), 10)
+        self.assertEqual(self.dataset.record_queryset.filter(site=self.site).count(), 10)
+
+
+class TestBulkUpload(helpers.BaseUserTestCase):
+    fields = [
+        {
+            "name": "Column A",
+            "type": "string",
+            "constraints": helpers.NOT_REQUIRED_CONSTRAINTS
+        },
+        {
+            "name": "Column B",
+            "type": "integer",
+            "constraints": helpers.REQUIRED_CONSTRAINTS
+        }
+    ]
+
+    def _more_setup(self):
+        self.ds = factories.DatasetFactory(
+            project=self.project_1,
+            type=Dataset.TYPE_GENERIC,
+            data_package=helpers.create_data_package_from_fields(self.fields))
+        self.url = reverse('api:dataset-upload', kwargs={'pk': self.ds.pk})
+
+    def test_bulk_happy_path(self):
+        csv_data = [['Column A', 'Column B']] + [['A{}'.format(i), i] for i in range(7)]
+        file_ = helpers.rows_to_csv_file(csv_data)
+        client = self.custodian_1_client
+        with open(file_) as fp:
+            data = {
+                'file': fp,
+                'strict': True,
+                'bulk': True,
+                'batch_size': 3
+            }
+            resp = client.post(self.url, data=data, format='multipart')
+        self.assertEqual(status.HTTP_200_OK, resp.status_code)
+        results = resp.json()
+        self.assertEqual(len(results), 7)
+        qs = self.ds.record_queryset.order_by('pk')
+        self.assertEqual(qs.count(), 7)
+        for index, (result, record) in enumerate(zip(results, qs)):
+            self.assertEqual(result['row'], index + 2)
+            self.assertEqual(result['recordId'], record.pk)
+            self.assertEqual(record.data, {'Column A': 'A{}'.format(index), 'Column B': index})
+            self.assertEqual(record.source_info, {'file_name': path.basename(file_), 'row': index + 2})
+
+    def test_bulk_error_is_isolated(self):
+        """
+        An invalid row must be reported on its own row and must not prevent the other rows of its batch to be saved.
+        """
+        csv_data = [
+            ['Column A', 'Column B'],
+            ['A1', 1],
+            ['A2', 'not an integer'],
+            ['A3', 3]
+        ]
+        file_ = helpers.rows_to_csv_file(csv_data)
+        client = self.custodian_1_client
+        with open(file_) as fp:
+            data = {
+                'file': fp,
+                'strict': True,
+                'bulk': True
+            }
+            resp = client.post(self.url, data=data, format='multipart')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, resp.status_code)
+        results = resp.json()
+        self.assertEqual(len(results), 3)
+        self.assertIn('recordId', results[0])
+        self.assertNotIn('recordId', results[1])
+        self.assertIn('Column B', results[1]['errors'])
+        self.assertIn('recordId', results[2])
+        self.assertEqual(
+            sorted([r.data['Column A'] for r in self.ds.record_queryset.all()]),
+            ['A1', 'A3']
+        )
+
+    def test_bulk_invalid_batch_size(self):
+        csv_data = [
+            ['Column A', 'Column B'],
+            ['A1', 1]
+        ]
+        file_ = helpers.rows_to_csv_file(csv_data)
+        client = self.custodian_1_client
+        with open(file_) as fp:
+            data = {
+                'file': fp,
+                'bulk': True,
+                'batch_size': 'many'
+            }
+            resp = client.post(self.url, data=data, format='multipart')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, resp.status_code)
+        self.assertEqual(self.ds.record_queryset.count(), 0)
+
+
+class TestUploadResponseModes(helpers.BaseUserTestCase):
+    fields = TestBulkUpload.fields
+    csv_data = [
+        ['Column A', 'Column B'],
+        ['A1', 1],
+        ['A2', 'not an integer'],
+        ['A3', 3]
+    ]
+
+    def _more_setup(self):
+        self.ds = factories.DatasetFactory(
+            project=self.project_1,
+            type=Dataset.TYPE_GENERIC,
+            data_package=helpers.create_data_package_from_fields(self.fields))
+        self.url = reverse('api:dataset-upload', kwargs={'pk': self.ds.pk})
+
+    def _post(self, **data):
+        with open(helpers.rows_to_csv_file(self.csv_data)) as fp:
+            data['file'] = fp
+            return self.custodian_1_client.post(self.url, data=data, format='multipart')
+
+    def _read_lines(self, resp):
+        content = b''.join(resp.streaming_content).decode('utf-8')
+        self.assertTrue(content.endswith('\n'))
+        return [json.loads(line) for line in content.splitlines()]
+
+    def test_summary(self):
+        resp = self._post(summary=True)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        data = resp.json()
+        self.assertEqual(data['summary'], {'total': 3, 'succeeded': 2, 'failed': 1, 'withWarnings': 0})
+        self.assertEqual(len(data['failedRows']), 1)
+        self.assertEqual(data['failedRows'][0]['row'], 3)
+        self.assertIn('Column B', data['failedRows'][0]['errors'])
+        self.assertEqual(self.ds.record_queryset.count(), 2)
+
+    def test_stream(self):
+        expected = self._post().json()
+        self.ds.record_queryset.delete()
+
+        resp = self._post(stream=True)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp['Content-Type'], 'application/x-ndjson')
+        lines = self._read_lines(resp)
+        self.assertEqual(len(lines), 4)
+        # the record ids differ between the two uploads
+        for result in expected + lines[:3]:
+            result.pop('recordId', None)
+        self.assertEqual(lines[:3], expected)
+        self.assertEqual(lines[3], {'summary': {'total': 3, 'succeeded': 2, 'failed': 1, 'withWarnings': 0}})
+        self.assertEqual(self.ds.record_queryset.count(), 2)
+
+    def test_stream_summary(self):
+        lines = self._read_lines(self._post(stream=True, summary=True))
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]['row'], 3)
+        self.assertEqual(lines[1]['summary']['failed'], 1)
+
+
+class TestUpsertUpload(helpers.BaseUserTestCase):
+    fields = [
+        {
+            "name": "Code",
+            "type": "string",
+            "constraints": helpers.REQUIRED_CONSTRAINTS
+        },
+        {
+            "name": "Count",
+            "type": "integer",
+            "constraints": helpers.NOT_REQUIRED_CONSTRAINTS
+        }
+    ]
+
+    def _create_dataset(self, primary_key=None):
+        schema = helpers.create_schema_from_fields(self.fields)
+        if primary_key:
+            schema['primaryKey'] = primary_key
+        self.ds = factories.DatasetFactory(
+            project=self.project_1,
+            type=Dataset.TYPE_GENERIC,
+            data_package=helpers.create_data_package_from_schema(schema))
+        self.url = reverse('api:dataset-upload', kwargs={'pk': self.ds.pk})
+
+    def _post(self, rows, **data):
+        with open(helpers.rows_to_csv_file(rows)) as fp:
+            data['file'] = fp
+            data['upsert'] = True
+            return self.custodian_1_client.post(self.url, data=data, format='multipart')
+
+    def _assert_upsert(self, **data):
+        resp = self._post([['Code', 'Count'], ['C1', 1], ['C2', 2]], **data)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['action'] for r in resp.json()], ['inserted', 'inserted'])
+        ids = dict((r.data['Code'], r.pk) for r in self.ds.record_queryset.all())
+
+        resp = self._post([['Code', 'Count'], ['C1', 1], ['C2', 20], ['C3', 3]], **data)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        results = resp.json()
+        self.assertEqual([r['action'] for r in results], ['unchanged', 'updated', 'inserted'])
+        self.assertEqual([r['recordId'] for r in results[:2]], [ids['C1'], ids['C2']])
+        records = dict((r.data['Code'], r) for r in self.ds.record_queryset.all())
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records['C2'].data, {'Code': 'C2', 'Count': 20})
+        self.assertEqual(records['C2'].source_info['row'], 3)
+        self.assertEqual(records['C1'].source_info['row'], 2)
+
+    def test_primary_key(self):
+        self._create_dataset(primary_key='Code')
+        self._assert_upsert()
+
+    def test_primary_key_bulk(self):
+        self._create_dataset(primary_key='Code')
+        self._assert_upsert(bulk=True, batch_size=2)
+
+    def test_set_based_update(self):
+        """
+        The matched records are updated with a single UPDATE per batch, without a query per record.
+        """
+        self._create_dataset(primary_key='Code')
+        self._post([['Code', 'Count'], ['C1', 1], ['C2', 2], ['C3', 3]])
+        rows = [['Code', 'Count'], ['C1', 10], ['C2', 20], ['C3', 3]]
+        for data in [{'bulk': True, 'batch_size': 10}, {}]:
+            rows[1][1] += 1
+            rows[2][1] += 1
+            with CaptureQueriesContext(connection) as queries:
+                resp = self._post(rows, **data)
+            self.assertEqual([r['action'] for r in resp.json()], ['updated', 'updated', 'unchanged'])
+            record_updates = [query for query in queries if 'UPDATE main_record r' in query['sql']]
+            self.assertEqual(len(record_updates), 1 if data else 3)
+            self.assertFalse([query for query in queries if 'WHERE "main_record"."id" = ' in query['sql']])
+        self.assertEqual(self.ds.record_queryset.get(data__Code='C1').data['Count'], 12)
+
+    def test_summary(self):
+        self._create_dataset(primary_key='Code')
+        self._post([['Code', 'Count'], ['C1', 1], ['C2', 2]])
+        resp = self._post([['Code', 'Count'], ['C1', 1], ['C2', 20], ['C3', 3]], summary=True)
+        summary = resp.json()['summary']
+        self.assertEqual((summary['inserted'], summary['updated'], summary['unchanged']), (1, 1, 1))
+
+    def test_client_id(self):
+        self._create_dataset()
+        rows = [['client_id', 'Code', 'Count'], ['id-1', 'C1', 1], ['id-2', 'C1', 2], ['', 'C3', 3]]
+        resp = self._post(rows, strict=True)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(self.ds.record_queryset.values_list('client_id', flat=True), key=str),
+                         sorted(['id-1', 'id-2', None], key=str))
+        # the client_id column is not saved in the data
+        self.assertEqual(self.ds.record_queryset.get(client_id='id-1').data, {'Code': 'C1', 'Count': 1})
+
+        rows = [['client_id', 'Code', 'Count'], ['id-1', 'C1', 10], ['id-2', 'C1', 2], ['', 'C3', 3]]
+        resp = self._post(rows, strict=True)
+        # a row without client_id can't be matched
+        self.assertEqual([r['action'] for r in resp.json()], ['updated', 'unchanged', 'inserted'])
+        self.assertEqual(self.ds.record_queryset.count(), 4)
+        source_info = self.ds.record_queryset.get(client_id='id-1').source_info
+        self.assertEqual(source_info['row'], 2)
+        self.assertTrue(source_info['file_name'].endswith('.csv'))
+
+    def test_duplicate_key(self):
+        self._create_dataset(primary_key='Code')
+        resp = self._post([['Code', 'Count'], ['C1', 1], ['C1', 2]])
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        results = resp.json()
+        self.assertEqual(results[0]['action'], 'inserted')
+        self.assertIn('Code', results[1]['errors'])
+        self.assertEqual(self.ds.record_queryset.count(), 1)
+
+    def test_copy_engine_not_supported(self):
+        self._create_dataset(primary_key='Code')
+        resp = self._post([['Code', 'Count'], ['C1', 1]], engine='copy')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.ds.record_queryset.count(), 0)
+
+
+class TestCopyEngine(helpers.BaseUserTestCase):
+
+    def _more_setup(self):
+        self.project = self.project_1
+        self.client = self.custodian_1_client
+        self.dataset = self._create_dataset_with_schema(
+            self.project,
+            self.data_engineer_1_client,
+            TestObservation.all_fields_nothing_required,
+            Dataset.TYPE_OBSERVATION
+        )
+        self.url = reverse('api:dataset-upload', kwargs={'pk': self.dataset.pk})
+        self.site = factories.SiteFactory.create(project=self.project, code='COT', geometry=Point(115.76, -32.0))
+
+    def _upload(self, csv_data, **kwargs):
+        file_ = helpers.rows_to_csv_file(csv_data)
+        with open(file_) as fp:
+            data = {
+                'file': fp,
+                'strict': True,
+                'engine': 'copy'
+            }
+            data.update(kwargs)
+            return self.client.post(self.url, data=data, format='multipart')
+
+    def test_happy_path(self):
+        csv_data = [
+            ['What', 'When', 'Site', 'Latitude', 'Longitude'],
+            ['Lat/long', '04/06/2017', '', -32.5, 115.5],
+            ['Site', '05/06/2017', 'COT', '', ''],
+        ]
+        resp = self._upload(csv_data)
+        self.assertEqual(status.HTTP_200_OK, resp.status_code)
+        results = resp.json()
+        self.assertEqual([result['row'] for result in results], [2, 3])
+        qs = self.dataset.record_queryset.order_by('pk')
+        self.assertEqual(qs.count(), 2)
+        self.assertEqual([result['recordId'] for result in results], [record.pk for record in qs])
+
+        record = qs[0]
+        self.assertEqual(record.data['What'], 'Lat/long')
+        self.assertEqual(record.data['Latitude'], -32.5)
+        self.assertEqual((record.geometry.x, record.geometry.y), (115.5, -32.5))
+        self.assertEqual(timezone.localtime(record.datetime).date(), datetime.date(2017, 6, 4))
+        self.assertIsNone(record.site)
+        self.assertEqual(record.source_info['row'], 2)
+
+        record = qs[1]
+        self.assertEqual(record.site, self.site)
+        self.assertEqual(record.geometry, self.site.geometry)
+        self.assertEqual(timezone.localtime(record.datetime).date(), datetime.date(2017, 6, 5))
+
+    def test_errors(self):
+        csv_data = [
+            ['What', 'When', 'Site', 'Latitude', 'Longitude'],
+            ['Unknown site', '04/06/2017', 'UNKNOWN', '', ''],
+            ['Bad date', 'not a date', 'COT', '', ''],
+            ['OK', '04/06/2017', 'COT', '', ''],
+        ]
+        resp = self._upload(csv_data)
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, resp.status_code)
+        results = resp.json()
+        self.assertEqual(len(results), 3)
+        self.assertNotIn('recordId', results[0])
+        self.assertEqual(results[0]['errors']['Site'], 'The site UNKNOWN does not exist')
+        self.assertNotIn('recordId', results[1])
+        self.assertIn('When', results[1]['errors'])
+        self.assertIn('recordId', results[2])
+        self.assertEqual(self.dataset.record_queryset.count(), 1)
+
+    def test_create_site(self):
+        csv_data = [
+            ['What', 'Site', 'Latitude', 'Longitude'],
+            ['New site', 'NEW', -32.5, 115.5],
+        ]
+        resp = self._upload(csv_data, create_site=True)
+        self.assertEqual(status.HTTP_200_OK, resp.status_code)
+        site = Site.objects.filter(project=self.project, code='NEW').first()
+        self.assertIsNotNone(site)
+        self.assertEqual(self.dataset.record_queryset.first().site, site)
+
+    def test_unknown_engine(self):
+        csv_data = [
+            ['What', 'Site'],
+            ['Site', 'COT'],
+        ]
+        resp = self._upload(csv_data, engine='turbo')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, resp.status_code)
+        self.assertEqual(self.dataset.record_queryset.count(), 0)
+
+
+class TestParallelValidation(helpers.BaseUserTestCase):
+
+    def _more_setup(self):
+        self.project = self.project_1
+        self.client = self.custodian_1_client
+        self.dataset = self._create_dataset_with_schema(
+            self.project,
+            self.data_engineer_1_client,
+            TestObservation.all_fields_nothing_required,
+            Dataset.TYPE_OBSERVATION
+        )
+        self.url = reverse('api:dataset-upload', kwargs={'pk': self.dataset.pk})
+        self.site = factories.SiteFactory.create(project=self.project, code='COT', geometry=Point(115.76, -32.0))
+
+    def _upload(self, csv_data, **kwargs):
+        file_ = helpers.rows_to_csv_file(csv_data)
+        with open(file_) as fp:
+            data = {
+                'file': fp,
+                'strict': True,
+            }
+            data.update(kwargs)
+            return self.client.post(self.url, data=data, format='multipart')
+
+    def _set_chunk_size(self, chunk_size):
+        default = RecordCreator.DEFAULT_CHUNK_SIZE
+        RecordCreator.DEFAULT_CHUNK_SIZE = chunk_size
+        self.addCleanup(setattr, RecordCreator, 'DEFAULT_CHUNK_SIZE', default)
+
+    def _get_records(self):
+        return [
+            (r.data, r.datetime, r.geometry.coords if r.geometry else None, r.site_id, r.source_info)
+            for r in self.dataset.record_queryset.order_by('pk')
+        ]
+
+    def test_same_results_as_serial(self):
+        """
+        The rows validated in a process pool must give the same results and records, in the same order, as the serial
+        validation.
+        """
+        csv_data = [['What', 'When', 'Site', 'Latitude', 'Longitude']]
+        for i in range(25):
+            csv_data += [
+                ['Lat/long {}'.format(i), '04/06/2017', '', -32.5, 115.5],
+                ['Site {}'.format(i), '05/06/2017', 'COT', '', ''],
+                ['Unknown site {}'.format(i), '05/06/2017', 'UNKNOWN', '', ''],
+                ['Bad date {}'.format(i), 'not a date', 'COT', '', ''],
+            ]
+        resp = self._upload(csv_data)
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, resp.status_code)
+        expected_results = resp.json()
+        expected_records = self._get_records()
+        self.dataset.record_queryset.delete()
+
+        self._set_chunk_size(7)
+        resp = self._upload(csv_data, processes=3)
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, resp.status_code)
+        results = resp.json()
+        for result in expected_results + results:
+            result.pop('recordId', None)
+        self.assertEqual(results, expected_results)
+        self.assertEqual(self._get_records(), expected_records)
+
+    def test_created_site(self):
+        """
+        A site created by a row must be seen by the next rows even if they have been validated before its creation.
+        """
+        csv_data = [
+            ['What', 'Site', 'Latitude', 'Longitude'],
+            ['New site', 'NEW', -32.5, 115.5],
+            ['Same site', 'NEW', -32.6, 115.6],
+        ]
+        self._set_chunk_size(1)
+        resp = self._upload(csv_data, create_site=True, processes=2)
+        self.assertEqual(status.HTTP_200_OK, resp.status_code)
+        site = Site.objects.get(project=self.project, code='NEW')
+        self.assertEqual([r.site for r in self.dataset.record_queryset.order_by('pk')], [site, site])
+
+    def test_invalid_processes(self):
+        csv_data = [
+            ['What', 'Site'],
+            ['Site', 'COT'],
+        ]
+        resp = self._upload(csv_data, processes='many')
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, resp.status_code)
+        self.assertEqual(self.dataset.record_queryset.count(), 0)
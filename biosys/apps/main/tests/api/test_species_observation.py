@@ -711,6 +711,36 @@ class TestDateTimeAndGeometryExtraction(helpers.BaseUserTestCase):
         self.assertEqual((111.111, 22.222), (geometry.x, geometry.y))
 
 
+    def test_db_render(self):
+        """
+        The records rendered by the database (?render=db) are the same as the serialized ones: datetime in the
+        current time zone and geojson geometry.
+        """
+        client = self.custodian_1_client
+        ds = self._create_dataset_with_schema(
+            self.project_1, self.data_engineer_1_client, self.schema_with_species_name(),
+            dataset_type=Dataset.TYPE_SPECIES_OBSERVATION
+        )
+        for when, latitude in [('2018-01-31', -32.0), ('2017-12-24', 22.222), ('2018-06-30', -31.123456)]:
+            self._create_record(client, ds, {
+                'Species Name': 'Chubby Bat',
+                'Latitude': latitude,
+                'Longitude': 115.75,
+                'When': when
+            })
+        urls = [
+            (reverse('api:dataset-records', kwargs={'pk': ds.pk}), {}),
+            (reverse('api:record-list'), {'dataset__id': ds.pk}),
+        ]
+        for url, params in urls:
+            for extra in [{}, {'limit': 2, 'offset': 1}, {'fields': ['id', 'datetime', 'geometry']}]:
+                query = dict(params, **extra)
+                expected = client.get(url, query).json()
+                resp = client.get(url, dict(query, render='db'))
+                self.assertEqual(resp.status_code, status.HTTP_200_OK)
+                self.assertEqual(json.loads(b''.join(resp.streaming_content).decode('utf-8')), expected)
+
+
 class TestSpeciesNameExtraction(helpers.BaseUserTestCase):
     species_facade_class = NoSpeciesFacade
 
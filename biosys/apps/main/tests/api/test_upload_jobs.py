@@ -0,0 +1,193 @@
+import datetime
+import json
+
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.utils import timezone
+from django.utils.six import StringIO
+from rest_framework import status
+
+from main.api.jobs import UploadJobRunner, claim_next_job, fail_stale_jobs
+from main.models import Dataset, Site, UploadJob
+from main.tests import factories
+from main.tests.api import helpers
+
+
+class TestRecordsUploadJob(helpers.BaseUserTestCase):
+    def _more_setup(self):
+        self.fields = [
+            {
+                "name": "Column A",
+                "type": "string",
+                "constraints": helpers.NOT_REQUIRED_CONSTRAINTS
+            },
+            {
+                "name": "Column B",
+                "type": "string",
+                "constraints": helpers.REQUIRED_CONSTRAINTS
+            }
+        ]
+        self.ds = factories.DatasetFactory(
+            project=self.project_1,
+            type=Dataset.TYPE_GENERIC,
+            data_package=helpers.create_data_package_from_fields(self.fields))
+        self.url = reverse('api:dataset-upload', kwargs={'pk': self.ds.pk})
+        self.rows = [
+            ['Column A', 'Column B'],
+            ['A1', 'B1'],
+            ['A2', ''],  # Column B is required
+            ['A3', 'B3']
+        ]
+
+    def _post(self, rows, **data):
+        file_ = helpers.rows_to_csv_file(rows)
+        with open(file_) as fp:
+            data['file'] = fp
+            return self.custodian_1_client.post(self.url, data=data, format='multipart')
+
+    def _process_jobs(self):
+        call_command('process_upload_jobs', '--once', stdout=StringIO(), stderr=StringIO())
+
+    def _get_report(self, job_id):
+        url = reverse('api:upload-job-report', kwargs={'pk': job_id})
+        resp = self.custodian_1_client.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        return json.loads(b''.join(resp.streaming_content).decode('utf-8'))
+
+    def test_async_post_returns_job(self):
+        resp = self._post(self.rows, strict=True, **{'async': True})
+        self.assertEqual(resp.status_code, status.HTTP_202_ACCEPTED)
+        job_id = resp.data['id']
+        self.assertEqual(resp.data['status'], UploadJob.STATUS_PENDING)
+        self.assertEqual(resp.data['dataset'], self.ds.pk)
+        self.assertEqual(resp.data['options']['strict'], True)
+        # nothing created until the job is processed
+        self.assertEqual(self.ds.record_queryset.count(), 0)
+
+        url = reverse('api:upload-job-detail', kwargs={'pk': job_id})
+        resp = self.custodian_1_client.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data['status'], UploadJob.STATUS_PENDING)
+        # no report yet
+        url = reverse('api:upload-job-report', kwargs={'pk': job_id})
+        self.assertEqual(self.custodian_1_client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_report_same_as_sync_upload(self):
+        resp = self._post(self.rows, strict=True)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        expected = json.loads(json.dumps(resp.data))
+        self.ds.record_queryset.delete()
+
+        resp = self._post(self.rows, strict=True, **{'async': True})
+        self.assertEqual(resp.status_code, status.HTTP_202_ACCEPTED)
+        job_id = resp.data['id']
+        self._process_jobs()
+
+        job = UploadJob.objects.get(pk=job_id)
+        self.assertEqual(job.status, UploadJob.STATUS_COMPLETED)
+        self.assertEqual(job.rows_processed, 3)
+        self.assertEqual(job.error_count, 1)
+        self.assertIsNotNone(job.finished)
+        self.assertEqual(self.ds.record_queryset.count(), 2)
+
+        report = self._get_report(job_id)
+        # the record ids differ between the two uploads
+        for result in expected + report:
+            result.pop('recordId', None)
+        self.assertEqual(report, expected)
+
+    def test_progress_updated_while_running(self):
+        rows = [['Column A', 'Column B']] + [['A', 'B'] for _ in range(5)]
+        resp = self._post(rows, **{'async': True})
+        job = claim_next_job()
+        self.assertEqual(job.pk, resp.data['id'])
+        self.assertEqual(job.status, UploadJob.STATUS_RUNNING)
+        # no other job to claim
+        self.assertIsNone(claim_next_job())
+
+        runner = UploadJobRunner(job, species_facade_class=self.species_facade_class)
+        runner.PROGRESS_INTERVAL = 2
+        progress = []
+        update = runner._progress
+
+        def _progress(has_error):
+            update(has_error)
+            progress.append(UploadJob.objects.get(pk=job.pk).rows_processed)
+
+        runner._progress = _progress
+        runner.run()
+        self.assertEqual(progress, [0, 2, 2, 4, 4])
+        self.assertEqual(UploadJob.objects.get(pk=job.pk).rows_processed, 5)
+
+    def test_failed_job(self):
+        resp = self._post(self.rows, **{'async': True})
+        job = UploadJob.objects.get(pk=resp.data['id'])
+        # the file has been lost
+        job.file.storage.delete(job.file.name)
+        self._process_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, UploadJob.STATUS_FAILED)
+        self.assertTrue(job.message)
+        url = reverse('api:upload-job-report', kwargs={'pk': job.pk})
+        self.assertEqual(self.custodian_1_client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_stale_job_failed(self):
+        resp = self._post(self.rows, **{'async': True})
+        job = claim_next_job()
+        self.assertEqual(job.pk, resp.data['id'])
+        # the worker is alive
+        self.assertEqual(fail_stale_jobs(timeout=60), 0)
+        # the worker was killed 2 minutes ago
+        UploadJob.objects.filter(pk=job.pk).update(heartbeat=timezone.now() - datetime.timedelta(minutes=2))
+        self.assertEqual(fail_stale_jobs(timeout=60), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, UploadJob.STATUS_FAILED)
+        self.assertTrue(job.message)
+        self.assertIsNotNone(job.finished)
+
+    def test_invalid_options_rejected(self):
+        resp = self._post(self.rows, engine='unknown', **{'async': True})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(UploadJob.objects.count(), 0)
+
+    def test_permissions(self):
+        file_ = helpers.rows_to_csv_file(self.rows)
+        for client in [self.readonly_client, self.custodian_2_client]:
+            with open(file_) as fp:
+                resp = client.post(self.url, data={'file': fp, 'async': True}, format='multipart')
+                self.assertEqual(resp.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(UploadJob.objects.count(), 0)
+        # jobs are read only
+        job_id = self._post(self.rows, **{'async': True}).data['id']
+        url = reverse('api:upload-job-detail', kwargs={'pk': job_id})
+        self.assertEqual(self.admin_client.delete(url).status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+class TestSitesUploadJob(helpers.BaseUserTestCase):
+
+    def test_async_sites_upload(self):
+        rows = [
+            ['Site Code', 'Site Name', 'Latitude', 'Longitude'],
+            ['C1', 'Site 1', -32, 116],
+            ['', 'No code', -31, 117]
+        ]
+        url = reverse('api:upload-sites', kwargs={'pk': self.project_1.pk})
+        with open(helpers.rows_to_csv_file(rows)) as fp:
+            resp = self.custodian_1_client.post(url, data={'file': fp, 'async': True}, format='multipart')
+        self.assertEqual(resp.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(resp.data['type'], UploadJob.TYPE_SITES)
+        self.assertEqual(Site.objects.filter(project=self.project_1).count(), 0)
+
+        call_command('process_upload_jobs', '--once', stdout=StringIO(), stderr=StringIO())
+        site = Site.objects.get(project=self.project_1)
+        self.assertEqual(site.code, 'C1')
+
+        report_url = reverse('api:upload-job-report', kwargs={'pk': resp.data['id']})
+        resp = self.custodian_1_client.get(report_url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        report = json.loads(b''.join(resp.streaming_content).decode('utf-8'))
+        expected = {
+            '1': {'site': site.pk, 'error': None},
+            '2': {'site': None, 'error': 'Site Code is missing'}
+        }
+        self.assertEqual(report, expected)
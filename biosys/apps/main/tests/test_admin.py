@@ -1,8 +1,10 @@
 from django.core.urlresolvers import reverse
+from django.db import connection
 
-from main.models import Project, Site
+from main.models import Project, Site, Dataset, DatasetSummary, Record
 from main.tests import factories
 from main.tests.api import helpers
+from main.utils_index import build_pending_indexes
 
 
 class BaseTestCase(helpers.BaseUserTestCase):
@@ -55,4 +57,62 @@ class AdminTest(BaseTestCase):
                 response = self.client.get(url)
                 self.assertEqual(
                     response.status_code, code,
-                    '{} wrong permission for {} ({})'.format(user, m._meta.object_name, response.status_code))
\ No newline at end of file
+                    '{} wrong permission for {} ({})'.format(user, m._meta.object_name, response.status_code))
+
+
+class DeleteSelectedTest(BaseTestCase):
+
+    def setUp(self):
+        super(DeleteSelectedTest, self).setUp()
+        fields = [
+            {
+                'name': 'What',
+                'type': 'string',
+                'biosys': {'index': True}
+            },
+        ]
+        self.ds = self._create_dataset_with_schema(self.project_1, self.data_engineer_1_client, fields)
+        self.records = [self._create_record(self.custodian_1_client, self.ds, {'What': what}) for what in 'abc']
+        self.client.force_login(self.admin_user)
+
+    def _delete_selected(self, model, objs, confirm=True):
+        data = {
+            'action': 'delete_selected',
+            '_selected_action': [obj.pk for obj in objs]
+        }
+        if confirm:
+            data['post'] = 'yes'
+        return self.client.post(reverse('admin:main_{}_changelist'.format(model._meta.model_name)), data)
+
+    def test_records(self):
+        # the confirmation page
+        response = self._delete_selected(Record, self.records[:2], confirm=False)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.ds.record_queryset.count(), 3)
+
+        response = self._delete_selected(Record, self.records[:2])
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(self.ds.record_queryset.values_list('pk', flat=True)), [self.records[2].pk])
+        summary = DatasetSummary.objects.get(dataset=self.ds)
+        self.assertEqual(summary.record_count, 1)
+
+    def _count_db_indexes(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM pg_indexes WHERE indexname = %s", [name])
+            return cursor.fetchone()[0]
+
+    def test_datasets(self):
+        index_name = build_pending_indexes()[0].name
+        self.assertEqual(self._count_db_indexes(index_name), 1)
+        response = self._delete_selected(Dataset, [self.ds])
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Dataset.objects.filter(pk=self.ds.pk).exists())
+        self.assertFalse(Record.objects.filter(pk__in=[record.pk for record in self.records]).exists())
+        # the index is dropped with the dataset, not left as an orphan
+        self.assertEqual(self._count_db_indexes(index_name), 0)
+
+    def test_projects(self):
+        response = self._delete_selected(Project, [self.project_1])
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Project.objects.filter(pk=self.project_1.pk).exists())
+        self.assertFalse(Dataset.objects.filter(pk=self.ds.pk).exists())
@@ -408,6 +408,196 @@ class TestGenericSchemaValidation(TestCase):
         self.sch = GenericSchema(self.descriptor)
 
 
+class TestRowProcessor(TestCase):
+    """
+    The compiled row processor must give the same results as the field by field validation and cast.
+    """
+    descriptor = {
+        "fields": [
+            {"name": "Integer", "type": "integer"},
+            {"name": "Number", "type": "number", "constraints": {"required": True, "minimum": -90, "maximum": 90}},
+            {"name": "Enum", "type": "string", "constraints": {"enum": ["a", "b"]}},
+            {"name": "Date", "type": "date", "format": "any"},
+            {"name": "Boolean", "type": "boolean"},
+        ]
+    }
+    values = ['', ' ', None, '1', ' 1', '1.0', '1.2', '-91', '45.5', 'a', 'c', '12/01/2018', '2018-01-12', 'not a date',
+              'yes', 'No', 1, 1.5, 0]
+
+    def setUp(self):
+        self.schema = GenericSchema(clone(self.descriptor))
+        self.processor = self.schema.row_processor
+
+    def test_same_errors_as_field_validation(self):
+        for field in self.schema.fields:
+            for value in self.values:
+                processed_row = self.processor.process({field.name: value})
+                expected = self.schema.field_validation_error(field.name, value)
+                self.assertEqual(dict(processed_row.errors).get(field.name), expected or None,
+                                 msg="{}: {!r}".format(field.name, value))
+
+    def test_unknown_and_missing_fields(self):
+        processed_row = self.processor.process({'Unknown': 'x'})
+        self.assertEqual(
+            processed_row.errors,
+            [('Unknown', "The field 'Unknown' doesn't exists in the schema. Should be one of {}".format(
+                self.schema.field_names))]
+        )
+        self.assertEqual([f.name for f in processed_row.missing_fields], ['Number'])
+
+    def test_cast_numbers(self):
+        for value in self.values:
+            row = {'Integer': value, 'Number': value, 'Enum': value}
+            expected = self.schema.cast_numbers(dict(row))
+            casted = self.processor.process(dict(row)).cast_numbers()
+            self.assertEqual(casted, expected, msg=repr(value))
+            self.assertEqual([type(casted[k]) for k in sorted(casted)], [type(expected[k]) for k in sorted(expected)])
+
+    def test_cast_is_done_once(self):
+        field = self.schema.get_field_by_name('Date')
+        processed_row = self.processor.process({'Date': '12/01/2018'})
+        self.assertEqual(processed_row.values['Date'], datetime.date(2018, 1, 12))
+        processed_row.values['Date'] = 'cached'
+        self.assertEqual(processed_row.cast(field), 'cached')
+
+
+class TestDateFormatDetector(TestCase):
+    """
+    The dates parsed with the detected format must be the same as the ones parsed with dateutil.
+    """
+
+    def assert_same_as_dateutil(self, detector, values):
+        for value in values:
+            self.assertEqual(detector.parse(value), parse_datetime_day_first(value), msg=value)
+
+    def test_day_first_format(self):
+        detector = DateFormatDetector(sample_size=3)
+        self.assert_same_as_dateutil(detector, ['12/01/2018', '1/2/2018', '31/12/2017'])
+        self.assertEqual(detector.format, '%d/%m/%Y')
+        # month first (not valid as day first) and other formats fall back to dateutil
+        self.assert_same_as_dateutil(detector, [
+            '05/06/2017', '01/13/2018', '2018-01-12', '12 Jan 2018', '13/01/2018 10:00'
+        ])
+        with self.assertRaises(ValueError):
+            detector.parse('31/02/2018')
+
+    def test_iso_format(self):
+        detector = DateFormatDetector(sample_size=2)
+        self.assert_same_as_dateutil(detector, ['2018-01-12', '2017-12-31'])
+        self.assertEqual(detector.format, '%Y-%m-%d')
+        # not yyyy-mm-dd: parsed day first by dateutil
+        self.assert_same_as_dateutil(detector, ['2018-1-5', '2018-02-03'])
+
+    def test_datetime_format(self):
+        detector = DateFormatDetector(sample_size=2)
+        self.assert_same_as_dateutil(detector, ['12/01/2018 13:45', '13/01/2018 9:05'])
+        self.assertEqual(detector.format, '%d/%m/%Y %H:%M')
+        self.assert_same_as_dateutil(detector, ['14/01/2018 23:59', '14/01/2018'])
+
+    def test_no_consistent_format(self):
+        detector = DateFormatDetector(sample_size=5)
+        self.assert_same_as_dateutil(detector, ['12/01/2018', '2018-01-12'])
+        self.assertTrue(detector.is_detection_done)
+        self.assertIsNone(detector.format)
+        # two digits years are left to dateutil
+        detector = DateFormatDetector(sample_size=1)
+        self.assert_same_as_dateutil(detector, ['12/01/70', '12/01/18'])
+        self.assertIsNone(detector.format)
+
+    def test_row_processor_reports_formats(self):
+        schema = GenericSchema({
+            "fields": [
+                {"name": "Date", "type": "date", "format": "any"},
+                {"name": "DateTime", "type": "datetime", "format": "any"},
+                {"name": "Other Date", "type": "date", "format": "any"},
+            ]
+        })
+        processor = RowProcessor(schema, detect_date_formats=True)
+        for day in range(1, DateFormatDetector.SAMPLE_SIZE + 5):
+            row = {'Date': '{}/01/2018'.format(day), 'DateTime': '2018-01-{:02d} 10:00:00'.format(day)}
+            processed_row = processor.process(row)
+            self.assertEqual(processed_row.values['Date'], datetime.date(2018, 1, day))
+            self.assertEqual(processed_row.values['DateTime'], datetime.datetime(2018, 1, day, 10))
+        self.assertEqual(processor.date_formats, {'Date': '%d/%m/%Y', 'DateTime': '%Y-%m-%d %H:%M:%S'})
+        # the schema processor doesn't detect anything
+        self.assertEqual(schema.row_processor.date_formats, {})
+
+
+class TestCoordTransform(TestCase):
+    """
+    The cached transformations must give the same results as GEOSGeometry.transform
+    """
+
+    def test_transform_geometry(self):
+        point = Point(115.76, -32.0, srid=MODEL_SRID)
+        for srid in [4283, 28350, 20350, 20250]:
+            expected = point.transform(srid, clone=True)
+            transformed = transform_geometry(point, srid, clone=True)
+            self.assertEqual(transformed.srid, srid)
+            self.assertAlmostEqual(transformed.x, expected.x, places=6)
+            self.assertAlmostEqual(transformed.y, expected.y, places=6)
+            # the cloned point is not changed
+            self.assertEqual(point.srid, MODEL_SRID)
+        # in place
+        transform_geometry(point, 28350)
+        self.assertEqual(point.srid, 28350)
+        self.assertIs(get_coord_transform(MODEL_SRID, 28350), get_coord_transform(MODEL_SRID, 28350))
+
+    def test_transform_coordinates(self):
+        coordinates = [(390000.0, 6460000.0), (400000.0, 6470000.0), (410000.0, 6450000.0)]
+        transformed = transform_coordinates(coordinates, 28350, MODEL_SRID)
+        self.assertEqual(len(transformed), len(coordinates))
+        for (x, y), (lon, lat) in zip(coordinates, transformed):
+            expected = Point(x, y, srid=28350).transform(MODEL_SRID, clone=True)
+            self.assertAlmostEqual(lon, expected.x, places=6)
+            self.assertAlmostEqual(lat, expected.y, places=6)
+        self.assertEqual(transform_coordinates([], 28350, MODEL_SRID), [])
+        self.assertEqual(transform_coordinates(coordinates, 28350, 28350), coordinates)
+
+
+class TestSchemaCache(TestCase):
+
+    def test_get(self):
+        cache = SchemaCache(maxsize=2)
+        descriptor = clone(GENERIC_SCHEMA)
+        schema = cache.get(GenericSchema, descriptor)
+        self.assertIsInstance(schema, GenericSchema)
+        self.assertIs(cache.get(GenericSchema, clone(descriptor)), schema)
+        # the class is part of the key
+        self.assertIsNot(cache.get(ObservationSchema, clone(LAT_LONG_OBSERVATION_SCHEMA)),
+                         cache.get(GenericSchema, clone(LAT_LONG_OBSERVATION_SCHEMA)))
+        # the cached schema doesn't follow the descriptor changes
+        descriptor['fields'][0]['name'] = 'Other'
+        self.assertEqual(schema.field_names, ['Name'])
+        self.assertEqual(cache.get(GenericSchema, descriptor).field_names, ['Other'])
+        self.assertEqual(len(cache), 2)
+
+    def test_lru(self):
+        cache = SchemaCache(maxsize=2)
+        descriptors = []
+        for name in ['A', 'B', 'C']:
+            descriptor = clone(GENERIC_SCHEMA)
+            descriptor['fields'][0]['name'] = name
+            descriptors.append(descriptor)
+        schema_a = cache.get(GenericSchema, descriptors[0])
+        schema_b = cache.get(GenericSchema, descriptors[1])
+        # A is the most recently used, B is evicted
+        cache.get(GenericSchema, descriptors[0])
+        cache.get(GenericSchema, descriptors[2])
+        self.assertIs(cache.get(GenericSchema, descriptors[0]), schema_a)
+        self.assertIsNot(cache.get(GenericSchema, descriptors[1]), schema_b)
+
+    def test_dataset_schema(self):
+        dataset = Dataset(id=1, type=Dataset.TYPE_GENERIC, data_package=clone(GENERIC_DATA_PACKAGE))
+        schema = dataset.schema
+        # shared by the datasets with the same schema
+        self.assertIs(Dataset(id=2, data_package=clone(GENERIC_DATA_PACKAGE)).schema, schema)
+        dataset.data_package['resources'][0]['schema']['fields'].append(clone(BASE_FIELD))
+        dataset.data_package['resources'][0]['schema']['fields'][1]['name'] = 'Other'
+        self.assertEqual(dataset.schema.field_names, ['Name', 'Other'])
+        self.assertEqual(schema.field_names, ['Name'])
+
+
 class TestObservationSchemaCast(TestCase):
     def setUp(self):
         self.descriptor = clone(LAT_LONG_OBSERVATION_SCHEMA)
@@ -0,0 +1,84 @@
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.utils.six import StringIO
+from rest_framework import status
+
+from main.models import Dataset, Media, PendingFileDeletion, Project, Record
+from main.tests import factories
+from main.tests.api import helpers
+from main.utils_delete import delete_records, clean_deleted_files
+
+
+class TestDeleteRecords(helpers.BaseUserTestCase):
+
+    def _more_setup(self):
+        self.ds = self._create_dataset_and_records_from_rows([
+            ['What', 'When'],
+            ['Canis lupus', '2018-06-11'],
+            ['Chubby bat', '2018-06-12'],
+            ['Red fox', '2018-06-13'],
+        ])
+        self.records = list(self.ds.record_queryset.order_by('pk'))
+        self.media = [factories.MediaFactory(record=record) for record in self.records[:2]]
+        self.files = [media.file.name for media in self.media]
+        for file_ in self.files:
+            self.assertTrue(default_storage.exists(file_))
+
+    def test_delete_by_batch(self):
+        other_ds = factories.DatasetFactory(project=self.project_1, data_package=self.ds.data_package)
+        Record.objects.create(dataset=other_ds, data={'What': 'Other', 'When': '2018-06-11'})
+        deleted = delete_records(self.ds.record_queryset, batch_size=2)
+        self.assertEqual(deleted, 3)
+        self.assertEqual(self.ds.record_queryset.count(), 0)
+        self.assertEqual(Media.objects.filter(pk__in=[m.pk for m in self.media]).count(), 0)
+        self.assertEqual(other_ds.record_queryset.count(), 1)
+        # the files are only queued
+        self.assertEqual(sorted(PendingFileDeletion.objects.values_list('file', flat=True)), sorted(self.files))
+        for file_ in self.files:
+            self.assertTrue(default_storage.exists(file_))
+
+        self.assertEqual(clean_deleted_files(), (2, 0))
+        self.assertEqual(PendingFileDeletion.objects.count(), 0)
+        for file_ in self.files:
+            self.assertFalse(default_storage.exists(file_))
+
+    def test_resume(self):
+        """
+        An interrupted delete is resumed by deleting again.
+        """
+        delete_records(Record.objects.filter(pk=self.records[0].pk))
+        self.assertEqual(self.ds.record_queryset.count(), 2)
+        self.assertEqual(delete_records(self.ds.record_queryset), 2)
+        self.assertEqual(self.ds.record_queryset.count(), 0)
+        # an already deleted file is not an error
+        default_storage.delete(self.files[0])
+        call_command('clean_deleted_files', '--once', stdout=StringIO())
+        self.assertEqual(PendingFileDeletion.objects.count(), 0)
+        self.assertFalse(default_storage.exists(self.files[1]))
+
+    def test_api_delete_all(self):
+        url = reverse('api:dataset-records', kwargs={'pk': self.ds.pk})
+        resp = self.custodian_1_client.delete(url, data='all', format='json')
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.ds.record_queryset.count(), 0)
+        self.assertEqual(PendingFileDeletion.objects.count(), 2)
+
+    def test_api_delete_dataset_and_project(self):
+        dataset_media = factories.DatasetMediaFactory(dataset=self.ds)
+        url = reverse('api:dataset-detail', kwargs={'pk': self.ds.pk})
+        resp = self.admin_client.delete(url)
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Dataset.objects.filter(pk=self.ds.pk).exists())
+        self.assertEqual(Record.objects.filter(pk__in=[r.pk for r in self.records]).count(), 0)
+        self.assertEqual(sorted(PendingFileDeletion.objects.values_list('file', flat=True)),
+                         sorted(self.files + [dataset_media.file.name]))
+
+        project_media = factories.ProjectMediaFactory(project=self.project_1)
+        url = reverse('api:project-detail', kwargs={'pk': self.project_1.pk})
+        resp = self.admin_client.delete(url)
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Project.objects.filter(pk=self.project_1.pk).exists())
+        self.assertIn(project_media.file.name, PendingFileDeletion.objects.values_list('file', flat=True))
+        clean_deleted_files()
+        self.assertFalse(default_storage.exists(project_media.file.name))
@@ -0,0 +1,46 @@
+import datetime
+
+from django.test import TestCase
+
+from main.api.uploaders import XLSXDictReader
+from main.tests.api import helpers
+
+
+class TestXLSXDictReader(TestCase):
+
+    def test_values_formatted_as_csv(self):
+        rows = [
+            ['Text', 'Blank', 'Integer', 'Float', 'Date'],
+            ['A', None, 12, 1.5, datetime.datetime(2018, 1, 20)]
+        ]
+        reader = XLSXDictReader(helpers.rows_to_xlsx_file(rows))
+        self.assertEqual(reader.fieldnames, rows[0])
+        records = list(reader)
+        self.assertEqual(len(records), 1)
+        expected = {
+            'Text': 'A',
+            'Integer': '12',
+            'Float': '1.5',
+            'Date': '20/01/2018',
+            'Blank': ''
+        }
+        self.assertEqual(records[0], expected)
+
+    def test_short_and_long_rows(self):
+        """
+        Rows shorter or longer than the headers are handled like the csv.DictReader
+        """
+        rows = [
+            ['A', 'B'],
+            ['A1'],
+            ['A2', 'B2', 'C2']
+        ]
+        reader = XLSXDictReader(helpers.rows_to_xlsx_file(rows))
+        records = list(reader)
+        self.assertEqual(records[0], {'A': 'A1', 'B': None})
+        self.assertEqual(records[1], {'A': 'A2', 'B': 'B2', None: ['C2']})
+
+    def test_empty_file(self):
+        reader = XLSXDictReader(helpers.rows_to_xlsx_file([]))
+        self.assertEqual(reader.fieldnames, [])
+        self.assertEqual(list(reader), [])
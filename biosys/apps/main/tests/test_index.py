@@ -0,0 +1,124 @@
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.utils.six import StringIO
+from rest_framework import status
+
+from main.models import DatasetIndex, Record
+from main.tests.api import helpers
+from main.utils_delete import delete_dataset
+from main.utils_index import sync_dataset_indexes, add_dataset_index, drop_orphan_indexes, build_pending_indexes, \
+    INDEX_NAME_REGEX
+
+
+class TestDatasetIndexes(helpers.BaseUserTestCase):
+
+    def _more_setup(self):
+        self.fields = [
+            {
+                'name': 'What',
+                'type': 'string',
+                'biosys': {'index': True}
+            },
+            {
+                'name': 'When',
+                'type': 'date',
+            },
+            {
+                'name': 'Count',
+                'type': 'integer',
+                'biosys': {'index': True}
+            }
+        ]
+        self.ds = self._create_dataset_with_schema(self.project_1, self.custodian_1_client, self.fields)
+
+    @staticmethod
+    def _get_db_indexes():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT indexname, indexdef FROM pg_indexes WHERE indexname ~ %s", [INDEX_NAME_REGEX])
+            return dict(cursor.fetchall())
+
+    def test_sync_from_schema(self):
+        indexes = sync_dataset_indexes(self.ds)
+        self.assertEqual([i.field for i in indexes], ['What', 'Count'])
+        db_indexes = self._get_db_indexes()
+        for dataset_index in indexes:
+            self.assertEqual(dataset_index.status, DatasetIndex.STATUS_READY)
+            self.assertEqual(dataset_index.source, DatasetIndex.SOURCE_SCHEMA)
+            self.assertIn(dataset_index.name, db_indexes)
+            self.assertIn('dataset_id = {}'.format(self.ds.pk), db_indexes[dataset_index.name])
+
+        # Count no longer indexed
+        self.fields[2].pop('biosys')
+        self.ds.data_package = helpers.create_data_package_from_fields(self.fields)
+        self.ds.save()
+        indexes = sync_dataset_indexes(self.ds)
+        self.assertEqual([i.field for i in indexes], ['What'])
+        self.assertEqual(list(self._get_db_indexes().keys()), [indexes[0].name])
+
+    def test_built_by_worker(self):
+        # the dataset created through the API: the indexes are only registered
+        self.assertEqual([(i.field, i.status) for i in DatasetIndex.objects.filter(dataset=self.ds)],
+                         [('What', DatasetIndex.STATUS_PENDING), ('Count', DatasetIndex.STATUS_PENDING)])
+        self.assertEqual(self._get_db_indexes(), {})
+        self.assertEqual(len(build_pending_indexes()), 2)
+        self.assertEqual(len(self._get_db_indexes()), 2)
+
+        # Count no longer indexed: orphan index dropped by the worker
+        self.fields[2].pop('biosys')
+        resp = self.data_engineer_1_client.patch(reverse('api:dataset-detail', kwargs={'pk': self.ds.pk}), data={
+            'type': self.ds.type,
+            'data_package': helpers.create_data_package_from_fields(self.fields)
+        }, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(self._get_db_indexes()), 2)
+        self.assertEqual(build_pending_indexes(), [])
+        self.assertEqual(list(self._get_db_indexes().keys()), [DatasetIndex.objects.get(dataset=self.ds).name])
+
+    def test_admin_index_kept(self):
+        sync_dataset_indexes(self.ds)
+        dataset_index = add_dataset_index(self.ds, 'When')
+        self.assertEqual(dataset_index.source, DatasetIndex.SOURCE_ADMIN)
+        self.assertEqual(dataset_index.status, DatasetIndex.STATUS_READY)
+        self.assertEqual(len(sync_dataset_indexes(self.ds)), 3)
+        self.assertIn(dataset_index.name, self._get_db_indexes())
+
+    def test_list_api(self):
+        sync_dataset_indexes(self.ds)
+        url = reverse('api:dataset-indexes', kwargs={'pk': self.ds.pk})
+        resp = self.readonly_client.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([(i['field'], i['status']) for i in resp.json()],
+                         [('What', DatasetIndex.STATUS_READY), ('Count', DatasetIndex.STATUS_READY)])
+
+    def test_dropped_with_dataset(self):
+        sync_dataset_indexes(self.ds)
+        self.assertEqual(len(self._get_db_indexes()), 2)
+        delete_dataset(self.ds)
+        self.assertEqual(self._get_db_indexes(), {})
+        self.assertEqual(DatasetIndex.objects.count(), 0)
+
+    def test_orphans_dropped(self):
+        indexes = sync_dataset_indexes(self.ds)
+        # delete without drop_dataset_indexes
+        self.ds.delete()
+        self.assertEqual(sorted(drop_orphan_indexes()), sorted(i.name for i in indexes))
+        self.assertEqual(self._get_db_indexes(), {})
+
+    def test_model_indexes_kept(self):
+        # the indexes of the Record model, created by the migrations, are not dataset indexes
+        model_indexes = [index.name for index in Record._meta.indexes]
+        self.assertIn('main_record_ds_species_idx', model_indexes)
+        sync_dataset_indexes(self.ds)
+        self.ds.delete()
+        self.assertEqual(len(drop_orphan_indexes()), 2)
+        self.assertEqual(build_pending_indexes(), [])
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT indexname FROM pg_indexes WHERE indexname = ANY(%s)", [model_indexes])
+            self.assertEqual(sorted(row[0] for row in cursor.fetchall()), sorted(model_indexes))
+
+    def test_command(self):
+        out = StringIO()
+        call_command('sync_dataset_indexes', '--dataset', str(self.ds.pk), stdout=out)
+        self.assertEqual(DatasetIndex.objects.filter(dataset=self.ds).count(), 2)
+        self.assertIn('What', out.getvalue())
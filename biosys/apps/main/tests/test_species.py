@@ -1,6 +1,7 @@
-from django.test import TestCase
+from django.core.cache import caches
+from django.test import TestCase, override_settings
 
-from main.utils_species import HerbieFacade
+from main.utils_species import HerbieFacade, SpeciesFacade, SpeciesIndex, CachedSpeciesFacade
 
 
 class TestHerbieFacade(TestCase):
@@ -37,3 +38,92 @@ class TestHerbieFacade(TestCase):
             self.assertTrue(self.facade.PROPERTY_NAME_ID.herbie_name in sp)
         except Exception as e:
             self.fail("Should not raise an exception!: {}: '{}'".format(e.__class__, e))
+
+
+class TestSpeciesIndex(TestCase):
+    mapping = {
+        'Canis lupus': 1,
+        'Chubby Bat': 2,
+        'Koala': 3
+    }
+
+    def test_mapping(self):
+        """
+        The index can be used like the species_name -> name_id dict
+        """
+        index = SpeciesIndex(self.mapping)
+        self.assertEqual(len(index), 3)
+        self.assertEqual(dict(index), self.mapping)
+        self.assertEqual(index['Koala'], 3)
+        self.assertEqual(index.get('Unknown', -1), -1)
+        self.assertIn('Chubby Bat', index)
+        self.assertFalse(SpeciesIndex())
+
+    def test_lookups(self):
+        index = SpeciesIndex(self.mapping)
+        self.assertEqual(index.get_name_id('Canis lupus'), 1)
+        self.assertIsNone(index.get_name_id('canis LUPUS'))
+        self.assertEqual(index.get_name_id('canis LUPUS', case_sensitive=False), 1)
+        self.assertEqual(index.get_name_id('Unknown', -1), -1)
+        self.assertEqual(index.get_species_name(2), 'Chubby Bat')
+        self.assertIsNone(index.get_species_name(4))
+        self.assertTrue(index.has_name_id(3))
+        self.assertFalse(index.has_name_id(4))
+
+    def test_facade(self):
+        class Facade(SpeciesFacade):
+            def name_id_by_species_name(self):
+                return TestSpeciesIndex.mapping
+
+        index = Facade().species_index()
+        self.assertIsInstance(index, SpeciesIndex)
+        self.assertEqual(dict(index), self.mapping)
+
+
+class UpstreamFacade(SpeciesFacade):
+    calls = 0
+    mapping = {'Canis lupus': 1}
+
+    def name_id_by_species_name(self):
+        UpstreamFacade.calls += 1
+        return dict(self.mapping)
+
+
+class CachedFacade(CachedSpeciesFacade):
+    upstream_facade_class = UpstreamFacade
+
+
+class FailingUpstreamFacade(SpeciesFacade):
+    def name_id_by_species_name(self):
+        raise Exception('Upstream is down')
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'species': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test-species'}
+})
+class TestCachedSpeciesFacade(TestCase):
+    def setUp(self):
+        caches['species'].clear()
+        UpstreamFacade.calls = 0
+        CachedFacade._local_index = None
+        CachedFacade._local_timestamp = None
+
+    def test_cached(self):
+        facade = CachedFacade()
+        self.assertEqual(facade.name_id_by_species_name(), UpstreamFacade.mapping)
+        self.assertEqual(UpstreamFacade.calls, 1)
+        # second call served from the cache
+        index = CachedFacade().species_index()
+        self.assertIsInstance(index, SpeciesIndex)
+        self.assertEqual(index.get_species_name(1), 'Canis lupus')
+        self.assertEqual(UpstreamFacade.calls, 1)
+
+    def test_stale_served_when_upstream_down(self):
+        CachedFacade().refresh()
+        with override_settings(SPECIES_CACHE_TTL=0):
+            facade = CachedFacade()
+            facade.upstream_facade_class = FailingUpstreamFacade
+            # refresh fails but the stale mapping is kept
+            facade._background_refresh()
+            self.assertEqual(facade.name_id_by_species_name(), UpstreamFacade.mapping)
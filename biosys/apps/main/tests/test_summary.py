@@ -0,0 +1,226 @@
+from django.contrib.gis.db.models import Extent
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db.models import Min, Max, Count
+from django.utils.six import StringIO
+from rest_framework import status
+
+from main.api.uploaders import RecordCreator
+from main.api.views import SpeciesMixin
+from main.models import Dataset, DatasetSpecies, DatasetSummary, Project, Record
+from main.tests.api import helpers
+from main.utils_delete import delete_records
+from main.utils_species import NoSpeciesFacade
+from main.utils_summary import get_dataset_summary, get_project_summary
+
+
+class TestDatasetSummary(helpers.BaseUserTestCase):
+
+    def _more_setup(self):
+        SpeciesMixin.species_facade_class = NoSpeciesFacade
+        fields = [
+            {
+                'name': 'Species Name',
+                'type': 'string',
+                'constraints': helpers.REQUIRED_CONSTRAINTS
+            },
+            {
+                'name': 'When',
+                'type': 'date',
+                'constraints': helpers.REQUIRED_CONSTRAINTS,
+                'format': 'any',
+                'biosys': {
+                    'type': 'observationDate'
+                }
+            },
+            {
+                'name': 'Latitude',
+                'type': 'number',
+                'constraints': helpers.REQUIRED_CONSTRAINTS
+            },
+            {
+                'name': 'Longitude',
+                'type': 'number',
+                'constraints': helpers.REQUIRED_CONSTRAINTS
+            },
+        ]
+        self.ds = self._create_dataset_with_schema(self.project_1, self.data_engineer_1_client, fields,
+                                                   dataset_type=Dataset.TYPE_SPECIES_OBSERVATION)
+        self.records = [
+            self._create_record(self.custodian_1_client, self.ds, {
+                'Species Name': species_name,
+                'When': when,
+                'Latitude': latitude,
+                'Longitude': 115.75
+            })
+            for species_name, when, latitude in [
+                ('Chubby Bat', '2018-01-31', -32.0),
+                ('Red Fox', '2018-02-01', -31.0),
+                ('Chubby Bat', '2018-02-02', -30.0),
+            ]
+        ]
+
+    def assert_summary_exact(self):
+        summary = get_dataset_summary(Dataset.objects.get(pk=self.ds.pk))
+        expected = self.ds.record_queryset.aggregate(
+            Count('id'), Extent('geometry'), Min('datetime'), Max('datetime'),
+            Count('species_name', distinct=True)
+        )
+        self.assertEqual(summary.record_count, expected['id__count'])
+        self.assertEqual(summary.extent, expected['geometry__extent'])
+        self.assertEqual(summary.start_datetime, expected['datetime__min'])
+        self.assertEqual(summary.end_datetime, expected['datetime__max'])
+        self.assertEqual(summary.species_count, expected['species_name__count'])
+        return summary
+
+    def test_maintained_on_create(self):
+        summary = DatasetSummary.objects.get(dataset=self.ds)
+        self.assertFalse(summary.is_stale)
+        self.assertEqual(summary.record_count, 3)
+        self.assertEqual(summary.species_count, 2)
+        self.assertEqual(summary.extent, (115.75, -32.0, 115.75, -30.0))
+        self.assert_summary_exact()
+
+        resp = self._upload_records_from_rows([
+            ['Species Name', 'When', 'Latitude', 'Longitude'],
+            ['Red Fox', '2018-01-01', -29.0, 116.0],
+            ['Canis Lupus', '2018-03-01', -33.0, 115.0],
+        ], self.ds.pk)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        summary = DatasetSummary.objects.get(dataset=self.ds)
+        self.assertFalse(summary.is_stale)
+        self.assertEqual(summary.record_count, 5)
+        self.assertEqual(summary.species_count, 3)
+        self.assert_summary_exact()
+
+    def test_update_and_delete(self):
+        record = self.records[2]
+        url = reverse('api:record-detail', kwargs={'pk': record.pk})
+        data = dict(record.data, Latitude=-20.0)
+        resp = self.custodian_1_client.patch(url, data={'data': data}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(DatasetSummary.objects.get(dataset=self.ds).is_stale)
+        summary = self.assert_summary_exact()
+        self.assertEqual(summary.extent[3], -20.0)
+        self.assertFalse(summary.is_stale)
+
+        resp = self.custodian_1_client.delete(reverse('api:record-detail', kwargs={'pk': self.records[1].pk}))
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        summary = DatasetSummary.objects.get(dataset=self.ds)
+        # the count is exact, the rest is recomputed on read
+        self.assertEqual(summary.record_count, 2)
+        self.assertTrue(summary.is_stale)
+        self.assertEqual(self.assert_summary_exact().species_count, 1)
+
+        delete_records(self.ds.record_queryset)
+        self.assertEqual(DatasetSummary.objects.get(dataset=self.ds).record_count, 0)
+        summary = self.assert_summary_exact()
+        self.assertIsNone(summary.extent)
+
+    def test_upload_stopped(self):
+        # the records committed before the upload stops (e.g. client disconnected) are in the summary
+        rows = [
+            {'Species Name': 'Dingo', 'When': '2018-03-0{}'.format(day), 'Latitude': '-25.0', 'Longitude': '115.75'}
+            for day in range(1, 6)
+        ]
+        for batch_size in [2, None]:
+            creator = RecordCreator(self.ds, iter(rows), species_facade_class=NoSpeciesFacade, batch_size=batch_size)
+            results = iter(creator)
+            for _ in range(2):
+                record, validator_result = next(results)
+                self.assertIsNotNone(record.pk)
+            results.close()
+        self.assertEqual(self.ds.record_queryset.count(), 7)
+        summary = DatasetSummary.objects.get(dataset=self.ds)
+        self.assertFalse(summary.is_stale)
+        self.assertEqual(summary.record_count, 7)
+        self.assertEqual(summary.species_count, 3)
+        self.assertEqual(summary.extent[1], -32.0)
+        self.assertIn('Dingo', DatasetSpecies.objects.filter(dataset=self.ds).values_list('species_name', flat=True))
+
+    def test_serializers(self):
+        resp = self.readonly_client.get(reverse('api:dataset-detail', kwargs={'pk': self.ds.pk}))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.json()['record_count'], self.ds.record_count)
+        self.assertEqual(resp.json()['extent'], list(self.ds.extent))
+
+        resp = self.readonly_client.get(reverse('api:project-detail', kwargs={'pk': self.project_1.pk}))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.json()['record_count'], self.project_1.record_count)
+        self.assertEqual(get_project_summary(self.project_1)['extent'], self.ds.extent)
+
+        resp = self.readonly_client.get(reverse('api:project-list'))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(dict((project['id'], project['record_count']) for project in resp.json()),
+                         dict((project.pk, project.record_count) for project in Project.objects.all()))
+
+    def test_created_with_dataset(self):
+        ds = self._create_dataset_with_schema(self.project_2, self.data_engineer_2_client,
+                                              helpers.create_schema_from_fields([{'name': 'What', 'type': 'string'}]))
+        summary = DatasetSummary.objects.get(dataset=ds)
+        self.assertEqual((summary.record_count, summary.extent), (0, None))
+
+    def test_missing_summary_computed(self):
+        # records written without maintaining the summary
+        DatasetSummary.objects.all().delete()
+        Record.objects.create(dataset=self.ds, data={})
+        self.assertEqual(self.assert_summary_exact().record_count, 4)
+
+    def assert_species_exact(self):
+        expected = {
+            row['species_name']: (row['id__count'], row['datetime__min'], row['datetime__max'])
+            for row in self.ds.record_queryset.exclude(species_name__isnull=True).order_by().values(
+                'species_name').annotate(Count('id'), Min('datetime'), Max('datetime'))
+        }
+        self.assertEqual({
+            species.species_name: (species.record_count, species.first_observation, species.last_observation)
+            for species in DatasetSpecies.objects.filter(dataset=self.ds)
+        }, expected)
+
+    def get_species_counts(self):
+        return list(DatasetSpecies.objects.filter(dataset=self.ds).values_list('species_name', 'record_count'))
+
+    def test_species_maintained(self):
+        self.assertEqual(self.get_species_counts(), [('Chubby Bat', 2), ('Red Fox', 1)])
+        self.assert_species_exact()
+
+        # renamed: removed from its species
+        record = self.records[2]
+        url = reverse('api:record-detail', kwargs={'pk': record.pk})
+        data = dict(record.data, **{'Species Name': 'Red Fox'})
+        resp = self.custodian_1_client.patch(url, data={'data': data}, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_species_counts(), [('Chubby Bat', 1), ('Red Fox', 2)])
+        self.assert_species_exact()
+
+        delete_records(Record.objects.filter(pk=self.records[0].pk))
+        self.assertEqual(self.get_species_counts(), [('Red Fox', 2)])
+        self.assert_species_exact()
+        self.assertEqual(get_project_summary(self.project_1)['species_count'], 1)
+
+    def test_species_view(self):
+        other_ds = Dataset.objects.create(project=self.project_2, name='Other', type=self.ds.type,
+                                          data_package=self.ds.data_package)
+        Record.objects.create(dataset=other_ds, data={}, species_name='Red Fox')
+        call_command('rebuild_dataset_summaries', stdout=StringIO())
+        url = reverse('api:species')
+        resp = self.readonly_client.get(url, {'search': 'fox'})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.json(), ['Red Fox'])
+
+        resp = self.readonly_client.get(url, {'counts': True})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([(s['species_name'], s['record_count'], s['dataset_count']) for s in resp.json()],
+                         [('Chubby Bat', 2, 1), ('Red Fox', 2, 2)])
+
+        resp = self.readonly_client.get(url, {'counts': True, 'project': self.project_2.pk})
+        self.assertEqual([(s['species_name'], s['record_count']) for s in resp.json()], [('Red Fox', 1)])
+        resp = self.readonly_client.get(url, {'dataset': 'bats'})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_command(self):
+        DatasetSummary.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_dataset_summaries', '--dataset', str(self.ds.pk), stdout=out)
+        self.assertEqual(DatasetSummary.objects.get(dataset=self.ds).record_count, 3)
+        self.assertIn('3 records', out.getvalue())
@@ -1,20 +1,26 @@
 from __future__ import absolute_import, unicode_literals, print_function, division
 
+import copy
 import datetime
 import decimal
+import functools
+import hashlib
 import json
 import logging
 import re
+import threading
+from collections import OrderedDict
 
 from dateutil.parser import parse as date_parse
-from django.contrib.gis.geos import Point
+from django.contrib.gis.gdal import CoordTransform, SpatialReference
+from django.contrib.gis.geos import MultiPoint, Point
 from django.utils import six
 from django.utils.encoding import python_2_unicode_compatible
 from future.utils import raise_with_traceback
 from tableschema import Field as TableField
 from tableschema import Schema as TableSchema
 
-from main.constants import MODEL_SRID, SUPPORTED_DATUMS, get_datum_srid, is_supported_datum, get_australian_zone_srid, \
+from main.constants import MODEL_SRID, DATUM_DICT, SUPPORTED_DATUMS, get_datum_srid, is_supported_datum, get_australian_zone_srid, \
     is_projected_srid, get_datum_and_zone
 
 YYYY_MM_DD_REGEX = re.compile(r'^\d{4}-\d{2}-\d{2}')
@@ -55,6 +61,27 @@ class FieldSchemaError(Exception):
     pass
 
 
+# The python value of a value that couldn't be casted. See SchemaField.processor
+NOT_CASTED = object()
+
+
+def to_json_number(python_value, value):
+    """
+    The frictionless cast will cast a number to a python Decimal(), which is not json serializable
+    by default. Cast it to a float or int. We want to keep it as entered as possible. E.g if entered
+    0 we don't want 0.0 or vice versa
+    :param python_value: the casted value
+    :param value: the value as entered
+    :return:
+    """
+    if isinstance(python_value, decimal.Decimal):
+        if str(value).find('.') > 0:
+            python_value = float(python_value)
+        else:
+            python_value = int(python_value)
+    return python_value
+
+
 def parse_datetime_day_first(value):
     """
     use the dateutil.parse() to parse a date/datetime with the date first (dd/mm/yyyy) (not month first mm/dd/yyyy)
@@ -69,24 +96,91 @@ def parse_datetime_day_first(value):
     return date_parse(value, dayfirst=dayfirst)
 
 
-def cast_date_any_format(value):
+def cast_date_any_format(value, parse=parse_datetime_day_first):
     if isinstance(value, datetime.date):
         return value
     try:
-        return parse_datetime_day_first(value).date()
+        return parse(value).date()
     except (TypeError, ValueError) as e:
         raise_with_traceback(InvalidDateType(e))
 
 
-def cast_datetime_any_format(value):
+def cast_datetime_any_format(value, parse=parse_datetime_day_first):
     if isinstance(value, datetime.datetime):
         return value
     try:
-        return parse_datetime_day_first(value)
+        return parse(value)
     except (TypeError, ValueError) as e:
         raise_with_traceback(InvalidDateType(e))
 
 
+class DateFormatDetector(object):
+    """
+    A faster parse_datetime_day_first for the values of a single column.
+    The first values are parsed with dateutil and compared with a set of strptime formats. Once sample_size values
+    have been parsed, the first format that gave the same result as dateutil for every sampled value is used for the
+    next values. The values that don't match the format are still parsed with dateutil.
+    The formats are guarded by a regex so a value parsed with strptime gives the same result as dateutil (the day first
+    rule and the yyyy-mm-dd exception included). Two digits years are not supported, dateutil doesn't map them to a
+    century like strptime does.
+    """
+    SAMPLE_SIZE = 20
+    FORMATS = [
+        (r'^\d{4}-\d{2}-\d{2}$', '%Y-%m-%d'),
+        (r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}$', '%Y-%m-%d %H:%M'),
+        (r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$', '%Y-%m-%d %H:%M:%S'),
+        (r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}$', '%Y-%m-%dT%H:%M:%S'),
+        (r'^\d{1,2}/\d{1,2}/\d{4}$', '%d/%m/%Y'),
+        (r'^\d{1,2}/\d{1,2}/\d{4} \d{1,2}:\d{2}$', '%d/%m/%Y %H:%M'),
+        (r'^\d{1,2}/\d{1,2}/\d{4} \d{1,2}:\d{2}:\d{2}$', '%d/%m/%Y %H:%M:%S'),
+        (r'^\d{1,2}-\d{1,2}-\d{4}$', '%d-%m-%Y'),
+        (r'^\d{1,2}\.\d{1,2}\.\d{4}$', '%d.%m.%Y'),
+    ]
+
+    def __init__(self, sample_size=None):
+        self.sample_size = sample_size or self.SAMPLE_SIZE
+        self.candidates = [(re.compile(regex), format_) for regex, format_ in self.FORMATS]
+        self.sampled = 0
+        self.is_detection_done = False
+        # the detected strptime format or None
+        self.format = None
+        self._regex = None
+
+    def parse(self, value):
+        """
+        Same as parse_datetime_day_first(value)
+        """
+        if self._regex is not None:
+            if isinstance(value, six.string_types) and self._regex.match(value):
+                try:
+                    return datetime.datetime.strptime(value, self.format)
+                except ValueError:
+                    pass
+            return parse_datetime_day_first(value)
+        result = parse_datetime_day_first(value)
+        if not self.is_detection_done:
+            self._sample(value, result)
+        return result
+
+    def _sample(self, value, result):
+        self.candidates = [
+            (regex, format_) for regex, format_ in self.candidates
+            if regex.match(value) and self._strptime(value, format_) == result
+        ]
+        self.sampled += 1
+        if not self.candidates or self.sampled >= self.sample_size:
+            self.is_detection_done = True
+            if self.candidates:
+                self._regex, self.format = self.candidates[0]
+
+    @staticmethod
+    def _strptime(value, format_):
+        try:
+            return datetime.datetime.strptime(value, format_)
+        except ValueError:
+            return None
+
+
 def find_unique_field(schema, biosys_type, column_name):
     """
     Precedence Rules:
@@ -122,10 +216,13 @@ class BiosysSchema:
       constraints: ....
       biosys: {
                 type: observationDate|latitude|longitude|...
+                index: true|false
               }
     }
+    index: if true the records data of this field are indexed in the database (see main.utils_index)
     """
     BIOSYS_KEY_NAME = 'biosys'
+    INDEX_KEY_NAME = 'index'
     OBSERVATION_DATE_TYPE_NAME = 'observationDate'
     LATITUDE_TYPE_NAME = 'latitude'
     LONGITUDE_TYPE_NAME = 'longitude'
@@ -158,6 +255,10 @@ class BiosysSchema:
     def get(self, k, d=None):
         return self.descriptor.get(k, d)
 
+    @property
+    def index(self):
+        return bool(self.get(self.INDEX_KEY_NAME, False))
+
     def is_observation_date(self):
         return self.type == self.OBSERVATION_DATE_TYPE_NAME
 
@@ -214,6 +315,9 @@ class SchemaField:
         # biosys specific
         self.biosys = BiosysSchema(self.descriptor.get(BiosysSchema.BIOSYS_KEY_NAME))
         self.constraints = SchemaConstraints(self.descriptor.get('constraints', {}))
+        # the compiled cast and validation functions. See the caster and processor properties.
+        self._caster = None
+        self._processor = None
 
     # implement some dict like methods
     def __getitem__(self, item):
@@ -285,18 +389,7 @@ class SchemaField:
         :param value:
         :return:
         """
-        # we want to strip strings
-        if isinstance(value, six.string_types):
-            value = value.strip()
-            # TODO: remove that when running in Python3
-            if not isinstance(value, six.text_type):
-                # the ensure only unicode
-                value = six.u(value).strip()
-        # date or datetime with format='any
-        if self.is_datetime_types and self.format == 'any' and value:
-            return cast_date_any_format(value) if self.is_date_type else cast_datetime_any_format(value)
-        # delegates to tableschema.Field.cast_value
-        return self.tableschema_field.cast_value(value, constraints=True)
+        return self.caster(value)
 
     def validation_error(self, value):
         """
@@ -305,31 +398,89 @@ class SchemaField:
         :param value:
         :return: None if value is valid or an error message string
         """
-        error = None
-        # override the integer validation. The default message is a bit cryptic if there's an error casting a string
-        # like '1.2' into an int.
-        if self.type == 'integer':
-            if not is_blank_value(value):
-                not_integer = False
-                try:
-                    casted = self.cast(value)
-                    # there's also the case where the case where a float 1.2 is successfully casted in 1
-                    # (ex: int(1.2) = 1)
-                    if str(casted) != str(value):
-                        not_integer = True
-                except Exception:
-                    not_integer = True
-                if not_integer:
-                    return 'The field "{}" must be a whole number.'.format(self.name)
-        try:
-            self.cast(value)
-        except Exception as e:
-            error = "{}".format(e)
-            # Override the default enum exception message to include all possible values
-            if error.find('enum array') and self.constraints.enum:
-                values = [str(v) for v in self.constraints.enum]
-                error = "The value must be one the following: {}".format(values)
-        return error
+        return self.processor(value)[1]
+
+    @property
+    def is_any_format_datetime(self):
+        return self.is_datetime_types and self.descriptor.get('format') == 'any'
+
+    @property
+    def caster(self):
+        """
+        The cast method compiled once into a function value -> python value.
+        """
+        if self._caster is None:
+            self._caster = self.compile_caster()
+        return self._caster
+
+    @property
+    def processor(self):
+        """
+        The cast and the validation compiled once into a single function value -> (python value, error) where
+        python value is NOT_CASTED if the value couldn't be casted and error is None if the value is valid.
+        """
+        if self._processor is None:
+            self._processor = self.compile_processor()
+        return self._processor
+
+    def compile_caster(self, date_format_detector=None):
+        """
+        :param date_format_detector: a DateFormatDetector to parse the date/datetime values with format 'any'.
+        :return: a function value -> python value
+        """
+        cast_value = self.tableschema_field.cast_value
+        any_format_cast = None
+        if self.is_any_format_datetime:
+            any_format_cast = cast_date_any_format if self.is_date_type else cast_datetime_any_format
+            if date_format_detector is not None:
+                any_format_cast = functools.partial(any_format_cast, parse=date_format_detector.parse)
+
+        def cast(value):
+            # we want to strip strings
+            if isinstance(value, six.string_types):
+                value = value.strip()
+                # TODO: remove that when running in Python3
+                if not isinstance(value, six.text_type):
+                    # the ensure only unicode
+                    value = six.u(value).strip()
+            # date or datetime with format='any
+            if any_format_cast is not None and value:
+                return any_format_cast(value)
+            # delegates to tableschema.Field.cast_value
+            return cast_value(value, constraints=True)
+
+        return cast
+
+    def compile_processor(self, caster=None):
+        """
+        :param caster: the cast function. Default to the field caster.
+        :return: a function value -> (python value, error)
+        """
+        cast = caster or self.caster
+        is_integer = self.type == 'integer'
+        integer_message = 'The field "{}" must be a whole number.'.format(self.name)
+        enum = self.constraints.enum
+        enum_message = "The value must be one the following: {}".format([str(v) for v in enum]) if enum else None
+
+        def process(value):
+            python_value = NOT_CASTED
+            error = None
+            try:
+                python_value = cast(value)
+            except Exception as e:
+                error = "{}".format(e)
+                # Override the default enum exception message to include all possible values
+                if error.find('enum array') and enum:
+                    error = enum_message
+            # override the integer validation. The default message is a bit cryptic if there's an error casting a
+            # string like '1.2' into an int.
+            # there's also the case where the case where a float 1.2 is successfully casted in 1 (ex: int(1.2) = 1)
+            if is_integer and not is_blank_value(value) and \
+                    (python_value is NOT_CASTED or str(python_value) != str(value)):
+                error = integer_message
+            return python_value, error
+
+        return process
 
     def __curate_descriptor(self, descriptor):
         """
@@ -436,6 +587,109 @@ class SchemaForeignKey:
         return self.reference_fields[0] if self.reference_fields else None
 
 
+class ProcessedRow(object):
+    """
+    The result of RowProcessor.process: the schema errors and the python values of a row.
+    """
+
+    def __init__(self, processor, row, values, errors, missing_fields):
+        self.processor = processor
+        self.row = row
+        # field name -> python value of the values that could be casted
+        self.values = values
+        # a list of (field name, error message) in the row order
+        self.errors = errors
+        # the required fields missing from the row
+        self.missing_fields = missing_fields
+
+    def cast(self, field):
+        """
+        Same as field.cast(row[field.name]) but without casting the value again.
+        """
+        if field.name in self.values:
+            return self.values[field.name]
+        return field.cast(self.row.get(field.name))
+
+    def cast_numbers(self):
+        """
+        Same as GenericSchema.cast_numbers(row) but without casting the values again.
+        :return: the row with the numeric field values replaced in place by python numbers
+        """
+        row = self.row
+        for name in self.processor.numeric_field_names:
+            if name in row and name in self.values:
+                row[name] = to_json_number(self.values[name], row[name])
+        return row
+
+
+class RowProcessor(object):
+    """
+    A schema compiled for row processing: a name -> field dict and the compiled cast and validation functions of the
+    fields. One call to process validates and casts every value of a row at once.
+    Get it from GenericSchema.row_processor, or create one with detect_date_formats to process the rows of a file: the
+    date format of every date field with format 'any' is then detected from the first values (see DateFormatDetector).
+    """
+
+    def __init__(self, schema, detect_date_formats=False):
+        self.schema = schema
+        self.fields_by_name = {}
+        for field in schema.fields:
+            # first field wins (same as a scan of the fields)
+            self.fields_by_name.setdefault(field.name, field)
+        self.field_names = schema.field_names
+        self.required_fields = schema.required_fields
+        self.numeric_field_names = [f.name for f in schema.numeric_fields]
+        self.date_format_detectors = {}
+        casters = {}
+        for name, field in self.fields_by_name.items():
+            if detect_date_formats and field.is_any_format_datetime:
+                self.date_format_detectors[name] = DateFormatDetector()
+                casters[name] = field.compile_caster(date_format_detector=self.date_format_detectors[name])
+            else:
+                casters[name] = field.caster
+        # (field name, compiled cast) in the schema order
+        self.casters = [(field.name, casters[field.name]) for field in schema.fields]
+        self._processors = dict(
+            (name, field.compile_processor(casters[name]) if name in self.date_format_detectors else field.processor)
+            for name, field in self.fields_by_name.items()
+        )
+
+    @property
+    def date_formats(self):
+        """
+        :return: a field name -> strptime format dict of the detected date formats
+        """
+        return dict(
+            (name, detector.format) for name, detector in self.date_format_detectors.items()
+            if detector.format is not None
+        )
+
+    def process(self, row):
+        """
+        Validate and cast the values of the row in one pass.
+        :param row: a dictionary or a list of key => value
+        :return: a ProcessedRow
+        """
+        if not isinstance(row, dict):
+            row = dict(row)
+        values = {}
+        errors = []
+        processors = self._processors
+        for field_name, value in row.items():
+            processor = processors.get(field_name)
+            if processor is None:
+                errors.append((field_name, "The field '{}' doesn't exists in the schema. Should be one of {}"
+                               .format(field_name, self.field_names)))
+                continue
+            python_value, error = processor(value)
+            if python_value is not NOT_CASTED:
+                values[field_name] = python_value
+            if error:
+                errors.append((field_name, error))
+        missing_fields = [field for field in self.required_fields if field.name not in row]
+        return ProcessedRow(self, row, values, errors, missing_fields)
+
+
 @python_2_unicode_compatible
 class GenericSchema(object):
     """
@@ -452,6 +706,7 @@ class GenericSchema(object):
         self.foreign_keys = [SchemaForeignKey(fk) for fk in
                              self.schema_model.foreign_keys] if self.schema_model.foreign_keys else []
         self.project = project
+        self._row_processor = None
 
     # implement some dict like methods
     def __getitem__(self, item):
@@ -476,11 +731,31 @@ class GenericSchema(object):
     def numeric_fields(self):
         return [f for f in self.fields if f.is_numeric]
 
+    @property
+    def indexed_field_names(self):
+        """
+        :return: the names of the fields declared with biosys.index = true
+        """
+        return [f.name for f in self.fields if f.biosys.index]
+
+    @property
+    def primary_key(self):
+        """
+        :return: the list of the field names of the declared primaryKey (empty if none)
+        """
+        return self.schema_model.primary_key or []
+
+    @property
+    def row_processor(self):
+        """
+        The RowProcessor of the schema, compiled on first use.
+        """
+        if self._row_processor is None:
+            self._row_processor = RowProcessor(self)
+        return self._row_processor
+
     def get_field_by_name(self, name):
-        for f in self.fields:
-            if f.name == name:
-                return f
-        return None
+        return self.row_processor.fields_by_name.get(name)
 
     def field_validation_error(self, field_name, value):
         field = self.get_field_by_name(field_name)
@@ -525,16 +800,7 @@ class GenericSchema(object):
             if field.name in row:
                 value = row[field.name]
                 try:
-                    python_value = field.cast(value)
-                    # The frictionless cast will cast a number to a python Decimal(), which is not json serializable
-                    # by default. Cast it to a float or int. We want to keep it as entered as possible. E.g if entered
-                    # 0 we don't want 0.0 or vice versa
-                    if isinstance(python_value, decimal.Decimal):
-                        if str(value).find('.') > 0:
-                            python_value = float(python_value)
-                        else:
-                            python_value = int(python_value)
-                    row[field.name] = python_value
+                    row[field.name] = to_json_number(field.cast(value), value)
                 except Exception as e:
                     if raise_error:
                         raise e
@@ -668,14 +934,14 @@ class ObservationSchema(GenericSchema):
     def find_site_code_foreign(self):
         return self.get_fk_for_model_field('Site', 'code')
 
-    def cast_record_observation_date(self, record):
-        return self.date_parser.cast_date(record)
+    def cast_record_observation_date(self, record, processed_row=None):
+        return self.date_parser.cast_date(record, processed_row=processed_row)
 
     def cast_srid(self, record, default_srid=MODEL_SRID):
         return self.geometry_parser.cast_srid(record, default_srid=default_srid)
 
-    def cast_geometry(self, record, default_srid=MODEL_SRID):
-        return self.geometry_parser.cast_geometry(record, default_srid=default_srid)
+    def cast_geometry(self, record, default_srid=MODEL_SRID, site_lookup=None):
+        return self.geometry_parser.cast_geometry(record, default_srid=default_srid, site_lookup=site_lookup)
 
 
 class SpeciesObservationSchema(ObservationSchema):
@@ -708,6 +974,52 @@ class SpeciesObservationSchema(ObservationSchema):
         return self.species_name_parser.cast_species_name_id(record)
 
 
+class SchemaCache(object):
+    """
+    A bounded LRU cache of the schema objects (GenericSchema, ObservationSchema, ...), shared by all the threads of a
+    process. Building a schema is slow (tableschema validation, fields and parsers lookup).
+    The schemas are keyed on their class and a hash of their descriptor, a change of the descriptor is a cache miss
+    so there is nothing to invalidate, the outdated schemas are evicted when the cache is full.
+    The cached schemas are shared: they must not be modified.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._schemas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._schemas)
+
+    @staticmethod
+    def get_key(schema_class, descriptor):
+        descriptor_hash = hashlib.md5(json.dumps(descriptor, sort_keys=True).encode('utf-8')).hexdigest()
+        return schema_class, descriptor_hash
+
+    def get(self, schema_class, descriptor):
+        """
+        :return: the cached schema_class(descriptor) or a new one
+        """
+        key = self.get_key(schema_class, descriptor)
+        with self._lock:
+            schema = self._schemas.pop(key, None)
+            if schema is not None:
+                # most recently used last
+                self._schemas[key] = schema
+                return schema
+        # built from a copy: the cached schema must not change with the dataset descriptor.
+        schema = schema_class(copy.deepcopy(descriptor))
+        with self._lock:
+            self._schemas[key] = schema
+            while len(self._schemas) > self.maxsize:
+                self._schemas.popitem(last=False)
+        return schema
+
+    def clear(self):
+        with self._lock:
+            self._schemas.clear()
+
+
 def format_required_message(field):
     return "The field named '{field_name}' must have the 'required' constraint set to true.".format(
         field_name=field.name
@@ -755,15 +1067,18 @@ class ObservationDateParser(object):
     def is_valid(self):
         return not self.errors
 
-    def cast_date(self, record):
+    def cast_date(self, record, processed_row=None):
         """
         Extract geometry from a record data
         :param record: a column -> value dictionary
+        :param processed_row: the ProcessedRow of the record if already processed. Avoid casting the date again.
         :return: a date or datetime or None
         """
         if self.observation_date_field:
             value = record.get(self.observation_date_field.name)
             if value:
+                if processed_row is not None:
+                    return processed_row.cast(self.observation_date_field)
                 return self.observation_date_field.cast(value)
         return None
 
@@ -772,6 +1087,102 @@ class ObservationDateParser(object):
         return [f for f in all_possibles_fields if f is not None]
 
 
+# The coordinate transformations are expensive to set up. They are cached per thread (a GDAL transformation can't be
+# used by several threads at the same time) for every (source srid, target srid) pair of the supported datums.
+_coord_transforms = threading.local()
+
+
+def get_coord_transform(src_srid, dst_srid):
+    """
+    :return: a CoordTransform from src_srid to dst_srid. Cached if both srids are supported datums.
+    """
+    key = (src_srid, dst_srid)
+    cache = getattr(_coord_transforms, 'cache', None)
+    if cache is None:
+        cache = _coord_transforms.cache = {}
+    coord_transform = cache.get(key)
+    if coord_transform is None:
+        coord_transform = CoordTransform(SpatialReference(src_srid), SpatialReference(dst_srid))
+        if src_srid in DATUM_DICT and dst_srid in DATUM_DICT:
+            cache[key] = coord_transform
+    return coord_transform
+
+
+def transform_geometry(geometry, srid, clone=False):
+    """
+    Same as geometry.transform(srid, clone) but with a cached coordinate transformation.
+    :return: the transformed geometry if clone is True, else None (the geometry is transformed in place).
+    """
+    if geometry.srid == srid:
+        return geometry.clone() if clone else None
+    coord_transform = get_coord_transform(geometry.srid, srid)
+    if clone:
+        geometry = geometry.clone()
+    geometry.transform(coord_transform)
+    geometry.srid = srid
+    return geometry if clone else None
+
+
+def transform_coordinates(coordinates, src_srid, dst_srid):
+    """
+    Transform many points at once.
+    :param coordinates: a list of (x, y)
+    :return: the list of transformed (x, y)
+    """
+    if not coordinates or src_srid == dst_srid:
+        return list(coordinates)
+    points = MultiPoint([Point(x, y) for x, y in coordinates], srid=src_srid)
+    points.transform(get_coord_transform(src_srid, dst_srid))
+    return [point.coords for point in points]
+
+
+class SiteLookup(object):
+    """
+    A site code => (site id, geometry) lookup of the sites of a project.
+    With prefetch the sites of the project are fetched in one query at creation, which is what we want for the duration
+    of an upload. Without prefetch the sites are fetched one by one when first requested.
+    If no project is given the sites are looked up in every project (legacy behaviour).
+    """
+
+    def __init__(self, project, prefetch=True):
+        self.project = project
+        self.prefetch = prefetch
+        self._sites = {}
+        if prefetch:
+            for pk, code, geometry in self._get_queryset().values_list('pk', 'code', 'geometry'):
+                self._sites[code] = (pk, geometry)
+
+    def _get_queryset(self):
+        from main.models import Site  # import here to avoid cyclic import problem
+        queryset = Site.objects.all()
+        if self.project is not None:
+            queryset = queryset.filter(project=self.project)
+        return queryset
+
+    def _get(self, code):
+        if code is None:
+            return None
+        code = six.text_type(code)
+        if code not in self._sites and not self.prefetch:
+            site = self._get_queryset().filter(code=code).first()
+            self._sites[code] = (site.pk, site.geometry) if site is not None else None
+        return self._sites.get(code)
+
+    def __contains__(self, code):
+        return self._get(code) is not None
+
+    def get_site_id(self, code):
+        site = self._get(code)
+        return site[0] if site is not None else None
+
+    def get_geometry(self, code):
+        site = self._get(code)
+        return site[1] if site is not None else None
+
+    def add(self, site):
+        self._sites[six.text_type(site.code)] = (site.pk, site.geometry)
+
+
 class GeometryParser(object):
     """
     A utility class to extract the geometry from data given a schema.
@@ -1003,34 +1414,24 @@ class GeometryParser(object):
             result = default_srid
         return result
 
-    def cast_geometry(self, record, default_srid=MODEL_SRID):
+    def cast_geometry(self, record, default_srid=MODEL_SRID, site_lookup=None):
         """
         Precedences rules:
         easting/northing > lat/long > site geometry
         :param record: a column -> value dictionary
         :param default_srid:
+        :param site_lookup: a SiteLookup of the project sites. If None the site is looked up in the parser project.
         :return: Will throw an exception if anything went wrong
         """
-        x, y = (None, None)  # x = longitude or easting, y = latitude or northing.
-        geometry = None
-
-        if self.is_easting_northing:
-            x = record.get(self.easting_field.name)
-            y = record.get(self.northing_field.name)
-        if (is_blank_value(x) or is_blank_value(y)) and self.is_lat_long:
-            x = record.get(self.longitude_field.name)
-            y = record.get(self.latitude_field.name)
-        if not is_blank_value(x) and not is_blank_value(y):
-            srid = self.cast_srid(record, default_srid=default_srid)
-            geometry = Point(x=float(x), y=float(y), srid=srid)
+        geometry = self.cast_point(record, default_srid=default_srid)
         if geometry is None and self.site_code_field is not None:
             # extract geometry from site
-            from main.models import Site  # import here to avoid cyclic import problem
             site_code = self.get_site_code(record)
-            site = Site.objects.filter(code=site_code).first()
-            if site_code and site is None:
+            if site_lookup is None:
+                site_lookup = SiteLookup(self.project, prefetch=False)
+            if site_code and site_code not in site_lookup:
                 raise Exception('The site {} does not exist'.format(site_code))
-            geometry = site.geometry if site is not None else None
+            geometry = site_lookup.get_geometry(site_code)
             if geometry is None and self.is_site_code_only:
                 raise Exception('The site {} has no geometry'.format(site_code))
         if geometry is not None:
@@ -1039,8 +1440,29 @@ class GeometryParser(object):
             # problem
             raise Exception('No Latitude/Longitude Easting/Northing or Site Code found!')
 
-    def from_record_to_geometry(self, record, default_srid=MODEL_SRID):
-        return self.cast_geometry(record, default_srid=default_srid)
+    def cast_point(self, record, default_srid=MODEL_SRID):
+        """
+        Build the point from the coordinates of the record only (the site is not considered).
+        Precedences rules:
+        easting/northing > lat/long
+        :param record: a column -> value dictionary
+        :param default_srid:
+        :return: a Point or None if the record has no coordinates. Will throw an exception if the datum is invalid.
+        """
+        x, y = (None, None)  # x = longitude or easting, y = latitude or northing.
+        if self.is_easting_northing:
+            x = record.get(self.easting_field.name)
+            y = record.get(self.northing_field.name)
+        if (is_blank_value(x) or is_blank_value(y)) and self.is_lat_long:
+            x = record.get(self.longitude_field.name)
+            y = record.get(self.latitude_field.name)
+        if not is_blank_value(x) and not is_blank_value(y):
+            srid = self.cast_srid(record, default_srid=default_srid)
+            return Point(x=float(x), y=float(y), srid=srid)
+        return None
+
+    def from_record_to_geometry(self, record, default_srid=MODEL_SRID, site_lookup=None):
+        return self.cast_geometry(record, default_srid=default_srid, site_lookup=site_lookup)
 
     def from_geometry_to_record(self, geometry, record, default_srid=MODEL_SRID):
         if not geometry:
@@ -1051,7 +1473,7 @@ class GeometryParser(object):
         srid = self.cast_srid(record, default_srid=default_srid)
         datum, zone = (None, None)
         if srid:
-            point.transform(srid)
+            transform_geometry(point, srid)
             datum, zone = get_datum_and_zone(srid)
         # update record field
         record = record or {}
@@ -0,0 +1,119 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import logging
+
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+
+from main.models import Dataset, Record, Media, DatasetMedia, ProjectMedia, PendingFileDeletion
+from main.utils_index import drop_dataset_indexes
+from main.utils_links import delete_record_links
+from main.utils_summary import remove_records_from_summary
+
+logger = logging.getLogger(__name__)
+
+DELETE_BATCH_SIZE = 5000
+
+
+def delete_records(queryset, batch_size=None):
+    """
+    Set based delete of records.
+    Unlike queryset.delete() the records and their media are not loaded: they are deleted in SQL by batch of batch_size
+    records, each batch in its own transaction. The files of the deleted media are queued in PendingFileDeletion within
+    the same transaction and removed from the storage later (see clean_deleted_files).
+    If the delete is interrupted the deleted batches stay deleted, run it again to delete the remaining records.
+    :param queryset: a Record queryset
+    :param batch_size:
+    :return: the number of deleted records
+    """
+    batch_size = batch_size or DELETE_BATCH_SIZE
+    ids_queryset = queryset.order_by('pk').values_list('pk', flat=True)
+    sql_params = {
+        'record': Record._meta.db_table,
+        'media': Media._meta.db_table,
+        'pending': PendingFileDeletion._meta.db_table
+    }
+    deleted = 0
+    last_id = None
+    while True:
+        with transaction.atomic():
+            batch_queryset = ids_queryset.filter(pk__gt=last_id) if last_id is not None else ids_queryset
+            ids = list(batch_queryset[:batch_size])
+            if not ids:
+                break
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "INSERT INTO {pending} (file, created) "
+                    "SELECT file, now() FROM {media} WHERE record_id = ANY(%s)".format(**sql_params), [ids])
+                cursor.execute("DELETE FROM {media} WHERE record_id = ANY(%s)".format(**sql_params), [ids])
+                delete_record_links(ids)
+                remove_records_from_summary(ids)
+                cursor.execute("DELETE FROM {record} WHERE id = ANY(%s)".format(**sql_params), [ids])
+                deleted += cursor.rowcount
+            last_id = ids[-1]
+    return deleted
+
+
+def queue_file_deletions(media_queryset):
+    """
+    Queue the files of a media queryset (Media, DatasetMedia or ProjectMedia) for deletion.
+    """
+    PendingFileDeletion.objects.bulk_create(
+        PendingFileDeletion(file=file_) for file_ in media_queryset.values_list('file', flat=True) if file_
+    )
+
+
+def delete_dataset(dataset, batch_size=None):
+    """
+    Delete the records of the dataset in bulk (see delete_records) then the dataset itself.
+    The indexes of the dataset are dropped first.
+    """
+    drop_dataset_indexes(dataset)
+    delete_records(dataset.record_queryset, batch_size=batch_size)
+    with transaction.atomic():
+        queue_file_deletions(DatasetMedia.objects.filter(dataset=dataset))
+        dataset.delete()
+
+
+def delete_project(project, batch_size=None):
+    """
+    Delete the records of every dataset of the project in bulk (see delete_records) then the project itself.
+    """
+    for dataset in Dataset.objects.filter(project=project):
+        drop_dataset_indexes(dataset)
+    delete_records(Record.objects.filter(dataset__project=project), batch_size=batch_size)
+    with transaction.atomic():
+        queue_file_deletions(DatasetMedia.objects.filter(dataset__project=project))
+        queue_file_deletions(ProjectMedia.objects.filter(project=project))
+        project.delete()
+
+
+def clean_deleted_files(limit=None, storage=default_storage):
+    """
+    Remove the queued files from the storage.
+    A file is removed from the queue once deleted from the storage, so the cleanup can be stopped and resumed at any
+    time. A file that couldn't be deleted is kept in the queue for the next run.
+    :param limit: the maximum number of files to process
+    :param storage:
+    :return: (number of files deleted, number of errors)
+    """
+    deleted, errors = (0, 0)
+    queryset = PendingFileDeletion.objects.order_by('pk')
+    last_id = 0
+    while limit is None or deleted + errors < limit:
+        batch_size = DELETE_BATCH_SIZE if limit is None else min(DELETE_BATCH_SIZE, limit - deleted - errors)
+        pending_files = list(queryset.filter(pk__gt=last_id)[:batch_size])
+        if not pending_files:
+            break
+        done = []
+        for pending_file in pending_files:
+            try:
+                storage.delete(pending_file.file)
+                done.append(pending_file.pk)
+            except Exception:
+                logger.exception("Error while deleting the file {}".format(pending_file.file))
+                errors += 1
+        PendingFileDeletion.objects.filter(pk__in=done).delete()
+        deleted += len(done)
+        last_id = pending_files[-1].pk
+    return deleted, errors
@@ -1,6 +1,9 @@
 from __future__ import absolute_import, unicode_literals, print_function, division
 
-from django.http import HttpResponse
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, StreamingHttpResponse
 
 
 class CSVFileResponse(HttpResponse):
@@ -37,3 +40,45 @@ class WorkbookResponse(ExcelFileResponse):
         wb.save(self)
 
 
+class NDJSONStreamingResponse(StreamingHttpResponse):
+    """
+    Stream an iterable of objects as newline delimited json: one json document per line, sent as soon as the object
+    is produced.
+    """
+    content_type = 'application/x-ndjson'
+
+    def __init__(self, objects, status=200):
+        lines = (json.dumps(obj, cls=DjangoJSONEncoder) + '\n' for obj in objects)
+        super(NDJSONStreamingResponse, self).__init__(lines, content_type=self.content_type, status=status)
+
+
+class JSONRowsStreamingResponse(StreamingHttpResponse):
+    """
+    Stream a list of already rendered json documents (e.g. built by the database) as a json array, optionally wrapped
+    in an object (e.g. the pagination count, next and previous) under the key results_key.
+    """
+    content_type = 'application/json'
+    chunk_size = 100
+
+    def __init__(self, rows, envelope=None, results_key='results', status=200):
+        super(JSONRowsStreamingResponse, self).__init__(self.iter_chunks(rows, envelope, results_key),
+                                                        content_type=self.content_type, status=status)
+
+    @classmethod
+    def iter_chunks(cls, rows, envelope, results_key):
+        if envelope is not None:
+            prefix = json.dumps(envelope, cls=DjangoJSONEncoder)[:-1]
+            yield prefix + (', ' if envelope else '') + json.dumps(results_key) + ': ['
+        else:
+            yield '['
+        chunk = []
+        separator = ''
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= cls.chunk_size:
+                yield separator + ', '.join(chunk)
+                separator = ', '
+                chunk = []
+        if chunk:
+            yield separator + ', '.join(chunk)
+        yield ']}' if envelope is not None else ']'
@@ -0,0 +1,173 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+import hashlib
+import logging
+
+from django.db import connection
+
+from main.models import DatasetIndex, Record
+
+logger = logging.getLogger(__name__)
+
+# the postgres advisory lock held while the pending indexes are built, so two workers don't build the same index.
+BUILD_LOCK_ID = 7354201
+
+
+# the names of the indexes of the dataset fields (see get_index_name), not to be mixed with the indexes of the model
+# (e.g. main_record_ds_species_idx)
+INDEX_NAME_REGEX = '^{}_ds[0-9]+_'.format(Record._meta.db_table)
+
+
+def get_index_name(dataset, field):
+    """
+    The postgres index name of a dataset field. The field name is hashed: it can be any string and the postgres names
+    are limited to 63 characters.
+    """
+    field_hash = hashlib.md5(field.encode('utf-8')).hexdigest()[:12]
+    return '{}_ds{}_{}'.format(Record._meta.db_table, dataset.pk, field_hash)
+
+
+def _execute(sql, params=None):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def _concurrently():
+    # CREATE/DROP INDEX CONCURRENTLY can't run inside a transaction
+    return '' if connection.in_atomic_block else 'CONCURRENTLY'
+
+
+def create_index(dataset_index):
+    """
+    Build the index, CONCURRENTLY when not in a transaction so the records can still be written during the build.
+    The index is on (data -> field, id), the expression used to order by a data field, and limited to the records of
+    the dataset. A previous failed build leaves an invalid index, it is dropped first.
+    :param dataset_index: a DatasetIndex
+    :return: True if the index was built
+    """
+    name = connection.ops.quote_name(dataset_index.name)
+    try:
+        _execute('DROP INDEX {} IF EXISTS {}'.format(_concurrently(), name))
+        _execute(
+            'CREATE INDEX {concurrently} {name} ON {table} (({table}.data -> %s), id) WHERE dataset_id = %s'.format(
+                concurrently=_concurrently(),
+                name=name,
+                table=Record._meta.db_table
+            ),
+            [dataset_index.field, dataset_index.dataset_id]
+        )
+        dataset_index.status = DatasetIndex.STATUS_READY
+    except Exception:
+        if connection.in_atomic_block:
+            raise
+        logger.exception("Error while creating the index {}".format(dataset_index.name))
+        dataset_index.status = DatasetIndex.STATUS_FAILED
+    dataset_index.save(update_fields=['status'])
+    return dataset_index.status == DatasetIndex.STATUS_READY
+
+
+def drop_index(dataset_index, delete=True):
+    """
+    Drop the index (and the DatasetIndex if delete)
+    """
+    _execute('DROP INDEX {} IF EXISTS {}'.format(_concurrently(), connection.ops.quote_name(dataset_index.name)))
+    if delete:
+        dataset_index.delete()
+
+
+def add_dataset_index(dataset, field, source=DatasetIndex.SOURCE_ADMIN, build=True):
+    """
+    Register the index of a dataset field and build it if build.
+    :return: the DatasetIndex
+    """
+    dataset_index, created = DatasetIndex.objects.get_or_create(
+        dataset=dataset,
+        field=field,
+        defaults={
+            'name': get_index_name(dataset, field),
+            'source': source
+        }
+    )
+    if build and dataset_index.status != DatasetIndex.STATUS_READY:
+        create_index(dataset_index)
+    return dataset_index
+
+
+def sync_dataset_indexes(dataset, build=True):
+    """
+    Match the indexes of the dataset with its schema: the fields declared with biosys.index = true are indexed, the
+    indexes of the fields removed from the schema (or no longer declared as indexed) are dropped. The indexes added by
+    an admin are kept as long as their field is in the schema. The pending and failed indexes are (re)built.
+    If not build, only the DatasetIndex are updated: no index is built or dropped in the current process, the new
+    indexes are left pending and the removed ones orphan, for the worker (see build_pending_indexes).
+    :param dataset:
+    :param build: build and drop the indexes
+    :return: the list of DatasetIndex of the dataset
+    """
+    schema = dataset.schema
+    field_names = schema.field_names
+    indexed_field_names = schema.indexed_field_names
+    for dataset_index in DatasetIndex.objects.filter(dataset=dataset):
+        if dataset_index.field not in field_names or \
+                (dataset_index.source == DatasetIndex.SOURCE_SCHEMA and
+                 dataset_index.field not in indexed_field_names):
+            if build:
+                drop_index(dataset_index)
+            else:
+                dataset_index.delete()
+    for field in indexed_field_names:
+        add_dataset_index(dataset, field, source=DatasetIndex.SOURCE_SCHEMA, build=False)
+    if build:
+        for dataset_index in DatasetIndex.objects.filter(dataset=dataset).exclude(status=DatasetIndex.STATUS_READY):
+            create_index(dataset_index)
+    return list(DatasetIndex.objects.filter(dataset=dataset))
+
+
+def drop_dataset_indexes(dataset):
+    """
+    Drop all the indexes of the dataset. To be called when the dataset is deleted: the indexes are on the record table
+    and are not dropped with the dataset rows.
+    """
+    for dataset_index in DatasetIndex.objects.filter(dataset=dataset):
+        drop_index(dataset_index)
+
+
+def build_pending_indexes():
+    """
+    Build the pending indexes, registered by a change of a dataset schema or by an admin, and drop the orphan ones. To
+    be run outside of a transaction, by the process_upload_jobs worker, so the indexes are built concurrently without
+    blocking a request. Nothing is done if another process is already building the indexes.
+    :return: the list of DatasetIndex built (ready or failed)
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", [BUILD_LOCK_ID])
+        if not cursor.fetchone()[0]:
+            return []
+    try:
+        dataset_indexes = list(DatasetIndex.objects.filter(status=DatasetIndex.STATUS_PENDING).order_by('pk'))
+        for dataset_index in dataset_indexes:
+            create_index(dataset_index)
+        drop_orphan_indexes()
+    finally:
+        _execute("SELECT pg_advisory_unlock(%s)", [BUILD_LOCK_ID])
+    return dataset_indexes
+
+
+def drop_orphan_indexes():
+    """
+    Drop the dataset indexes without DatasetIndex, left by the datasets deleted without drop_dataset_indexes (e.g.
+    cascade delete).
+    :return: the names of the dropped indexes
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT indexname FROM pg_indexes WHERE tablename = %s AND indexname ~ %s",
+            [Record._meta.db_table, INDEX_NAME_REGEX]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    known_names = set(DatasetIndex.objects.filter(name__in=names).values_list('name', flat=True))
+    orphans = [name for name in names if name not in known_names]
+    for name in orphans:
+        _execute('DROP INDEX {} IF EXISTS {}'.format(_concurrently(), connection.ops.quote_name(name)))
+    return orphans
+
@@ -0,0 +1,90 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+from django.db import connection
+
+from main.models import Record, RecordLink
+
+# the foreign key values that don't link (see Record.parents)
+_EMPTY_KEY_VALUES = "('null'::jsonb, '\"\"'::jsonb, 'false'::jsonb, '0'::jsonb)"
+
+
+def get_fk_lookup(child_dataset):
+    """
+    The foreign key of the dataset to its parent dataset (see Dataset.get_parent_dataset)
+    :return: a tuple (parent_dataset, parent_field, child_field) or None
+    """
+    if not child_dataset.has_foreign_keys:
+        return None
+    parent_dataset = child_dataset.get_parent_dataset
+    if parent_dataset is None:
+        return None
+    parent_field, child_field = child_dataset.get_fk_lookup_fields_for_dataset(parent_dataset)
+    if not parent_field or not child_field:
+        return None
+    return parent_dataset, parent_field, child_field
+
+
+def _insert_links(cursor, parent_dataset, parent_field, child_dataset, child_field, parent_ids=None, child_ids=None):
+    """
+    Link the records of the child dataset to the records of the parent dataset with the same key value, with a single
+    INSERT ... SELECT. Optionally limited to some parent or child records.
+    """
+    sql = "INSERT INTO {link} (parent_id, child_id) " \
+          "SELECT p.id, c.id FROM {record} c JOIN {record} p ON (p.data -> %s) = (c.data -> %s) " \
+          "WHERE c.dataset_id = %s AND p.dataset_id = %s AND (c.data -> %s) NOT IN {empty}"
+    params = [parent_field, child_field, child_dataset.pk, parent_dataset.pk, child_field]
+    if parent_ids is not None:
+        sql += " AND p.id = ANY(%s)"
+        params.append(parent_ids)
+    if child_ids is not None:
+        sql += " AND c.id = ANY(%s)"
+        params.append(child_ids)
+    sql += " ON CONFLICT DO NOTHING"
+    cursor.execute(sql.format(link=RecordLink._meta.db_table, record=Record._meta.db_table, empty=_EMPTY_KEY_VALUES),
+                   params)
+
+
+def update_record_links(dataset, record_ids=None):
+    """
+    Rebuild the links of the records of the dataset, as children (foreign key of the dataset) and as parents (foreign
+    keys of the datasets referencing it). Set based: a few statements whatever the number of records.
+    To be called when records are created or updated (record_ids) and when the dataset schema, name or code changed
+    (all the records).
+    :param dataset:
+    :param record_ids: the ids of the records to update, all the records of the dataset if None.
+    """
+    if record_ids is not None:
+        record_ids = list(record_ids)
+        if not record_ids:
+            return
+    sql_params = {'link': RecordLink._meta.db_table, 'record': Record._meta.db_table}
+    records_sql = "SELECT id FROM {record} WHERE dataset_id = %s".format(**sql_params)
+    records_params = [dataset.pk]
+    if record_ids is not None:
+        records_sql += " AND id = ANY(%s)"
+        records_params.append(record_ids)
+    with connection.cursor() as cursor:
+        # as children
+        cursor.execute("DELETE FROM {link} WHERE child_id IN ({records})".format(records=records_sql, **sql_params),
+                       records_params)
+        fk_lookup = get_fk_lookup(dataset)
+        if fk_lookup is not None:
+            parent_dataset, parent_field, child_field = fk_lookup
+            _insert_links(cursor, parent_dataset, parent_field, dataset, child_field, child_ids=record_ids)
+        # as parents
+        cursor.execute("DELETE FROM {link} WHERE parent_id IN ({records})".format(records=records_sql, **sql_params),
+                       records_params)
+        for child_dataset in dataset.get_children_datasets():
+            fk_lookup = get_fk_lookup(child_dataset)
+            if fk_lookup is not None and fk_lookup[0] == dataset:
+                parent_dataset, parent_field, child_field = fk_lookup
+                _insert_links(cursor, dataset, parent_field, child_dataset, child_field, parent_ids=record_ids)
+
+
+def delete_record_links(record_ids):
+    """
+    Delete the links of the records (for the deletes in SQL, the ORM deletes the links in cascade)
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM {} WHERE child_id = ANY(%s)".format(RecordLink._meta.db_table), [record_ids])
+        cursor.execute("DELETE FROM {} WHERE parent_id = ANY(%s)".format(RecordLink._meta.db_table), [record_ids])
@@ -38,24 +38,39 @@ def search_json_field(qs, json_field_name, keys, search_param):
     return qs.extra(where=['OR '.join(where_clauses)], params=params)
 
 
-def search_json_fields(qs, field_info, search_param):
+SEARCH_MODE_FULLTEXT = 'fulltext'
+SEARCH_MODE_SUBSTRING = 'substring'
+SEARCH_MODES = [SEARCH_MODE_FULLTEXT, SEARCH_MODE_SUBSTRING]
+# the text search configuration of the record search_vector (see the migration 0021_record_search)
+SEARCH_CONFIG = 'simple'
+
+
+def search_records(qs, search_param, mode=SEARCH_MODE_FULLTEXT, rank=True):
     """
-    Search does not support searching within JSONField.
-    :param qs: queryset
-    :param field_info: dictionary with json_field_name as the key and each json_field's respective keys as the value
+    Search the records with their search document, a text of all the data values and source info maintained by the
+    database (see the migration 0021_record_search).
+    fulltext: the records containing all the words of search_param (case and word order insensitive), served by the
+    search_vector GIN index. If rank the records are ordered by relevance (ts_rank).
+    substring: the records containing search_param (case insensitive), served by the search_text trigram index.
+    :param qs: a Record queryset
     :param search_param: value to search
+    :param mode: SEARCH_MODE_FULLTEXT or SEARCH_MODE_SUBSTRING
+    :param rank: order by relevance (fulltext only). The rank is available as the search_rank attribute.
     :return: the queryset after search filters applied
     """
-    where_clauses = []
-    params = []
-
-    for json_field_name in field_info.keys():
-        for key in field_info[json_field_name]:
-            where_clauses.append(json_field_name + '->>%s ILIKE %s')
-
-            params += [key, '%' + search_param + '%']
-
-    return qs.extra(where=['OR '.join(where_clauses)], params=params)
+    table = qs.model._meta.db_table
+    if mode == SEARCH_MODE_SUBSTRING:
+        return qs.extra(where=[table + '.search_text ILIKE %s'], params=['%' + search_param + '%'])
+    if mode != SEARCH_MODE_FULLTEXT:
+        raise ValueError("Unknown search mode {}. Should be one of {}".format(mode, SEARCH_MODES))
+    query = "plainto_tsquery('{}', %s)".format(SEARCH_CONFIG)
+    qs = qs.extra(where=['{}.search_vector @@ {}'.format(table, query)], params=[search_param])
+    if rank:
+        qs = qs.extra(
+            select={'search_rank': 'ts_rank({}.search_vector, {})'.format(table, query)},
+            select_params=[search_param]
+        ).order_by('-search_rank', 'id')
+    return qs
 
 
 def order_by_json_field(qs, json_field_name, keys, ordering_param):
@@ -75,3 +90,25 @@ def order_by_json_field(qs, json_field_name, keys, ordering_param):
                 qs = qs.order_by(RawSQL(json_field_name + '->%s', (ordering_param,)))
 
     return qs
+
+
+def json_keys_sql(column):
+    """
+    The sql of the object of a jsonb column limited to some keys (the absent keys are skipped), the list of keys being
+    the single param.
+    """
+    return "(SELECT coalesce(jsonb_object_agg(key, value), '{}'::jsonb) FROM jsonb_each(" + column + ") " \
+           "WHERE key = ANY(%s))"
+
+
+def select_json_keys(qs, json_field_name, keys):
+    """
+    Load a JSONField with only some of its keys, extracted by the database: the rest of the json is not transferred.
+    :param qs: queryset
+    :param json_field_name: json field to load
+    :param keys: list of keys in json field to keep
+    :return: the queryset with the json field limited to the keys
+    """
+    column = '{}.{}'.format(qs.model._meta.db_table, json_field_name)
+    return qs.defer(json_field_name).extra(select={json_field_name: json_keys_sql(column)},
+                                           select_params=[list(keys)])
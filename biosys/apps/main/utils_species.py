@@ -47,27 +47,63 @@ All species information are in the properties field.
 from __future__ import absolute_import, unicode_literals, print_function, division
 
 import logging
+import threading
+import time
+
 import requests
 from confy import env
-
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
 from django.utils import six
 
+# TODO: remove when python3
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
 logger = logging.getLogger(__name__)
 
 
-def get_key_for_value(dict_, value, default=None):
+class SpeciesIndex(Mapping):
     """
-    A util function for dict reverse lookup.
-    Mostly used to find the species name from nameId given a species_name -> nameId dict
-    :param dict_:
-    :param value:
-    :param default:
-    :return: the key for the given value of default
+    A species_name -> name_id mapping indexed both ways.
+    It can be used in place of the species_name -> name_id dict but also provides constant time lookups of the species
+    name from a name_id and of the name_id from a case insensitive species name.
     """
-    for k, v in six.iteritems(dict_):
-        if v == value:
-            return k
-    return default
+
+    def __init__(self, name_id_by_species_name=None):
+        self._name_id_by_name = dict(name_id_by_species_name or {})
+        self._name_by_name_id = {}
+        self._name_id_by_lower_name = {}
+        for species_name, name_id in six.iteritems(self._name_id_by_name):
+            # the first species name found wins.
+            self._name_by_name_id.setdefault(name_id, species_name)
+            if species_name is not None:
+                self._name_id_by_lower_name.setdefault(species_name.lower(), name_id)
+
+    def __getitem__(self, species_name):
+        return self._name_id_by_name[species_name]
+
+    def __iter__(self):
+        return iter(self._name_id_by_name)
+
+    def __len__(self):
+        return len(self._name_id_by_name)
+
+    def get_name_id(self, species_name, default=None, case_sensitive=True):
+        if case_sensitive:
+            return self._name_id_by_name.get(species_name, default)
+        if species_name is None:
+            return default
+        return self._name_id_by_lower_name.get(species_name.lower(), default)
+
+    def get_species_name(self, name_id, default=None):
+        return self._name_by_name_id.get(name_id, default)
+
+    def has_name_id(self, name_id):
+        return name_id in self._name_by_name_id
 
 
 class HerbieError(Exception):
@@ -83,6 +119,12 @@ class SpeciesFacade(object):
     PROPERTY_SPECIES_NAME = Property('species_name')
     PROPERTY_NAME_ID = Property('name_id')
 
+    def species_index(self):
+        """
+        :return: a SpeciesIndex built from name_id_by_species_name
+        """
+        return SpeciesIndex(self.name_id_by_species_name())
+
     def name_id_by_species_name(self):
         """
         :return: a dict where key is species_name and the value is name_id
@@ -135,15 +177,6 @@ class HerbieFacade(SpeciesFacade):
             logger.warning(message)
             raise HerbieError(message)
 
-    def name_id_by_species_name(self):
-        """
-        :return: a dict where key is species_name and the value is name_id
-        """
-        species = self.get_all_species([self.PROPERTY_SPECIES_NAME, self.PROPERTY_NAME_ID])
-        return dict(
-            [(sp[self.PROPERTY_SPECIES_NAME.herbie_name], sp[self.PROPERTY_NAME_ID.herbie_name]) for sp in species]
-        )
-
     def get_all_species(self, properties=None):
         """
         :param properties: a sequence of Property, e.g [PROPERTY_SPECIES_NAME, PROPERTY_NAME_ID] or None for all
@@ -158,4 +191,97 @@ class NoSpeciesFacade(SpeciesFacade):
     def get_all_species(self, properties=None):
         return []
 
-# TODO: implement a cached version of Herbie (memory/disk or db?). Cache renewal policy?
+
+class CachedSpeciesFacade(SpeciesFacade):
+    """
+    A facade that caches the species name -> name_id mapping of an upstream facade in the Django cache (see the
+    'species' cache in the settings).
+    When the cached mapping is older than settings.SPECIES_CACHE_TTL seconds it is refreshed in a background thread
+    while the stale mapping keeps being served. If the upstream facade fails the stale mapping is served until a
+    refresh succeeds. Only the first call, with an empty cache, waits for the upstream facade.
+    """
+    upstream_facade_class = None
+    CACHE_ALIAS = 'species'
+    CACHE_KEY = 'name_id_by_species_name'
+    # refresh lock, prevent concurrent refreshes across processes.
+    REFRESH_LOCK_TIMEOUT = 10 * 60
+
+    # in-process copy of the cached index, reused as long as the cache timestamp doesn't change.
+    _local_index = None
+    _local_timestamp = None
+
+    @classmethod
+    def get_cache(cls):
+        alias = cls.CACHE_ALIAS if cls.CACHE_ALIAS in settings.CACHES else 'default'
+        return caches[alias]
+
+    @classmethod
+    def _get_key(cls, suffix):
+        return 'biosys:species:{}:{}:{}'.format(cls.__name__, cls.CACHE_KEY, suffix)
+
+    @property
+    def ttl(self):
+        return settings.SPECIES_CACHE_TTL
+
+    def name_id_by_species_name(self):
+        """
+        :return: a dict where key is species_name and the value is name_id
+        """
+        return dict(self.species_index())
+
+    def species_index(self):
+        cls = self.__class__
+        cache = self.get_cache()
+        timestamp = cache.get(self._get_key('timestamp'))
+        if timestamp is not None and timestamp == cls._local_timestamp:
+            index = cls._local_index
+        else:
+            data = cache.get(self._get_key('data')) if timestamp is not None else None
+            if data is None:
+                # nothing cached (first call or cache cleared): we have to wait for the upstream.
+                return self.refresh()
+            index = SpeciesIndex(data)
+            cls._local_index, cls._local_timestamp = index, timestamp
+        if time.time() - timestamp > self.ttl:
+            self.refresh_in_background()
+        return index
+
+    def refresh(self):
+        """
+        Fetch the mapping from the upstream facade and cache it.
+        :return: the SpeciesIndex
+        """
+        data = self.upstream_facade_class().name_id_by_species_name()
+        timestamp = time.time()
+        cache = self.get_cache()
+        cache.set(self._get_key('data'), data, None)
+        cache.set(self._get_key('timestamp'), timestamp, None)
+        index = SpeciesIndex(data)
+        cls = self.__class__
+        cls._local_index, cls._local_timestamp = index, timestamp
+        return index
+
+    def refresh_in_background(self):
+        cache = self.get_cache()
+        # only one refresh at a time.
+        if cache.add(self._get_key('lock'), True, self.REFRESH_LOCK_TIMEOUT):
+            thread = threading.Thread(target=self._background_refresh)
+            thread.daemon = True
+            thread.start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.warning("Error while refreshing the species cache. Keep using the stale species: {}".format(e))
+        finally:
+            self.get_cache().delete(self._get_key('lock'))
+            # the thread may have opened a db connection (database cache).
+            connection.close()
+
+    def get_all_species(self, properties=None):
+        return self.upstream_facade_class().get_all_species(properties)
+
+
+class CachedHerbieFacade(CachedSpeciesFacade):
+    upstream_facade_class = HerbieFacade
@@ -0,0 +1,251 @@
+from __future__ import absolute_import, unicode_literals, print_function, division
+
+from django.db import connection
+from django.db.models import Q, Sum, Min, Max
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from main.models import Dataset, DatasetSpecies, DatasetSummary, Record
+
+_SQL_PARAMS = {
+    'summary': DatasetSummary._meta.db_table,
+    'species': DatasetSpecies._meta.db_table,
+    'record': Record._meta.db_table,
+}
+
+# the aggregates of the records of a dataset, optionally limited to some records.
+_AGGREGATES_SQL = "SELECT count(*) AS record_count, ST_Extent(r.geometry) AS extent, " \
+                  "min(r.datetime) AS start_datetime, max(r.datetime) AS end_datetime, " \
+                  "count(DISTINCT r.species_name) {species_filter} AS species_count, " \
+                  "max(r.last_modified) AS last_modified " \
+                  "FROM {record} r WHERE r.dataset_id = %s {records_filter}"
+
+_REFRESH_SQL = "INSERT INTO {summary} (dataset_id, record_count, min_x, min_y, max_x, max_y, start_datetime, " \
+               "end_datetime, species_count, last_modified, is_stale, updated) " \
+               "SELECT %s, a.record_count, ST_XMin(a.extent), ST_YMin(a.extent), ST_XMax(a.extent), " \
+               "ST_YMax(a.extent), a.start_datetime, a.end_datetime, a.species_count, a.last_modified, false, now() " \
+               "FROM ({aggregates}) a " \
+               "ON CONFLICT (dataset_id) DO UPDATE SET record_count = EXCLUDED.record_count, " \
+               "min_x = EXCLUDED.min_x, min_y = EXCLUDED.min_y, max_x = EXCLUDED.max_x, max_y = EXCLUDED.max_y, " \
+               "start_datetime = EXCLUDED.start_datetime, end_datetime = EXCLUDED.end_datetime, " \
+               "species_count = EXCLUDED.species_count, " \
+               "last_modified = GREATEST({summary}.last_modified, EXCLUDED.last_modified), " \
+               "is_stale = false, updated = now()"
+
+# LEAST and GREATEST ignore the nulls.
+_ADD_SQL = "UPDATE {summary} s SET record_count = s.record_count + a.record_count, " \
+           "min_x = LEAST(s.min_x, ST_XMin(a.extent)), min_y = LEAST(s.min_y, ST_YMin(a.extent)), " \
+           "max_x = GREATEST(s.max_x, ST_XMax(a.extent)), max_y = GREATEST(s.max_y, ST_YMax(a.extent)), " \
+           "start_datetime = LEAST(s.start_datetime, a.start_datetime), " \
+           "end_datetime = GREATEST(s.end_datetime, a.end_datetime), " \
+           "species_count = s.species_count + a.species_count, " \
+           "last_modified = GREATEST(s.last_modified, a.last_modified), updated = now() " \
+           "FROM ({aggregates}) a WHERE s.dataset_id = %s"
+
+# only the species that are not in the other records of the dataset are new.
+_NEW_SPECIES_FILTER = "FILTER (WHERE NOT EXISTS (SELECT 1 FROM {record} o WHERE o.dataset_id = r.dataset_id " \
+                      "AND o.species_name = r.species_name AND o.id <> ALL(%s)))"
+
+_REMOVE_SQL = "UPDATE {summary} s SET record_count = s.record_count - d.record_count, is_stale = true, " \
+              "last_modified = now(), updated = now() " \
+              "FROM (SELECT dataset_id, count(*) AS record_count FROM {record} WHERE id = ANY(%s) " \
+              "GROUP BY dataset_id) d " \
+              "WHERE s.dataset_id = d.dataset_id"
+
+# insert the species of some records or of a dataset (condition)
+_INSERT_SPECIES_SQL = "INSERT INTO {species} AS s " \
+                      "(dataset_id, species_name, name_id, record_count, first_observation, last_observation) " \
+                      "SELECT dataset_id, species_name, max(name_id), count(*), min(datetime), max(datetime) " \
+                      "FROM {record} WHERE {condition} AND species_name IS NOT NULL " \
+                      "GROUP BY dataset_id, species_name"
+
+_ADD_SPECIES_SQL = _INSERT_SPECIES_SQL + " " \
+                   "ON CONFLICT (dataset_id, species_name) DO UPDATE SET " \
+                   "name_id = GREATEST(s.name_id, EXCLUDED.name_id), " \
+                   "record_count = s.record_count + EXCLUDED.record_count, " \
+                   "first_observation = LEAST(s.first_observation, EXCLUDED.first_observation), " \
+                   "last_observation = GREATEST(s.last_observation, EXCLUDED.last_observation)"
+
+_REMOVE_SPECIES_SQL = "UPDATE {species} s SET record_count = s.record_count - d.record_count " \
+                      "FROM (SELECT dataset_id, species_name, count(*) AS record_count FROM {record} " \
+                      "WHERE id = ANY(%s) AND species_name IS NOT NULL GROUP BY dataset_id, species_name) d " \
+                      "WHERE s.dataset_id = d.dataset_id AND s.species_name = d.species_name " \
+                      "RETURNING s.id"
+
+# the observation range of a species without the removed records, from the (dataset, species_name, datetime) index.
+_SPECIES_RANGE_SQL = "UPDATE {species} s SET " \
+                     "first_observation = (SELECT min(r.datetime) FROM {record} r WHERE r.dataset_id = s.dataset_id " \
+                     "AND r.species_name = s.species_name AND r.id <> ALL(%s)), " \
+                     "last_observation = (SELECT max(r.datetime) FROM {record} r WHERE r.dataset_id = s.dataset_id " \
+                     "AND r.species_name = s.species_name AND r.id <> ALL(%s)) " \
+                     "WHERE s.id = ANY(%s)"
+
+
+def refresh_dataset_summary(dataset):
+    """
+    Recompute the summary of the dataset from its records, with a single aggregate query.
+    :return: the DatasetSummary
+    """
+    aggregates = _AGGREGATES_SQL.format(species_filter='', records_filter='', **_SQL_PARAMS)
+    with connection.cursor() as cursor:
+        cursor.execute(_REFRESH_SQL.format(aggregates=aggregates, **_SQL_PARAMS), [dataset.pk, dataset.pk])
+    return DatasetSummary.objects.get(dataset=dataset)
+
+
+def add_records_to_summary(dataset, record_ids):
+    """
+    Add the created records to the summary and the species of the dataset: only the new records are aggregated.
+    To be called once the records are inserted, and after an update (see remove_records_from_summary).
+    The summary is computed from all the records if it doesn't exist yet.
+    :param dataset:
+    :param record_ids: the ids of the created records
+    """
+    record_ids = list(record_ids)
+    if not record_ids:
+        return
+    aggregates = _AGGREGATES_SQL.format(
+        species_filter=_NEW_SPECIES_FILTER.format(**_SQL_PARAMS),
+        records_filter='AND r.id = ANY(%s)',
+        **_SQL_PARAMS
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(_ADD_SQL.format(aggregates=aggregates, **_SQL_PARAMS),
+                       [record_ids, dataset.pk, record_ids, dataset.pk])
+        if cursor.rowcount:
+            cursor.execute(_ADD_SPECIES_SQL.format(condition='id = ANY(%s)', **_SQL_PARAMS), [record_ids])
+            return
+    refresh_dataset_summary(dataset)
+    refresh_species_summary(dataset)
+
+
+def remove_records_from_summary(record_ids):
+    """
+    Remove the records from the summaries and the species of their datasets. To be called before the records are
+    deleted, or before they are updated then added back with add_records_to_summary.
+    The record counts are decremented, the observation range of the species is recomputed from the index. The rest of
+    the dataset summary is recomputed on its next read (see get_dataset_summary).
+    """
+    record_ids = list(record_ids)
+    if not record_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(_REMOVE_SQL.format(**_SQL_PARAMS), [record_ids])
+        cursor.execute(_REMOVE_SPECIES_SQL.format(**_SQL_PARAMS), [record_ids])
+        species_ids = [row[0] for row in cursor.fetchall()]
+        if species_ids:
+            cursor.execute("DELETE FROM {species} WHERE id = ANY(%s) AND record_count <= 0".format(**_SQL_PARAMS),
+                           [species_ids])
+            cursor.execute(_SPECIES_RANGE_SQL.format(**_SQL_PARAMS), [record_ids, record_ids, species_ids])
+
+
+def refresh_species_summary(dataset):
+    """
+    Recompute the species of the dataset from its records.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM {species} WHERE dataset_id = %s".format(**_SQL_PARAMS), [dataset.pk])
+        cursor.execute(_INSERT_SPECIES_SQL.format(condition='dataset_id = %s', **_SQL_PARAMS), [dataset.pk])
+
+
+def mark_summaries_stale(dataset_ids):
+    """
+    Flag the summaries of the datasets for a recompute on the next read. To be called when records are updated.
+    """
+    DatasetSummary.objects.filter(dataset_id__in=list(dataset_ids)).update(is_stale=True,
+                                                                           last_modified=timezone.now())
+
+
+def create_missing_summaries():
+    """
+    Compute the summaries of the datasets that don't have one (e.g. created outside of the API and the admin).
+    :return: the list of the created DatasetSummary
+    """
+    return [refresh_dataset_summary(dataset) for dataset in Dataset.objects.filter(summary__isnull=True)]
+
+
+def get_record_counts(group_by):
+    """
+    The record counts read from the dataset summaries, without a scan of the record table.
+    :param group_by: a field of the dataset, e.g. 'type' or 'project'
+    :return: a dict {field value: record count}
+    """
+    rows = DatasetSummary.objects.values_list('dataset__' + group_by).annotate(Sum('record_count')).order_by()
+    return dict(rows)
+
+
+def get_estimated_count(model):
+    """
+    The number of rows of the model table estimated from the postgres planner statistics (pg_class.reltuples, updated
+    by VACUUM and ANALYZE): no scan of the table but can be off after large writes. The rows are counted if there is
+    no estimate (table never analyzed or empty).
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [model._meta.db_table])
+        row = cursor.fetchone()
+    if row is None or row[0] <= 0:
+        return model.objects.count()
+    return int(row[0])
+
+
+def get_dataset_summary(dataset):
+    """
+    The summary of the dataset, (re)computed if it is stale or doesn't exist. Use
+    Dataset.objects.select_related('summary') to read the summaries of a list of datasets without a query per dataset.
+    :return: the DatasetSummary
+    """
+    try:
+        summary = dataset.summary
+    except DatasetSummary.DoesNotExist:
+        summary = None
+    if summary is None or summary.is_stale:
+        summary = refresh_dataset_summary(dataset)
+        dataset.summary = summary
+    return summary
+
+
+def get_project_record_count(project):
+    """
+    The number of records of the project, summed from the record counts of its dataset summaries with a single
+    aggregate query (the record counts are always up to date). See also ProjectViewSet for a list of projects.
+    """
+    return DatasetSummary.objects.filter(dataset__project=project).aggregate(
+        record_count=Coalesce(Sum('record_count'), 0)
+    )['record_count']
+
+
+def get_project_summary(project):
+    """
+    The summaries of the datasets of the project rolled up, the distinct species from the species of the datasets.
+    :return: a dict {record_count, extent, start_datetime, end_datetime, species_count, last_modified}
+    """
+    datasets = Dataset.objects.filter(project=project).filter(Q(summary__isnull=True) | Q(summary__is_stale=True))
+    for dataset in datasets:
+        refresh_dataset_summary(dataset)
+    result = DatasetSummary.objects.filter(dataset__project=project).aggregate(
+        record_count=Coalesce(Sum('record_count'), 0),
+        min_x=Min('min_x'),
+        min_y=Min('min_y'),
+        max_x=Max('max_x'),
+        max_y=Max('max_y'),
+        start_datetime=Min('start_datetime'),
+        end_datetime=Max('end_datetime'),
+        last_modified=Max('last_modified')
+    )
+    extent = tuple(result.pop(key) for key in ['min_x', 'min_y', 'max_x', 'max_y'])
+    result['extent'] = extent if extent[0] is not None else None
+    result['species_count'] = DatasetSpecies.objects.filter(dataset__project=project) \
+        .order_by().values('species_name').distinct().count()
+    return result
+
+
+def rebuild_summaries(datasets=None):
+    """
+    Recompute the summaries and the species of the datasets (all by default).
+    :return: the list of DatasetSummary
+    """
+    datasets = datasets if datasets is not None else Dataset.objects.order_by('pk')
+    summaries = []
+    for dataset in datasets:
+        refresh_species_summary(dataset)
+        summaries.append(refresh_dataset_summary(dataset))
+    return summaries
@@ -220,6 +220,13 @@ MEDIA_ROOT = env('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
 # URL that handles the media served from MEDIA_ROOT. Make sure to use a
 # trailing slash.
 MEDIA_URL = '/media/'
+# Absolute filesystem path to the directory that will hold the files of the asynchronous upload jobs.
+# Always on the local filesystem: it must be shared by the web server and the process_upload_jobs worker.
+UPLOAD_JOBS_ROOT = env('UPLOAD_JOBS_ROOT', os.path.join(BASE_DIR, 'upload_jobs'))
+# Seconds between two heartbeats of a running upload job. A running job without heartbeat for UPLOAD_JOB_TIMEOUT
+# seconds is marked as failed (its worker crashed or was killed).
+UPLOAD_JOB_HEARTBEAT_INTERVAL = env('UPLOAD_JOB_HEARTBEAT_INTERVAL', 60)
+UPLOAD_JOB_TIMEOUT = env('UPLOAD_JOB_TIMEOUT', 10 * 60)
 
 # Additional locations of static files
 STATICFILES_DIRS = (
@@ -248,7 +255,28 @@ BOOTSTRAP3 = {
 # The class that should provide a mapping between the species scientific name and the species name_id.
 # To use the WA Herbarium web service set SPECIES_FACADE_CLASS='main.utils_species.HerbieFacade'
 # in the environment file.
+# To use a cached version of the WA Herbarium web service set
+# SPECIES_FACADE_CLASS='main.utils_species.CachedHerbieFacade'
 SPECIES_FACADE_CLASS = env('SPECIES_FACADE_CLASS', None)
+# Time in seconds after which the cached species are refreshed (in background) by the CachedHerbieFacade.
+SPECIES_CACHE_TTL = env('SPECIES_CACHE_TTL', 24 * 60 * 60)
+
+# Maximum number of dataset schema objects cached by each worker process (see main.models.Dataset.schema).
+SCHEMA_CACHE_SIZE = env('SCHEMA_CACHE_SIZE', 128)
+
+# Caches
+# The 'species' cache is used by the CachedHerbieFacade and must be shared by all the worker processes.
+CACHES = {
+    'default': {
+        'BACKEND': env('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': env('CACHE_LOCATION', ''),
+    },
+    'species': {
+        'BACKEND': env('SPECIES_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': env('SPECIES_CACHE_LOCATION', os.path.join(BASE_DIR, 'cache', 'species')),
+        'TIMEOUT': None,
+    }
+}
 
 # Logging settings
 # Ensure that the logs directory exists: